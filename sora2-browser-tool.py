@@ -22,39 +22,37 @@ def _check_dependencies():
             print("[Deps] Error:", e)
             traceback.print_exc()
 
-try:
-    _check_dependencies()
-except Exception:
-    pass
-
-import os, sys, re, json, tempfile, random, mimetypes, pathlib, webbrowser
-import urllib.request
-from urllib.parse import urlparse
+import os, sys, re, json, random
 
-from PyQt6.QtCore import Qt, QUrl, QSize, QProcess
-from PyQt6.QtWidgets import (QTextEdit,
-    QApplication, QMainWindow, QSplitter, QWidget, QVBoxLayout, QHBoxLayout,
-    QListWidget, QListWidgetItem, QPushButton, QLineEdit, QComboBox, QLabel,
-    QMessageBox, QInputDialog, QTabWidget, QCheckBox, QCompleter, QFileDialog,
-    QSizePolicy, QWidgetAction
-)
-from PyQt6.QtWebEngineCore import QWebEngineSettings, QWebEngineProfile, QWebEnginePage
-from PyQt6.QtWebEngineWidgets import QWebEngineView
-from PyQt6.QtGui import QDesktopServices
+# User-facing notices from the pure helpers below. The GUI routes these to
+# QMessageBox (see _qt_notify); the headless CLI prints them to stderr.
+_notify_hook = None
 
-# Cloudflare/Turnstile compatibility flags (GPU + third-party cookies)
-# Must be set before QtWebEngine starts
-os.environ.setdefault(
-    "QTWEBENGINE_CHROMIUM_FLAGS",
-    "--enable-gpu --ignore-gpu-blocklist --enable-webgl --enable-accelerated-video-decode "
-    "--disable-features=BlockThirdPartyCookies,ThirdPartyStoragePartitioning"
-)
+def _notify(level, title, message):
+    if _notify_hook is not None:
+        try:
+            _notify_hook(level, title, message)
+            return
+        except Exception:
+            pass
+    print(f"[{title}] {message}", file=sys.stderr)
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "sora2_config.json")
 USER_SITES_PATH = os.path.join(os.path.dirname(__file__), "sora2_user_sites.json")
 USER_PROMPTS_PATH = os.path.join(os.path.dirname(__file__), "sora2_user_prompts.json")
+PROMPT_JOURNAL_PATH = os.path.join(os.path.dirname(__file__), "sora2_user_prompts.journal")  # see PromptJournal
 USER_CHARACTERS_PATH = os.path.join(os.path.dirname(__file__), "sora2_user_characters.json")
 USER_MAIL_SITES_PATH = os.path.join(os.path.dirname(__file__), "sora2_user_mail_sites.json")
+ANALYTICS_PATH = os.path.join(os.path.dirname(__file__), "sora2_analytics.db")
+HISTORY_DB_PATH = os.path.join(os.path.dirname(__file__), "sora2_history.db")  # prompt versions (PromptHistory)
+PLACEHOLDERS_PATH = os.path.join(os.path.dirname(__file__), "sora2_placeholders.json")  # filled slots (PlaceholderStore)
+SESSION_PATH = os.path.join(os.path.dirname(__file__), "sora2_session.json")
+PERF_PATH = os.path.join(os.path.dirname(__file__), "sora2_perf.json")
+BLOCKLIST_PATH = os.path.join(os.path.dirname(__file__), "sora2_blocklist.txt")  # optional hosts/ABP list
+ASSET_CACHE_DIR = os.path.join(os.path.dirname(__file__), "sora2_asset_cache")
+DEFAULTS_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "sora2_defaults_snapshot.json")
+UPDATE_STATE_PATH = os.path.join(os.path.dirname(__file__), "sora2_update_state.json")  # manifest ETag + cache
+UPDATE_BASE_URL = "https://raw.githubusercontent.com/esc0rtd3w/sora2-browser-tool/refs/heads/main/"
 
 
 DEFAULT_CHROME_UA = (
@@ -201,7 +199,7 @@ MAIL_SITE_DEFAULTS = []
 PROMPT_DEFAULTS = []
 def load_config():
     if not os.path.exists(CONFIG_PATH):
-        QMessageBox.warning(None, "Config", f"Config not found at {CONFIG_PATH}. Using defaults.")
+        _notify("warning", "Config", f"Config not found at {CONFIG_PATH}. Using defaults.")
         return {
             "version": "1.2.9",
             "window": {"width": 1920,"height": 1080,"orientation":"horizontal","user_agent":"Default (Engine)","mail_url":"https://www.guerrillamail.com/inbox","window_title":"Sora 2 Browser Tool"},
@@ -234,8 +232,34 @@ def save_config(cfg):
 
         with open(CONFIG_PATH, "w", encoding="utf-8") as f:
             json.dump(existing, f, indent=2, ensure_ascii=False)
+        note_own_write(CONFIG_PATH)
     except Exception as e:
-        QMessageBox.critical(None, "Config Save Error", str(e))
+        _notify("critical", "Config Save Error", str(e))
+
+# The app's own writes to the hot-reloaded files, by stat signature: the watcher
+# skips a change whose (size, mtime) is the one this process left behind.
+_OWN_WRITES = {}
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns)
+    except OSError:
+        return None
+
+def note_own_write(path):
+    _OWN_WRITES[os.path.abspath(path)] = file_signature(path)
+
+def is_own_write(path):
+    sig = file_signature(path)
+    return sig is not None and _OWN_WRITES.get(os.path.abspath(path)) == sig
+
+def read_user_list(path, key):
+    # The list in a user file ({key: [...]} or a bare list); raises on unreadable or partial JSON
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = data.get(key, []) if isinstance(data, dict) else data
+    return items if isinstance(items, list) else []
 
 def load_or_init_user_sites(default_sites):
     # Load user sites from USER_SITES_PATH; if missing, seed with defaults and write file.
@@ -248,6 +272,7 @@ def load_or_init_user_sites(default_sites):
             sites = list(default_sites)
             with open(USER_SITES_PATH, "w", encoding="utf-8") as f:
                 json.dump({"sites": sites}, f, indent=2, ensure_ascii=False)
+            note_own_write(USER_SITES_PATH)
         return sites
     except Exception:
         return list(default_sites)
@@ -256,6 +281,7 @@ def save_user_sites(sites):
     try:
         with open(USER_SITES_PATH, "w", encoding="utf-8") as f:
             json.dump({"sites": sites}, f, indent=2, ensure_ascii=False)
+        note_own_write(USER_SITES_PATH)
         return True
     except Exception:
         return False
@@ -276,6 +302,7 @@ def load_or_init_user_mail_sites(default_mail_sites):
             sites = list(default_mail_sites)
             with open(USER_MAIL_SITES_PATH, "w", encoding="utf-8") as f:
                 json.dump({"mail_sites": sites}, f, indent=2, ensure_ascii=False)
+            note_own_write(USER_MAIL_SITES_PATH)
         if not isinstance(sites, list):
             sites = list(default_mail_sites)
         return sites
@@ -286,6 +313,7 @@ def save_user_mail_sites(sites):
     try:
         with open(USER_MAIL_SITES_PATH, "w", encoding="utf-8") as f:
             json.dump({"mail_sites": sites}, f, indent=2, ensure_ascii=False)
+        note_own_write(USER_MAIL_SITES_PATH)
         return True
     except Exception:
         return False
@@ -308,20 +336,47 @@ def load_or_init_user_prompts(default_prompts):
             prompts = list(default_prompts)
         with open(USER_PROMPTS_PATH, "w", encoding="utf-8") as f:
             json.dump({"prompts": prompts}, f, indent=2, ensure_ascii=False)
+        note_own_write(USER_PROMPTS_PATH)
         return prompts
     except Exception:
         return list(default_prompts)
 
 def save_user_prompts(prompts):
+    # Streamed, one prompt per line, atomic (see write_records). A full write contains
+    # every journaled op, so the journal's base moves up to it.
     try:
-        with open(USER_PROMPTS_PATH, "w", encoding="utf-8") as f:
-            json.dump({"prompts": prompts}, f, indent=2, ensure_ascii=False)
+        if write_records(USER_PROMPTS_PATH, "prompts", prompts, "json") is None:
+            return False
+        if os.path.exists(PROMPT_JOURNAL_PATH):
+            PromptJournal(PROMPT_JOURNAL_PATH).rebase()
         return True
     except Exception:
         return False
 
 
 # Prompt helpers
+def load_session(path=SESSION_PATH):
+    # Last saved tab session ({"tabs": [...], "active": i, "mail_url": ...}) or None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get("tabs"), list):
+            return data
+    except Exception:
+        pass
+    return None
+
+def save_session(data, path=SESSION_PATH):
+    # Atomic replace so a crash mid-write never leaves a truncated session
+    try:
+        tmp = path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        return False
+
 def _p_to_obj(p, idx=0):
     if isinstance(p, dict):
         text = str(p.get("text") or p.get("prompt") or "").strip()
@@ -338,6 +393,444 @@ def _p_to_obj(p, idx=0):
 def _normalize_prompts_list(prompts):
     return [_p_to_obj(p, i) for i, p in enumerate(prompts or [])]
 
+def prompt_content_hash(obj):
+    # SHA-1 of "title|text" (the historical placeholder-cache key for id-less prompts)
+    import hashlib
+    return hashlib.sha1(((obj.get("title") or "") + "|" + (obj.get("text") or "")).encode("utf-8")).hexdigest()
+
+class PromptRepository:
+    # Prompt library keyed by stable id. Legacy string prompts and missing or duplicate
+    # ids are migrated to objects with fresh ids once at load (self.migrated tells the
+    # caller to persist); lookup, edit and remove are dict operations after that.
+    # List positions (index_of) come from an index built on first use: slots in dict
+    # order with holes for removed ids and a Fenwick tree of live slots, so add, remove
+    # and index_of stay O(log n); insert and replace_all drop it.
+    def __init__(self, prompts=None):
+        self._by_id = {}
+        self._hash = {}
+        self._slots = None  # position index: slot -> id (None = removed), built lazily
+        self._seq = 1
+        self.migrated = False
+        self.replace_all(prompts or [])
+
+    def _bump_seq(self, pid):
+        m = re.match(r"^u(\d+)$", pid or "")
+        if m:
+            self._seq = max(self._seq, int(m.group(1)) + 1)
+
+    def next_id(self):
+        while True:
+            pid = f"u{self._seq:04d}"
+            self._seq += 1
+            if pid not in self._by_id:
+                return pid
+
+    def _coerce(self, p):
+        obj = _p_to_obj(p)
+        if isinstance(p, dict):
+            for k, v in p.items():
+                if k not in obj and k != "prompt":
+                    obj[k] = v
+            if not p.get("id"):
+                obj["id"] = None
+        else:
+            obj["id"] = None
+        return obj
+
+    def replace_all(self, prompts):
+        self._by_id = {}
+        self._hash = {}
+        self._slots = None
+        self.migrated = False
+        objs = [self._coerce(p) for p in prompts or []]
+        for o in objs:
+            if o["id"]:
+                self._bump_seq(str(o["id"]))
+        for p, o in zip(prompts or [], objs):
+            pid = o["id"]
+            if not pid or pid in self._by_id:
+                o["id"] = self.next_id()
+                self.migrated = True
+            elif not isinstance(p, dict):
+                self.migrated = True
+            self._by_id[o["id"]] = o
+            self._hash[o["id"]] = prompt_content_hash(o)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, pid):
+        return pid in self._by_id
+
+    def get(self, pid):
+        return self._by_id.get(pid)
+
+    def content_hash(self, pid):
+        return self._hash.get(pid)
+
+    def to_list(self):
+        return list(self._by_id.values())
+
+    def add(self, p):
+        o = self._coerce(p)
+        if not o["id"] or o["id"] in self._by_id:
+            o["id"] = self.next_id()
+        else:
+            self._bump_seq(str(o["id"]))
+        self._by_id[o["id"]] = o
+        self._hash[o["id"]] = prompt_content_hash(o)
+        if self._slots is not None:
+            self._slots.append(o["id"])
+            self._slot_of[o["id"]] = i = len(self._slots)
+            # New Fenwick node covers (i - lowbit(i), i]: this slot plus the live ones before it
+            self._tree.append(1 + self._live_upto(i - 1) - self._live_upto(i - (i & -i)))
+        return o
+
+    def update(self, pid, **fields):
+        o = self._by_id.get(pid)
+        if o is None:
+            return None
+        o.update(fields)
+        self._hash[pid] = prompt_content_hash(o)
+        return o
+
+    def remove(self, pid):
+        self._hash.pop(pid, None)
+        if self._slots is not None and pid in self._slot_of:
+            i = self._slot_of.pop(pid)
+            self._slots[i - 1] = None
+            while i < len(self._tree):
+                self._tree[i] -= 1
+                i += i & -i
+            if len(self._slots) > 2 * len(self._slot_of) + 64:
+                self._slots = None  # mostly holes: rebuild on next use
+        return self._by_id.pop(pid, None)
+
+    def _live_upto(self, i):
+        # Live slots among 1..i
+        n = 0
+        while i > 0:
+            n += self._tree[i]
+            i -= i & -i
+        return n
+
+    def index_of(self, pid):
+        if pid not in self._by_id:
+            return None
+        if self._slots is None:
+            self._slots = list(self._by_id)
+            self._slot_of = {k: i for i, k in enumerate(self._slots, 1)}
+            tree = [0] + [1] * len(self._slots)
+            for i in range(1, len(tree)):
+                j = i + (i & -i)
+                if j < len(tree):
+                    tree[j] += tree[i]
+            self._tree = tree
+        return self._live_upto(self._slot_of[pid]) - 1
+
+    def insert(self, p, index):
+        # add() at a list position (undo of a remove); O(n), so not for bulk use
+        o = self.add(p)
+        items = list(self._by_id.items())
+        last = items.pop()
+        items.insert(max(0, min(int(index), len(items))), last)
+        self._by_id = dict(items)
+        self._slots = None
+        return o
+
+class PromptJournal:
+    # Append-only log of prompt changes beside the snapshot (sora2_user_prompts.json).
+    # Line 1 is a header {"base": seq}: the last op already contained in the snapshot.
+    # Every other line is one op {"seq", "t", "batch", "op", "id", "pos", "before", "after"}
+    # with full item images, so an op can be replayed (load) or inverted (undo, restore
+    # to time). A change costs one appended line; the snapshot is only rewritten when
+    # COMPACT_AFTER ops are pending (and on exit), keeping at most KEEP_HISTORY ops and
+    # KEEP_BYTES of them (whole batches, newest first) as history.
+    COMPACT_AFTER = 200
+    KEEP_HISTORY = 2000
+    KEEP_BYTES = 16 * 1024 * 1024
+    RESET_MAX_ITEMS = 5000  # bigger bulk replaces are logged without images (a barrier for undo)
+
+    def __init__(self, path):
+        self.path = path
+        self.load()
+
+    def load(self):
+        self.base = self.seq = self.batch = 0
+        self.records = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    if not isinstance(rec, dict):
+                        continue
+                    if "base" in rec and "op" not in rec:
+                        self.base = int(rec["base"])
+                    elif rec.get("op") in ("add", "edit", "remove", "reset"):
+                        self.records.append(rec)
+                        self.seq = max(self.seq, int(rec.get("seq", 0)))
+                        self.batch = max(self.batch, int(rec.get("batch", 0)))
+        except (OSError, ValueError, TypeError):
+            pass
+        self.seq = max(self.seq, self.base)
+        return self
+
+    def pending(self):
+        return [r for r in self.records if r["seq"] > self.base]
+
+    def replay(self, repo):
+        # Apply ops newer than the snapshot to a freshly loaded repository
+        ops = self.pending()
+        for r in ops:
+            apply_prompt_op(repo, r)
+        return len(ops)
+
+    def append(self, ops):
+        # Log one batch (one undo step); returns the stamped records
+        import time
+        if not ops:
+            return []
+        self.batch += 1
+        now = round(time.time(), 3)
+        out = []
+        for op in ops:
+            self.seq += 1
+            rec = {"seq": self.seq, "t": now, "batch": self.batch}
+            rec.update((k, v) for k, v in op.items() if v is not None)
+            out.append(rec)
+        new = not os.path.exists(self.path)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if new:
+                f.write(json.dumps({"base": self.base}) + "\n")
+            for rec in out:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.records.extend(out)
+        return out
+
+    def rebase(self):
+        # The snapshot now holds every logged op: move the base and trim the history
+        self.base = self.seq
+        hist = self.history()[-self.KEEP_HISTORY:]
+        # Size cap: whole batches back from the newest; the newest one is always kept, so
+        # reset ops with thousands of images can't make every compaction rewrite megabytes
+        chunks = []
+        size = 0
+        i = len(hist)
+        while i > 0:
+            j = i - 1
+            while j > 0 and hist[j - 1].get("batch") == hist[i - 1].get("batch"):
+                j -= 1
+            lines = [json.dumps(rec, ensure_ascii=False) for rec in hist[j:i]]
+            size += sum(len(x) for x in lines)
+            if chunks and size > self.KEEP_BYTES:
+                break
+            chunks.append(lines)
+            i = j
+        keep = hist[i:]
+        tmp = self.path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"base": self.base}) + "\n")
+            for lines in reversed(chunks):
+                for line in lines:
+                    f.write(line + "\n")
+        os.replace(tmp, self.path)
+        self.records = keep
+
+    def history(self):
+        # Ops that can still be inverted: everything after the last image-less bulk replace
+        for i in range(len(self.records) - 1, -1, -1):
+            r = self.records[i]
+            if r["op"] == "reset" and "before" not in r:
+                return self.records[i + 1:]
+        return list(self.records)
+
+    @classmethod
+    def reset_op(cls, before, after):
+        if max(len(before), len(after)) > cls.RESET_MAX_ITEMS:
+            return {"op": "reset", "count": len(after)}
+        return {"op": "reset", "before": before, "after": after}
+
+def prompt_op_inverse(rec):
+    op = {"add": "remove", "remove": "add"}.get(rec["op"], rec["op"])
+    return {"op": op, "id": rec.get("id"), "pos": rec.get("pos"), "before": rec.get("after"), "after": rec.get("before")}
+
+def apply_prompt_op(repo, rec):
+    op, pid = rec["op"], rec.get("id")
+    if op == "remove":
+        repo.remove(pid)
+    elif op == "reset":
+        if "after" in rec:
+            repo.replace_all([dict(o) for o in rec["after"]])
+    elif pid in repo:
+        repo.update(pid, **rec["after"])
+    elif rec.get("pos") is not None:
+        repo.insert(dict(rec["after"]), rec["pos"])
+    else:
+        repo.add(dict(rec["after"]))
+
+def prompt_state_before(items, records):
+    # The library as it was before records[0] (records: a tail of the journal history)
+    repo = PromptRepository([dict(o) for o in items])
+    for r in reversed(records):
+        if r["op"] == "reset" and "before" not in r:
+            raise ValueError("history is cut by a large bulk replace")
+        apply_prompt_op(repo, prompt_op_inverse(r))
+    return repo.to_list()
+
+def prompt_diff_ops(items, target):
+    # Minimal add/edit/remove ops turning items into target (removes back to front, then
+    # edits, then adds at their target positions so the order comes out right too)
+    cur = {o.get("id"): (i, o) for i, o in enumerate(items)}
+    want = {o.get("id"): o for o in target}
+    ops = [{"op": "remove", "id": o.get("id"), "pos": i, "before": o}
+           for i, o in reversed(list(enumerate(items))) if o.get("id") not in want]
+    for pid, o in want.items():
+        if pid in cur and cur[pid][1] != o:
+            ops.append({"op": "edit", "id": pid, "before": cur[pid][1], "after": o})
+    ops += [{"op": "add", "id": o.get("id"), "pos": i, "after": o}
+            for i, o in enumerate(target) if o.get("id") not in cur]
+    return ops
+
+class PromptHistory:
+    # Per-prompt version history in SQLite. Texts live once in a content-addressed blob
+    # table (sha1 -> zlib text), so repeated or reverted variants add only a version row.
+    # The current text stays in PromptRepository; this store is only read for the
+    # versions view. Version rows also keep the manual "" fills that went with that text.
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS versions ("
+        " id INTEGER PRIMARY KEY, pid TEXT NOT NULL, ts REAL NOT NULL, hash TEXT NOT NULL,"
+        " title TEXT, fills TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_versions_pid ON versions(pid, id)",
+    )
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for stmt in self.SCHEMA:
+                self.conn.execute(stmt)
+
+    @staticmethod
+    def text_hash(text):
+        import hashlib
+        return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+    def _latest(self, pid):
+        return self.conn.execute("SELECT id, hash FROM versions WHERE pid=? ORDER BY id DESC LIMIT 1",
+                                 (pid,)).fetchone()
+
+    def record(self, pid, text, title="", fills=None, before=None):
+        # Store a new version unless it equals the latest; `before` seeds the first version
+        # of a prompt edited for the first time. Returns the new version id or None.
+        import time, zlib
+        if not pid:
+            return None
+        with self.conn:
+            latest = self._latest(pid)
+            rows = []
+            if latest is None and before is not None and (before.get("text") or "") != (text or ""):
+                rows.append((before.get("text") or "", before.get("title") or ""))
+            h = self.text_hash(text)
+            if latest is not None and latest[1] == h:
+                return None
+            rows.append((text or "", title or ""))
+            vid = None
+            for t, ti in rows:
+                th = self.text_hash(t)
+                self.conn.execute("INSERT OR IGNORE INTO blobs(hash, data) VALUES (?, ?)",
+                                  (th, zlib.compress(t.encode("utf-8"), 6)))
+                vid = self.conn.execute("INSERT INTO versions(pid, ts, hash, title, fills) VALUES (?,?,?,?,?)",
+                                        (pid, time.time(), th, ti, json.dumps(fills) if fills else None)).lastrowid
+            return vid
+
+    def set_fills(self, pid, text, fills):
+        # Attach manual "" fills to the newest version of pid that has this text
+        with self.conn:
+            self.conn.execute("UPDATE versions SET fills=? WHERE id=(SELECT MAX(id) FROM versions WHERE pid=? AND hash=?)",
+                              (json.dumps(fills) if fills else None, pid, self.text_hash(text)))
+
+    def versions(self, pid):
+        # Newest first: [{id, ts, hash, title, fills}]
+        cur = self.conn.execute("SELECT id, ts, hash, title, fills FROM versions WHERE pid=? ORDER BY id DESC", (pid,))
+        return [{"id": i, "ts": ts, "hash": h, "title": ti or "", "fills": json.loads(f) if f else []}
+                for i, ts, h, ti, f in cur]
+
+    def text(self, h):
+        import zlib
+        row = self.conn.execute("SELECT data FROM blobs WHERE hash=?", (h,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def stats(self):
+        v = self.conn.execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+        b, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        return {"versions": v, "blobs": b, "bytes": size}
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+def _diff_tokens(s):
+    return re.findall(r"\s+|\w+|[^\w\s]", s or "")
+
+def _diff_opcodes(a, b):
+    # SequenceMatcher opcodes with the common head/tail peeled off first, so a local edit
+    # in a long prompt only matches the changed middle
+    import difflib
+    n = min(len(a), len(b))
+    p = 0
+    while p < n and a[p] == b[p]:
+        p += 1
+    q = 0
+    while q < n - p and a[-1 - q] == b[-1 - q]:
+        q += 1
+    ops = [("equal", 0, p, 0, p)] if p else []
+    mid = difflib.SequenceMatcher(None, a[p:len(a) - q], b[p:len(b) - q]).get_opcodes()
+    ops += [(t, i1 + p, i2 + p, j1 + p, j2 + p) for t, i1, i2, j1, j2 in mid if i1 != i2 or j1 != j2]
+    if q:
+        ops.append(("equal", len(a) - q, len(a), len(b) - q, len(b)))
+    return ops
+
+def word_diff(a, b):
+    # Line diff first, then a word diff inside changed line blocks (keeps SequenceMatcher
+    # inputs small). Returns [(tag, a_text, b_text)] with tag equal/delete/insert/replace.
+    al, bl = (a or "").splitlines(True), (b or "").splitlines(True)
+    out = []
+    for tag, i1, i2, j1, j2 in _diff_opcodes(al, bl):
+        if tag != "replace":
+            out.append((tag, "".join(al[i1:i2]), "".join(bl[j1:j2])))
+            continue
+        aw, bw = _diff_tokens("".join(al[i1:i2])), _diff_tokens("".join(bl[j1:j2]))
+        for t, x1, x2, y1, y2 in _diff_opcodes(aw, bw):
+            out.append((t, "".join(aw[x1:x2]), "".join(bw[y1:y2])))
+    return out
+
+def diff_html(a, b):
+    # Side-by-side HTML for word_diff(): removals marked on the left, additions on the right
+    import html
+    esc = lambda s: html.escape(s).replace("\n", "<br>")
+    left, right = [], []
+    for tag, x, y in word_diff(a, b):
+        if tag == "equal":
+            left.append(esc(x)); right.append(esc(y))
+            continue
+        if x:
+            left.append(f'<span style="background:#f8c4c4;text-decoration:line-through">{esc(x)}</span>')
+        if y:
+            right.append(f'<span style="background:#c6efc6">{esc(y)}</span>')
+    return "".join(left), "".join(right)
+
 def _extract_categories(objs):
     seen = set(); cats = []
     for o in objs:
@@ -346,41 +839,2924 @@ def _extract_categories(objs):
             seen.add(c); cats.append(c)
     return cats
 
-def _normalize_characters_cfg_list(chars):
-    objs = []
-    for c in chars or []:
-        if isinstance(c, dict):
-            name = (" ".join(str(c.get("name", "")).split())).strip()
-            cat = (" ".join(str(c.get("category", "Base")).split())).strip() or "Base"
-        else:
-            name = (" ".join(str(c).split())).strip()
-            cat = "Base"
-        if not name:
-            continue
-        objs.append({"name": name, "category": cat})
-    # dedupe by lowercased name, keep first
-    seen = set()
-    result = []
-    for o in objs:
-        key = o["name"].lower()
-        if key in seen:
-            continue
-        seen.add(key)
-        result.append(o)
-    return result
+def sanitize_character_name(name: str) -> str:
+    s = re.sub(r"[^A-Za-z0-9 '\-]", "", str(name))
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+def _squash_ws(s):
+    return " ".join(str(s).split())
+
+_TAG_QUERY_OPS = {"and": "&", "&": "&", "&&": "&", "or": "|", "|": "|", "||": "|", "not": "!", "!": "!", "-": "!"}
+
+def parse_tag_query(text, known=()):
+    # "Animals AND Cartoon", "not Musicians", "(A | B) -C" -> nested tuples:
+    # ("tag", key) | ("not", x) | ("and", x, y) | ("or", x, y); None for a blank query.
+    # Adjacent terms AND together; runs of bare words are split greedily into the
+    # longest known (multi-word) tags, so "TV Shows Animals" needs no quotes.
+    known = {k.casefold() for k in known}
+    longest = max((k.count(" ") + 1 for k in known), default=1)
+    toks = []
+    for m in re.finditer(r'"([^"]*)"|(&&|\|\||[()&|!-])|([^\s()&|!"]+)', text or ""):
+        quoted, op, word = m.groups()
+        if quoted is not None:
+            toks.append(("tag", _squash_ws(quoted).casefold()))
+        elif op:
+            toks.append(("op", "(" if op == "(" else ")" if op == ")" else _TAG_QUERY_OPS[op]))
+        elif word.casefold() in ("and", "or", "not"):
+            toks.append(("op", _TAG_QUERY_OPS[word.casefold()]))
+        elif toks and toks[-1][0] == "word":
+            toks[-1] = ("word", toks[-1][1] + [word])
+        else:
+            toks.append(("word", [word]))
+    flat = []
+    for kind, val in toks:
+        if kind != "word":
+            flat.append((kind, val))
+            continue
+        i = 0
+        while i < len(val):
+            for n in range(min(longest, len(val) - i), 0, -1):
+                tag = " ".join(val[i:i + n]).casefold()
+                if n == 1 or tag in known:
+                    flat.append(("tag", tag)); i += n
+                    break
+    pos = 0
+
+    def peek():
+        return flat[pos] if pos < len(flat) else (None, None)
+
+    def expr():
+        nonlocal pos
+        node = term()
+        while peek() == ("op", "|"):
+            pos += 1
+            node = ("or", node, term())
+        return node
+
+    def term():
+        nonlocal pos
+        node = factor()
+        while True:
+            kind, val = peek()
+            if (kind, val) == ("op", "&"):
+                pos += 1
+            elif not (kind == "tag" or val in ("!", "(")):
+                return node
+            node = ("and", node, factor())
+
+    def factor():
+        nonlocal pos
+        kind, val = peek()
+        pos += 1
+        if kind == "tag":
+            return ("tag", val)
+        if val == "!":
+            return ("not", factor())
+        if val == "(":
+            node = expr()
+            if peek() != ("op", ")"):
+                raise ValueError("missing )")
+            pos += 1
+            return node
+        raise ValueError("unexpected " + (repr(val) if val else "end of query"))
+
+    if not flat:
+        return None
+    node = expr()
+    if pos != len(flat):
+        raise ValueError(f"unexpected {flat[pos][1]!r}")
+    return node
+
+class CharacterRepository:
+    # Ordered character names with one casefold index and a category -> names index.
+    # Entries are plain names or {name, category, tags} dicts; a name without its own
+    # category/tags takes the ones from the config defs (casefold match), else "Base".
+    # First spelling wins. Every category and extra tag also gets an int bitset over
+    # the name positions (built lazily), so tag queries and facet counts are bitwise ops.
+    def __init__(self, defs=(), entries=None, clean=None):
+        self._defs = {}  # casefold -> (name, category, tags) from config
+        for name, cat, tags in self._parse(defs, None):
+            self._defs.setdefault(name.casefold(), (name, cat or "Base", tags or ()))
+        self.replace(list(self._defs.values()) if entries is None else entries, clean)
+
+    @staticmethod
+    def _parse(entries, clean):
+        # -> (name, category or None, tags tuple or None) per non-blank entry;
+        # category/tag strings are squashed once per distinct value
+        cats = {}
+
+        def norm(c):
+            v = cats.get(c)
+            if v is None:
+                v = cats[c] = _squash_ws(c)
+            return v
+
+        for raw in entries or ():
+            tags = None
+            if isinstance(raw, str):
+                name, cat = raw, None
+            elif isinstance(raw, dict):
+                name, cat, tags = raw.get("name", ""), raw.get("category"), raw.get("tags")
+            elif isinstance(raw, (list, tuple)) and raw:
+                name, cat = raw[0], (raw[1] if len(raw) > 1 else None)
+                tags = raw[2] if len(raw) > 2 else None
+            else:
+                continue
+            name = clean(name) if clean else " ".join(str(name).split())
+            if not name:
+                continue
+            cat = norm(cat) if cat else None
+            if tags is not None:
+                if isinstance(tags, str):
+                    tags = tags.split(",")
+                seen = {(cat or "Base").casefold()}
+                out = []
+                for t in tags if isinstance(tags, (list, tuple)) else ():
+                    t = norm(t) if t else ""
+                    if t and t.casefold() not in seen:
+                        seen.add(t.casefold()); out.append(t)
+                tags = tuple(out)
+            yield name, (cat or None), tags
+
+    def replace(self, entries, clean=None):
+        self._names = []
+        self._key = {}    # casefold -> name
+        self._cat = {}    # name -> category
+        self._tags = {}   # name -> extra tags (besides the category)
+        self._own = set()  # names whose category/tags differ from the defs (persisted as objects)
+        self._index = {}  # category -> [names], insertion order
+        self._bits = None
+        self.extend(entries, clean)
+        return self
+
+    def extend(self, entries, clean=None):
+        # One casefold-keyed pass; returns how many names were added
+        names, keys, cats, index, defs = self._names, self._key, self._cat, self._index, self._defs
+        start = len(names)
+        for name, cat, tags in self._parse(entries, clean):
+            key = name.casefold()
+            if key in keys:
+                continue
+            d = defs.get(key)
+            if d is not None:
+                if cat is None:
+                    name, cat = d[0], d[1]
+                if tags is None:
+                    tags = d[2]
+                if cat != d[1] or tags != d[2]:
+                    self._own.add(name)
+            else:
+                cat = cat or "Base"
+                if cat != "Base" or tags:
+                    self._own.add(name)
+            names.append(name)
+            keys[key] = name
+            cats[name] = cat
+            if tags:
+                self._tags[name] = tags
+            group = index.get(cat)
+            if group is None:
+                index[cat] = [name]
+            else:
+                group.append(name)
+        if len(names) != start:
+            self._bits = None
+        return len(names) - start
+
+    def add(self, raw, clean=None):
+        # Returns the stored name, or None for blanks / duplicates
+        return self._names[-1] if self.extend((raw,), clean) else None
+
+    def remove(self, name):
+        name = self._key.pop(_squash_ws(name).casefold(), None)
+        if name is None:
+            return False
+        self._names.remove(name)
+        cat = self._cat.pop(name)
+        self._tags.pop(name, None)
+        self._own.discard(name)
+        group = self._index[cat]
+        group.remove(name)
+        if not group:
+            del self._index[cat]
+        self._bits = None
+        return True
+
+    def set_tags(self, name, tags):
+        # Replace a character's extra tags; returns the stored tuple (None if unknown)
+        name = self.canonical(name)
+        if name is None:
+            return None
+        cat = self._cat[name]
+        parsed = next(self._parse([{"name": name, "category": cat, "tags": list(tags or ())}], None))[2]
+        if parsed:
+            self._tags[name] = parsed
+        else:
+            self._tags.pop(name, None)
+        d = self._defs.get(name.casefold())
+        if (cat, parsed) != ((d[1], d[2]) if d is not None else ("Base", ())):
+            self._own.add(name)
+        else:
+            self._own.discard(name)
+        self._bits = None
+        return parsed
+
+    def sort(self):
+        # Case-insensitive order for names and every category group
+        self._names.sort(key=str.casefold)
+        for group in self._index.values():
+            group.sort(key=str.casefold)
+        self._bits = None
+        return self
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, name):
+        return _squash_ws(name).casefold() in self._key
+
+    def names(self, category=None):
+        if category in (None, "", "Show All"):
+            return list(self._names)
+        return list(self._index.get(category, ()))
+
+    def canonical(self, name):
+        return self._key.get(_squash_ws(name).casefold())
+
+    def known_spellings(self):
+        # casefold -> name for every current name and every config def
+        out = {k: d[0] for k, d in self._defs.items()}
+        out.update(self._key)
+        return out
+
+    def category_of(self, name):
+        return self._cat.get(self.canonical(name), None)
+
+    def tags_of(self, name):
+        # Category first, then the extra tags
+        name = self.canonical(name)
+        if name is None:
+            return ()
+        return (self._cat[name],) + self._tags.get(name, ())
+
+    def categories(self):
+        return list(self._index)
+
+    def groups(self):
+        return {c: list(v) for c, v in self._index.items()}
+
+    def objects(self):
+        out = []
+        for n in self._names:
+            o = {"name": n, "category": self._cat[n]}
+            if n in self._tags:
+                o["tags"] = list(self._tags[n])
+            out.append(o)
+        return out
+
+    def default_names(self):
+        return [d[0] for d in self._defs.values()]
+
+    def copy(self):
+        return CharacterRepository(list(self._defs.values()), self.to_list())
+
+    def to_list(self):
+        # On-disk shape: plain names, objects only where category/tags are the user's own
+        own, tags = self._own, self._tags
+        out = []
+        for n in self._names:
+            if n not in own:
+                out.append(n)
+            elif n in tags:
+                out.append({"name": n, "category": self._cat[n], "tags": list(tags[n])})
+            else:
+                out.append({"name": n, "category": self._cat[n]})
+        return out
+
+    # Bitset index: tag casefold -> int with bit i set for self._names[i]
+    def _bitsets(self):
+        if self._bits is None:
+            pos = {}
+            label = {}
+            tags = self._tags
+            for i, n in enumerate(self._names):
+                for t in ((self._cat[n],) + tags[n]) if n in tags else (self._cat[n],):
+                    k = t.casefold()
+                    p = pos.get(k)
+                    if p is None:
+                        p = pos[k] = []
+                        label[k] = t
+                    p.append(i)
+            size = (len(self._names) + 7) // 8
+            bits = {}
+            for k, p in pos.items():
+                buf = bytearray(size)
+                for i in p:
+                    buf[i >> 3] |= 1 << (i & 7)
+                bits[k] = int.from_bytes(buf, "little")
+            self._bits = (bits, label)
+        return self._bits
+
+    def all_mask(self):
+        return (1 << len(self._names)) - 1
+
+    def tags(self):
+        # Every category and extra tag (display spelling), categories first
+        label = self._bitsets()[1]
+        cats = {c.casefold() for c in self._index}
+        return [label[k] for k in label if k in cats] + sorted((label[k] for k in label if k not in cats), key=str.casefold)
+
+    def tag_mask(self, tag):
+        return self._bitsets()[0].get(_squash_ws(tag).casefold(), 0)
+
+    def query(self, text):
+        # Tag query -> bitset (raises ValueError on a malformed query; blank = everything)
+        bits, label = self._bitsets()
+        node = parse_tag_query(text, label.values())
+        full = self.all_mask()
+
+        def ev(n):
+            op = n[0]
+            if op == "tag":
+                return bits.get(n[1], 0)
+            if op == "not":
+                return full & ~ev(n[1])
+            if op == "and":
+                return ev(n[1]) & ev(n[2])
+            return ev(n[1]) | ev(n[2])
+
+        return full if node is None else ev(node)
+
+    def names_for(self, mask):
+        # Set bits -> names, in list order
+        names = self._names
+        s = bin(mask & self.all_mask())[:1:-1]
+        out = []
+        i = s.find("1")
+        while i >= 0:
+            out.append(names[i])
+            i = s.find("1", i + 1)
+        return out
+
+    def facet_counts(self, mask=None):
+        # {tag: members within mask}, in tags() order
+        bits, label = self._bitsets()
+        if mask is None:
+            mask = self.all_mask()
+        return {t: (bits[t.casefold()] & mask).bit_count() for t in self.tags()}
+
+def save_user_characters(characters):
+    try:
+        if isinstance(characters, CharacterRepository):
+            characters = characters.to_list()
+        return write_records(USER_CHARACTERS_PATH, "characters", characters, "json") is not None
+    except Exception:
+        return False
+
+def load_or_init_user_characters(cfg_characters):
+    # Load USER_CHARACTERS_PATH into a CharacterRepository over the config defs;
+    # if missing, seed with the default names and persist.
+    repo = CharacterRepository(cfg_characters, ())
+    try:
+        if os.path.exists(USER_CHARACTERS_PATH):
+            with open(USER_CHARACTERS_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                characters = data.get("characters", [])
+            elif isinstance(data, list):
+                characters = data
+            else:
+                characters = []
+            repo.replace(characters if isinstance(characters, list) else [])
+        else:
+            repo.replace(repo.default_names())
+            save_user_characters(repo)
+        return repo.sort()
+    except Exception as e:
+        _notify("critical", "Characters", str(e))
+        return repo.replace(repo.default_names()).sort()
+
+# Placeholders: bare "" slots are filled left to right (characters first), named
+# "{slot}" slots by name. A prompt text is compiled once into literal segments
+# around its slots; rendering joins the segments with the fills.
+_PLACEHOLDER_RE = re.compile(r'"(?:\{\s*([^{}"\n]{1,48}?)\s*\})?"')
+
+def placeholder_key(name):
+    # Named slots match case- and spacing-insensitively; "" is the bare slot
+    return " ".join(str(name or "").split()).casefold()
+
+_compiled_placeholders = {}
+
+def compile_placeholders(text):
+    # -> (literals, slots) with len(literals) == len(slots) + 1; a slot is its
+    # display name, "" for a bare slot. Cached by text (bounded).
+    text = text or ""
+    hit = _compiled_placeholders.get(text)
+    if hit is not None:
+        return hit
+    lits = []; slots = []; pos = 0
+    for m in _PLACEHOLDER_RE.finditer(text):
+        lits.append(text[pos:m.start()])
+        slots.append(" ".join((m.group(1) or "").split()))
+        pos = m.end()
+    lits.append(text[pos:])
+    if len(_compiled_placeholders) >= 1024:
+        _compiled_placeholders.clear()
+    hit = _compiled_placeholders[text] = (tuple(lits), tuple(slots))
+    return hit
+
+def placeholder_count(text, named=False):
+    # Bare "" slots only, or every slot with named=True
+    slots = compile_placeholders(text)[1]
+    return len(slots) if named else slots.count("")
+
+def fill_placeholders(text, values=(), named=None, held=()):
+    # Per-slot fill (None = still empty). Empty values are skipped so the next value takes the slot;
+    # a bare slot no value reaches takes held[j], j being its position among the bare slots.
+    slots = compile_placeholders(text)[1]
+    it = (v for v in (values or ()) if v)
+    named = named or {}
+    out = []; j = 0
+    for n in slots:
+        if n:
+            out.append(named.get(placeholder_key(n)) or None)
+            continue
+        v = next(it, None)
+        if v is None and j < len(held or ()):
+            v = held[j] or None
+        out.append(v); j += 1
+    return out
+
+def render_placeholder(name, value):
+    return f'"{value}"' if value else (f'"{{{name}}}"' if name else '""')
+
+def join_placeholders(text, fills):
+    # Render text with one fill per slot (see fill_placeholders)
+    lits, slots = compile_placeholders(text)
+    if not slots:
+        return text or ""
+    parts = [lits[0]]
+    for name, v, lit in zip(slots, fills, lits[1:]):
+        parts.append(render_placeholder(name, v)); parts.append(lit)
+    return "".join(parts)
+
+def render_prompt_text(text, values, named=None, held=()):
+    return join_placeholders(text, fill_placeholders(text, values, named, held))
+
+def _utf16_len(s):
+    # Length in QString units (QTextDocument positions)
+    return len(s.encode("utf-16-le")) // 2
+
+class PlaceholderStore:
+    # Filled placeholder values persisted to PLACEHOLDERS_PATH (compact JSON):
+    # per prompt id one value per bare "" slot ("" = unset) plus the named "{slot}" values,
+    # and a global most-recent-first list per slot name ("" = bare slots) that feeds
+    # completion. The file is read on first use; callers batch writes via save().
+    MAX_RECENT = 40
+
+    def __init__(self, path=None):
+        self.path = path
+        self._prompts = None
+        self._recent = None
+        self.dirty = False
+
+    def _load(self):
+        if self._prompts is not None:
+            return
+        self._prompts, self._recent = {}, {}
+        try:
+            if self.path and os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f) or {}
+                for pid, e in (data.get("prompts") or {}).items():
+                    if isinstance(e, dict):
+                        vals = [v if isinstance(v, str) else "" for v in (e.get("values") or [])]
+                        named = {placeholder_key(k): str(v) for k, v in (e.get("named") or {}).items() if v}
+                        if any(vals) or named:
+                            self._prompts[str(pid)] = {"values": vals, "named": named}
+                for k, vals in (data.get("recent") or {}).items():
+                    if isinstance(vals, list):
+                        self._recent[placeholder_key(k)] = [str(v) for v in vals if v][:self.MAX_RECENT]
+        except Exception:
+            pass
+
+    def get(self, pid):
+        # -> (bare values, {slot key: value}); copies
+        self._load()
+        e = self._prompts.get(pid) or {}
+        return list(e.get("values") or ()), dict(e.get("named") or {})
+
+    def put(self, pid, values=None, named=None):
+        # Replace the bare values and/or merge named values of a prompt; empty named values clear the slot
+        self._load()
+        e = self._prompts.setdefault(pid, {"values": [], "named": {}})
+        if values is not None:
+            vals = [str(v or "") for v in values]
+            while vals and not vals[-1]:
+                vals.pop()
+            e["values"] = vals
+        for k, v in (named or {}).items():
+            k = placeholder_key(k)
+            if v:
+                e["named"][k] = str(v)
+            else:
+                e["named"].pop(k, None)
+        if not e["values"] and not e["named"]:
+            del self._prompts[pid]
+        self.dirty = True
+
+    def pop(self, pid):
+        self._load()
+        e = self._prompts.pop(pid, None)
+        if e is not None:
+            self.dirty = True
+        return e
+
+    def remember(self, name, value):
+        # Move value to the front of the slot's recent list
+        value = str(value or "").strip()
+        if not value:
+            return
+        self._load()
+        lst = self._recent.setdefault(placeholder_key(name), [])
+        if lst[:1] == [value]:
+            return
+        if value in lst:
+            lst.remove(value)
+        lst.insert(0, value)
+        del lst[self.MAX_RECENT:]
+        self.dirty = True
+
+    def put_slot(self, pid, name, pos, value):
+        # One field of the fill panel: a named slot, or bare slot number pos
+        if name:
+            return self.put(pid, named={name: value})
+        vals = self.get(pid)[0]
+        vals += [""] * (pos + 1 - len(vals))
+        vals[pos] = value
+        self.put(pid, values=vals)
+
+    def recent(self, name, prefix=""):
+        # Most recent first; a named slot falls back to the bare-slot values after its own
+        self._load()
+        key = placeholder_key(name)
+        out = list(self._recent.get(key, ()))
+        if key:
+            out += [v for v in self._recent.get("", ()) if v not in out]
+        if prefix:
+            pf = prefix.casefold()
+            out = [v for v in out if v.casefold().startswith(pf)]
+        return out
+
+    def to_json(self):
+        self._load()
+        return {"prompts": self._prompts, "recent": self._recent}
+
+    def save(self):
+        if not self.path or self._prompts is None:
+            return False
+        try:
+            tmp = self.path + ".part"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            self.dirty = False
+            return True
+        except Exception:
+            return False
+
+# Prompt matrix helpers
+def _dedupe_names(names):
+    seen = set(); out = []
+    for n in names or ():
+        n = (" ".join(str(n).split())).strip()
+        key = n.casefold()
+        if n and key not in seen:
+            seen.add(key); out.append(n)
+    return out
+
+def _matrix_plan(prompts, pools):
+    # Per prompt: (obj, pools used by its "" slots). Duplicate prompt texts are dropped.
+    active = [p for p in (_dedupe_names(p) for p in (pools or ())) if p]
+    plan = []
+    seen = set()
+    for p in prompts or ():
+        obj = p if isinstance(p, dict) else _p_to_obj(p, len(plan))
+        text = obj.get("text") or ""
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        plan.append((obj, active[:placeholder_count(text)]))
+    return plan
+
+def prompt_matrix_size(prompts, pools):
+    # Upper bound of combinations (exact unless distinct_names filters some out).
+    total = 0
+    for _obj, used in _matrix_plan(prompts, pools):
+        n = 1
+        for pool in used:
+            n *= len(pool)
+        total += n
+    return total
+
+def iter_prompt_matrix(prompts, pools, limit=None, sample=False, seed=None, distinct_names=True):
+    """Lazily yield (prompt_obj, names, rendered_text) for prompts x character pools.
+
+    `pools` holds one list of names per character slot (empty lists are skipped, like
+    "— None —" in the character boxes). Nothing is materialized: "all" mode walks
+    itertools.product per prompt, sample mode draws unique indices from the combined
+    index space and decodes them, so the number of rows is bounded by `limit`.
+    """
+    import itertools, bisect
+    plan = _matrix_plan(prompts, pools)
+    sizes = []
+    for _obj, used in plan:
+        n = 1
+        for pool in used:
+            n *= len(pool)
+        sizes.append(n)
+    total = sum(sizes)
+    limit = total if limit is None else max(0, min(int(limit), total))
+    if not limit:
+        return
+
+    def _ok(names):
+        if not distinct_names or len(names) < 2:
+            return True
+        return len({n.casefold() for n in names}) == len(names)
+
+    emitted = 0
+    if not sample or limit >= total:
+        for (obj, used) in plan:
+            for names in itertools.product(*used):
+                if not _ok(names):
+                    continue
+                yield obj, list(names), render_prompt_text(obj.get("text", ""), names)
+                emitted += 1
+                if emitted >= limit:
+                    return
+        return
+
+    # Random sample without replacement: each index maps to exactly one (prompt, combo)
+    offsets = []
+    acc = 0
+    for n in sizes:
+        offsets.append(acc); acc += n
+    rng = random.Random(seed)
+    seen = set()
+    attempts = 0
+    max_attempts = limit * 20 + 1000
+    while emitted < limit and attempts < max_attempts and len(seen) < total:
+        attempts += 1
+        idx = rng.randrange(total)
+        if idx in seen:
+            continue
+        seen.add(idx)
+        pi = bisect.bisect_right(offsets, idx) - 1
+        obj, used = plan[pi]
+        rest = idx - offsets[pi]
+        names = []
+        for pool in reversed(used):
+            rest, r = divmod(rest, len(pool))
+            names.append(pool[r])
+        names.reverse()
+        if not _ok(names):
+            continue
+        yield obj, names, render_prompt_text(obj.get("text", ""), names)
+        emitted += 1
+
+def write_prompt_matrix(path, rows, fmt="jsonl", progress=None, should_stop=None, every=500):
+    # Stream rows to disk one at a time; returns the number of rows written.
+    # path may also be an open text stream (e.g. sys.stdout), which is left open.
+    import contextlib
+    count = 0
+    with (contextlib.nullcontext(path) if hasattr(path, "write") else open(path, "w", encoding="utf-8", newline="\n")) as f:
+        for obj, names, text in rows:
+            if fmt == "txt":
+                f.write(" ".join(text.split("\n")) + "\n")
+            else:
+                rec = {"id": obj.get("id"), "title": obj.get("title"), "characters": names, "text": text}
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            count += 1
+            if count % every == 0:
+                if progress:
+                    progress(count)
+                if should_stop and should_stop():
+                    break
+    if progress:
+        progress(count)
+    return count
+
+# Usage + random sampling helpers
+class UsageStats:
+    # In-memory usage index per namespace ("prompts", "characters", "sites"): plain counts,
+    # an LRU-ordered recency map and a decaying frecency score. Nothing is persisted here:
+    # the AnalyticsStore event log is the record, and from_analytics() rebuilds the index.
+    # Frecency is kept in log space relative to the epoch (log sum of 2^(t/half_life)),
+    # so ranks never need re-aging and a touch is one heap push: O(log n).
+    HALF_LIFE = 7 * 24 * 3600.0
+    MAX_RECENT = 500
+    # namespace -> (event kind, events column holding the key)
+    EVENTS = {
+        "prompts": ("prompt_copied", "prompt_id"),
+        "sites": ("site_opened", "site"),
+        "characters": ("character_used", "detail"),
+    }
+
+    def __init__(self):
+        self.counts = {}
+        self.recent = {}
+        self.frecency = {}
+        self._heaps = {}
+
+    @classmethod
+    def from_analytics(cls, store):
+        # Per-day aggregates keep the read small; within a day the latest use stands for all
+        st = cls()
+        if store is None:
+            return st
+        for ns, (kind, column) in cls.EVENTS.items():
+            try:
+                rows = sorted(store.usage_by_day(kind, column), key=lambda r: r[3])
+            except Exception:
+                continue
+            for key, _day, n, ts in rows:
+                st.touch(ns, str(key), ts, int(n))
+        return st
+
+    def _log_weight(self, ts):
+        import math
+        return (ts / self.HALF_LIFE) * math.log(2.0)
+
+    def count(self, ns, key):
+        return self.counts.get(ns, {}).get(key, 0)
+
+    def bump(self, ns, key, n=1):
+        if not key:
+            return 0
+        d = self.counts.setdefault(ns, {})
+        d[key] = d.get(key, 0) + n
+        return d[key]
+
+    def touch(self, ns, key, ts=None, n=1):
+        # Record n uses at ts: count + recency (move to end) + frecency heap push
+        import collections, heapq, math, time
+        if not key:
+            return
+        ts = time.time() if ts is None else ts
+        self.bump(ns, key, n)
+        od = self.recent.setdefault(ns, collections.OrderedDict())
+        od.pop(key, None)
+        od[key] = ts
+        while len(od) > self.MAX_RECENT:
+            od.popitem(last=False)
+        fr = self.frecency.setdefault(ns, {})
+        w = self._log_weight(ts) + math.log(n)
+        old = fr.get(key)
+        if old is None:
+            score = w
+        else:
+            hi, lo = (old, w) if old > w else (w, old)
+            score = hi + math.log1p(math.exp(lo - hi))
+        fr[key] = score
+        heap = self._heaps.get(ns)
+        if heap is not None:
+            heapq.heappush(heap, (-score, key))
+            if len(heap) > 2 * len(fr) + 64:
+                self._heaps.pop(ns, None)
+
+    def score(self, ns, key):
+        return self.frecency.get(ns, {}).get(key)
+
+    def _heap(self, ns):
+        import heapq
+        heap = self._heaps.get(ns)
+        if heap is None:
+            heap = [(-v, k) for k, v in self.frecency.get(ns, {}).items()]
+            heapq.heapify(heap)
+            self._heaps[ns] = heap
+        return heap
+
+    def recent_keys(self, ns, limit=None):
+        keys = list(reversed(self.recent.get(ns, {})))
+        return keys if limit is None else keys[:limit]
+
+    def frequent_keys(self, ns, limit=None):
+        # Heap order with stale (superseded) entries skipped
+        import heapq
+        fr = self.frecency.get(ns, {})
+        heap = self._heap(ns)
+        n = len(heap) if limit is None else min(len(heap), 2 * limit + 64)
+        out = []; seen = set()
+        for neg, key in heapq.nsmallest(n, heap):
+            if key in seen or fr.get(key) != -neg:
+                continue
+            seen.add(key); out.append(key)
+            if limit is not None and len(out) >= limit:
+                break
+        return out
+
+class AliasTable:
+    # Walker/Vose alias method: O(n) build, O(1) weighted draw.
+    def __init__(self, keys, weights):
+        self.keys = list(keys)
+        n = len(self.keys)
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        if not n:
+            return
+        w = [max(0.0, float(x)) for x in weights]
+        total = sum(w)
+        if total <= 0:
+            w = [1.0] * n; total = float(n)
+        scaled = [x * n / total for x in w]
+        small = [i for i, x in enumerate(scaled) if x < 1.0]
+        large = [i for i, x in enumerate(scaled) if x >= 1.0]
+        while small and large:
+            s = small.pop(); l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in large + small:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def draw(self, rng=random):
+        i = int(rng.random() * len(self.keys))
+        return self.keys[i] if rng.random() < self.prob[i] else self.keys[self.alias[i]]
+
+class RandomPicker:
+    # Weighted no-repeat sampler over named groups (None = every key).
+    # Alias tables are built per group on first draw and only rebuilt for groups
+    # whose membership or weights changed since.
+    def __init__(self, weight_fn, window=8):
+        self.weight_fn = weight_fn
+        self.window = max(0, int(window))
+        self._groups = {}
+        self._key_groups = {}
+        self._tables = {}
+        self._recent = []
+
+    def set_groups(self, groups):
+        # groups: {group: [keys]}, a key may sit in several groups; unchanged groups keep their tables
+        groups = {g: list(keys) for g, keys in (groups or {}).items()}
+        groups[None] = list(dict.fromkeys(k for keys in groups.values() for k in keys))
+        for g in list(self._groups):
+            if g not in groups:
+                self._groups.pop(g, None); self._tables.pop(g, None)
+        for g, keys in groups.items():
+            if self._groups.get(g) != keys:
+                self._groups[g] = keys
+                self._tables.pop(g, None)
+        self._key_groups = {}
+        for g, keys in self._groups.items():
+            for k in keys:
+                self._key_groups.setdefault(k, []).append(g)
+        self._recent = [k for k in self._recent if k in self._key_groups]
+
+    def discard(self, key):
+        # Forget a removed key; only the groups that held it lose their tables
+        for g in self._key_groups.pop(key, ()):
+            try:
+                self._groups[g].remove(key)
+            except (KeyError, ValueError):
+                pass
+            self._tables.pop(g, None)
+        self._recent = [k for k in self._recent if k != key]
+
+    def invalidate(self, key):
+        # A key's weight changed: drop only the tables that contain it
+        for g in self._key_groups.get(key, ()):
+            self._tables.pop(g, None)
+
+    def _table(self, group):
+        t = self._tables.get(group)
+        if t is None:
+            keys = self._groups.get(group) or []
+            t = AliasTable(keys, [self.weight_fn(k) for k in keys])
+            self._tables[group] = t
+        return t
+
+    def pick(self, group=None, rng=random, exclude=()):
+        t = self._table(group)
+        if not len(t):
+            return None
+        blocked = set(exclude)
+        # The window shrinks for tiny groups so a draw is always possible
+        window = min(self.window, max(0, len(t) - len(blocked) - 1))
+        if window:
+            blocked.update(self._recent[-window:])
+        choice = None
+        for _ in range(32):
+            k = t.draw(rng)
+            if k not in blocked:
+                choice = k
+                break
+        if choice is None:
+            rest = [k for k in t.keys if k not in blocked] or list(t.keys)
+            choice = rng.choice(rest)
+        self._recent.append(choice)
+        if len(self._recent) > max(self.window, 1) * 4:
+            del self._recent[:-max(self.window, 1)]
+        return choice
+
+class AnalyticsStore:
+    # Local usage event log in SQLite (WAL). record() only enqueues; a daemon
+    # writer thread batches inserts so the GUI thread never waits on disk.
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS events ("
+        " id INTEGER PRIMARY KEY, ts REAL NOT NULL, kind TEXT NOT NULL,"
+        " prompt_id TEXT, site TEXT, detail TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_events_kind_prompt ON events(kind, prompt_id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_kind_site ON events(kind, site)",
+        "CREATE INDEX IF NOT EXISTS idx_events_kind_detail ON events(kind, detail)",
+    )
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0):
+        import queue, threading
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._q = queue.Queue()
+        self._ready = threading.Event()
+        self._dead = False  # set when the DB can't be opened or the writer has stopped
+        self._reader = None
+        self._thread = threading.Thread(target=self._run, name="sora2-analytics", daemon=True)
+        self._thread.start()
+
+    def record(self, kind, prompt_id=None, site=None, detail=None):
+        import time
+        if self._dead:
+            return  # no writer to drain the queue; drop the event
+        self._q.put((time.time(), kind, prompt_id, site, detail))
+
+    def _run(self):
+        import sqlite3, queue, threading, time
+        try:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for stmt in self.SCHEMA:
+                conn.execute(stmt)
+            conn.commit()
+        except Exception:
+            self._stop_writer()
+            return
+        self._ready.set()
+        batch = []
+        waiters = []
+        stop = False
+        while not stop:
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    ev = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if ev is None:
+                    stop = True
+                    break
+                if isinstance(ev, threading.Event):
+                    waiters.append(ev)
+                    break
+                batch.append(ev)
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO events(ts, kind, prompt_id, site, detail) VALUES (?,?,?,?,?)", batch)
+                except Exception:
+                    pass
+                batch = []
+            for w in waiters:
+                w.set()
+            waiters = []
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._stop_writer()
+
+    def _stop_writer(self):
+        # Writer is gone: stop queueing, drop what's left and release any flush() waiters
+        import queue, threading
+        self._dead = True
+        while True:
+            try:
+                ev = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(ev, threading.Event):
+                ev.set()
+        self._ready.set()
+
+    def flush(self, timeout=2.0):
+        # Block until everything queued so far is on disk (used before reports)
+        import threading
+        if self._dead:
+            return False
+        ev = threading.Event()
+        self._q.put(ev)
+        if self._dead:
+            return False  # the writer stopped meanwhile; nothing will set ev
+        return ev.wait(timeout)
+
+    def close(self, timeout=2.0):
+        self._q.put(None)
+        self._thread.join(timeout)
+        try:
+            if self._reader is not None:
+                self._reader.close()
+        except Exception:
+            pass
+        self._reader = None
+
+    def _query(self, sql, args=()):
+        import sqlite3
+        self._ready.wait(2.0)
+        try:
+            if self._reader is None:
+                self._reader = sqlite3.connect(self.path)
+            return self._reader.execute(sql, args).fetchall()
+        except Exception:
+            return []
+
+    def _top(self, kind, column, limit):
+        return self._query(
+            f"SELECT {column}, COUNT(*) AS n FROM events WHERE kind = ? AND {column} IS NOT NULL"
+            f" GROUP BY {column} ORDER BY n DESC LIMIT ?", (kind, int(limit)))
+
+    def top_prompts(self, limit=50):
+        return self._top("prompt_copied", "prompt_id", limit)
+
+    def top_sites(self, limit=50):
+        return self._top("site_opened", "site", limit)
+
+    def downloads_per_site(self, limit=50):
+        return self._top("download_completed", "site", limit)
+
+    def download_sources(self, limit=50):
+        return self._top("download_completed", "detail", limit)
+
+    def usage_by_day(self, kind, column):
+        # (key, day, uses, last ts) per key and UTC day; UsageStats rebuilds its ranks from these
+        return self._query(
+            f"SELECT {column}, CAST(ts / 86400 AS INTEGER) AS day, COUNT(*), MAX(ts) FROM events"
+            f" WHERE kind = ? AND {column} IS NOT NULL GROUP BY {column}, day", (kind,))
+
+class SiteLoadStats:
+    # Rolling page-load timings per site base (last `window` samples per metric, in ms),
+    # persisted to PERF_PATH. Metrics: load (Qt loadStarted->loadFinished), ttfb, dcl,
+    # onload (Navigation Timing) and lcp (Largest Contentful Paint).
+    METRICS = ("load", "ttfb", "dcl", "onload", "lcp")
+
+    def __init__(self, path=None, window=50):
+        self.path = path
+        self.window = max(1, int(window))
+        self.sites = {}  # base -> {"samples": {metric: deque}, "failures": int, "last": ts}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path, window=50):
+        st = cls(path, window)
+        try:
+            if path and os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f) or {}
+                for base, row in (data.get("sites") or {}).items():
+                    if not isinstance(row, dict):
+                        continue
+                    ent = st._entry(str(base))
+                    for metric, vals in (row.get("samples") or {}).items():
+                        if metric in cls.METRICS and isinstance(vals, list):
+                            ent["samples"][metric].extend(float(v) for v in vals if isinstance(v, (int, float)))
+                    ent["failures"] = int(row.get("failures") or 0)
+                    ent["last"] = float(row.get("last") or 0)
+        except Exception:
+            pass
+        return st
+
+    def _entry(self, base):
+        import collections
+        ent = self.sites.get(base)
+        if ent is None:
+            ent = {"samples": {m: collections.deque(maxlen=self.window) for m in self.METRICS}, "failures": 0, "last": 0.0}
+            self.sites[base] = ent
+        return ent
+
+    def add(self, base, metric, ms):
+        if not base or metric not in self.METRICS or ms is None or ms <= 0:
+            return
+        import time
+        ent = self._entry(base)
+        ent["samples"][metric].append(round(float(ms), 1))
+        ent["last"] = time.time()
+        self.dirty = True
+
+    def fail(self, base):
+        if base:
+            self._entry(base)["failures"] += 1
+            self.dirty = True
+
+    @staticmethod
+    def _pct(vals, q):
+        if not vals:
+            return None
+        v = sorted(vals)
+        return v[min(len(v) - 1, int(q * len(v)))]
+
+    def summary(self, base):
+        ent = self.sites.get(base)
+        if ent is None:
+            return None
+        out = {"loads": len(ent["samples"]["load"]), "failures": ent["failures"]}
+        for metric, vals in ent["samples"].items():
+            out[metric + "_p50"] = self._pct(vals, 0.5)
+            out[metric + "_p95"] = self._pct(vals, 0.95)
+        return out
+
+    def rows(self):
+        # (base, summary) slowest first by load p50; unmeasured sites last
+        rows = [(b, self.summary(b)) for b in self.sites]
+        rows.sort(key=lambda r: -(r[1]["load_p50"] or -1))
+        return rows
+
+    def clear(self):
+        self.sites.clear()
+        self.dirty = True
+
+    def to_json(self):
+        return {"version": 1, "window": self.window,
+                "sites": {b: {"samples": {m: list(v) for m, v in e["samples"].items() if v},
+                              "failures": e["failures"], "last": e["last"]} for b, e in self.sites.items()}}
+
+    def save(self):
+        if not self.path:
+            return False
+        try:
+            tmp = self.path + ".part"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            self.dirty = False
+            return True
+        except Exception:
+            return False
+
+# Built-in ad/tracker hosts (blocked with all subdomains). Captcha and login
+# providers are deliberately absent; extend via sora2_blocklist.txt.
+DEFAULT_BLOCKLIST = (
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "google-analytics.com",
+    "adservice.google.com", "pagead2.googlesyndication.com", "amazon-adsystem.com", "adnxs.com",
+    "adsrvr.org", "rubiconproject.com", "pubmatic.com", "openx.net", "casalemedia.com", "criteo.com",
+    "criteo.net", "taboola.com", "outbrain.com", "moatads.com", "scorecardresearch.com", "quantserve.com",
+    "hotjar.com", "clarity.ms", "ads-twitter.com", "static.ads-twitter.com", "popads.net",
+    "propellerads.com", "exoclick.com", "mgid.com", "revcontent.com", "adsterra.com", "hilltopads.net",
+    "onclickads.net", "zedo.com", "yieldmo.com", "sharethrough.com", "smartadserver.com", "3lift.com",
+    "bidswitch.net", "media.net", "teads.tv",
+)
+
+# UA library: PRESET_UAS plus cfg "user_agents" entries, each with the client hints a
+# real browser sending that UA would add. Config form (list, or {label: spec}):
+#   {"label": "Chrome (Linux)", "ua": "...", "platform": "Linux", "mobile": false,
+#    "brands": [["Google Chrome", "141"], ...], "weight": 2}
+# platform/mobile/brands are derived from the UA string when omitted; "disabled": true
+# hides a built-in preset.
+_UA_PLATFORMS = (("Windows", "Windows", "Win32"), ("Android", "Android", "Linux armv8l"),
+                 ("iPhone", "iOS", "iPhone"), ("iPad", "iOS", "iPad"), ("CrOS", "Chrome OS", "Linux x86_64"),
+                 ("Macintosh", "macOS", "MacIntel"), ("Linux", "Linux", "Linux x86_64"))
+_UA_NAV_PLATFORM = {ch: nav for _, ch, nav in _UA_PLATFORMS}
+
+def ua_entry(label, spec):
+    # Normalised library entry; spec is a UA string or a dict (see above)
+    if isinstance(spec, str):
+        spec = {"ua": spec}
+    ua = str(spec.get("ua") or "").strip()
+    platform = spec.get("platform")
+    if not platform:
+        platform = next((ch for token, ch, _ in _UA_PLATFORMS if token in ua), "")
+    mobile = spec.get("mobile")
+    if mobile is None:
+        mobile = "Mobile" in ua or platform in ("Android", "iOS") and "iPad" not in ua
+    brands = spec.get("brands")
+    if brands is None:
+        # Only Chromium-based browsers send client hints (Safari/Firefox send none)
+        m = re.search(r"\bChrome/(\d+)", ua)
+        if m and "CriOS" not in ua:
+            v = m.group(1)
+            edge = re.search(r"\bEdg(?:A)?/(\d+)", ua)
+            brands = [["Chromium", v], ["Microsoft Edge", edge.group(1)] if edge else ["Google Chrome", v],
+                      ["Not?A_Brand", "99"]]
+    try:
+        weight = float(spec.get("weight", 1))
+    except (TypeError, ValueError):
+        weight = 1.0
+    return {"label": label, "ua": ua, "platform": platform, "mobile": bool(mobile),
+            "brands": [[str(b), str(v)] for b, v in brands] if brands else None,
+            "weight": max(0.0, weight), "client_hints": spec.get("client_hints") or {}}
+
+def ua_client_hint_headers(entry):
+    # [(name, value)] bytes pairs for the interceptor. Non-Chromium UAs get no Sec-CH-UA*
+    # headers from us (an empty header is itself a tell; real Safari/Firefox send none).
+    hints = {}
+    if entry.get("brands"):
+        hints = {"Sec-CH-UA": ", ".join(f'"{b}";v="{v}"' for b, v in entry["brands"]),
+                 "Sec-CH-UA-Mobile": "?1" if entry.get("mobile") else "?0",
+                 "Sec-CH-UA-Platform": f'"{entry.get("platform") or "Unknown"}"'}
+    hints.update(entry.get("client_hints") or {})
+    out = [(b"User-Agent", entry["ua"].encode("latin-1", "replace"))] if entry.get("ua") else []
+    out += [(k.encode("latin-1"), str(v).encode("latin-1", "replace")) for k, v in hints.items()]
+    return out
+
+def ua_navigator_js(entry):
+    # Payload for the per-site navigator override script (UA_OVERRIDE_JS)
+    return {"ua": entry["ua"], "platform": _UA_NAV_PLATFORM.get(entry.get("platform"), ""),
+            "brands": [{"brand": b, "version": v} for b, v in entry["brands"]] if entry.get("brands") else None,
+            "mobile": entry.get("mobile", False), "chPlatform": entry.get("platform", "")}
+
+class UALibrary:
+    # Label <-> UA index (both O(1)), weighted draws via AliasTable, cached header lists.
+    def __init__(self, entries=None):
+        self.entries = {}  # label -> entry, in menu order
+        self.by_ua = {}
+        self._headers = {}
+        self._table = None
+        for label, spec in (PRESET_UAS if entries is None else entries).items():
+            self.add(label, spec)
+
+    @classmethod
+    def from_config(cls, value):
+        lib = cls()
+        if isinstance(value, dict):
+            value = [dict(v, label=k) if isinstance(v, dict) else {"label": k, "ua": v} for k, v in value.items()]
+        for spec in value or []:
+            try:
+                label = str(spec.get("label") or spec.get("name") or "").strip()
+                if not label:
+                    continue
+                if spec.get("disabled"):
+                    lib.remove(label)
+                elif spec.get("ua"):
+                    lib.add(label, spec)
+            except Exception:
+                pass
+        return lib
+
+    def add(self, label, spec):
+        e = ua_entry(label, spec)
+        if not e["ua"]:
+            return None
+        self.remove(label)
+        self.entries[label] = e
+        self.by_ua.setdefault(e["ua"], label)
+        self._table = None
+        return e
+
+    def remove(self, label):
+        e = self.entries.pop(label, None)
+        if e is not None:
+            if self.by_ua.get(e["ua"]) == label:
+                del self.by_ua[e["ua"]]
+                other = next((l for l, x in self.entries.items() if x["ua"] == e["ua"]), None)
+                if other:
+                    self.by_ua[e["ua"]] = other
+            self._headers.pop(e["ua"], None)
+            self._table = None
+
+    def __contains__(self, label):
+        return label in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def labels(self):
+        return list(self.entries)
+
+    def ua(self, label, default=None):
+        e = self.entries.get(label)
+        return e["ua"] if e else default
+
+    def label_for(self, ua, default=None):
+        return self.by_ua.get(ua, default)
+
+    def entry_for(self, ua):
+        # Library entry for a UA string; custom strings get a derived one
+        label = self.by_ua.get(ua)
+        return self.entries[label] if label else ua_entry("Custom", ua)
+
+    def headers(self, ua):
+        h = self._headers.get(ua)
+        if h is None:
+            h = self._headers[ua] = ua_client_hint_headers(self.entry_for(ua))
+        return h
+
+    def pick(self, rng=random, exclude=None, mobile=None):
+        # Weighted label; `exclude` avoids repeating the current one where possible
+        if self._table is None:
+            self._table = AliasTable(self.entries, [e["weight"] for e in self.entries.values()])
+        if not len(self._table):
+            return None
+        for _ in range(16):
+            label = self._table.draw(rng)
+            if label != exclude and (mobile is None or self.entries[label]["mobile"] == mobile):
+                return label
+        pool = [l for l, e in self.entries.items() if l != exclude and (mobile is None or e["mobile"] == mobile)]
+        return rng.choice(pool) if pool else label
+
+def lookup_host_suffix(mapping, host):
+    # Value for host or its nearest parent domain in mapping (a.b.example.com -> example.com)
+    while host:
+        v = mapping.get(host)
+        if v is not None:
+            return v
+        i = host.find(".")
+        if i < 0:
+            return None
+        host = host[i + 1:]
+    return None
+
+class DomainBlocklist:
+    # Hosts-file / domain-list / ABP "||domain^" rules compiled into hashed suffix sets.
+    # match() walks the host's label suffixes (a.b.example.com -> b.example.com -> example.com
+    # -> com), so a lookup is O(labels) set probes regardless of list size.
+    _HOSTS_IPS = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+    _HOSTS_SKIP = {"localhost", "localhost.localdomain", "local", "broadcasthost", "ip6-localhost",
+                   "ip6-loopback", "0.0.0.0"}
+    _ABP_OK_OPTS = {"third-party", "3p", "important", "all"}
+
+    def __init__(self, domains=()):
+        self.block = set()
+        self.allow = set()
+        for d in domains:
+            self._add(self.block, d)
+
+    def __len__(self):
+        return len(self.block)
+
+    @staticmethod
+    def _add(target, domain):
+        domain = domain.strip().lower().lstrip("*").strip(".")
+        if domain and "." in domain and "/" not in domain and "*" not in domain:
+            target.add(domain)
+            return True
+        return False
+
+    def add_line(self, line):
+        line = line.strip()
+        if not line or line[0] in "!#[":
+            return False
+        if "##" in line or "#@#" in line or "#?#" in line:
+            return False  # cosmetic filters
+        target = self.block
+        if line.startswith("@@"):
+            target, line = self.allow, line[2:]
+        if line.startswith("||"):
+            body, _, opts = line[2:].partition("$")
+            if opts and not set(o.strip().lower() for o in opts.split(",")) <= self._ABP_OK_OPTS:
+                return False  # resource-type / domain= scoped rules would over-block here
+            if body.endswith("^|"):
+                body = body[:-2]
+            elif body.endswith("^"):
+                body = body[:-1]
+            else:
+                return False  # path rules
+            return self._add(target, body)
+        if target is self.allow:
+            return False
+        parts = line.split("#", 1)[0].split()
+        if len(parts) >= 2 and parts[0] in self._HOSTS_IPS:
+            added = False
+            for d in parts[1:]:
+                if d.lower() not in self._HOSTS_SKIP:
+                    added = self._add(self.block, d) or added
+            return added
+        if len(parts) == 1 and not any(c in parts[0] for c in "|^$/"):
+            return self._add(self.block, parts[0])
+        return False
+
+    def add_lines(self, lines):
+        n = 0
+        for line in lines:
+            if self.add_line(line):
+                n += 1
+        return n
+
+    def load_file(self, path):
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return self.add_lines(f)
+        except Exception:
+            return 0
+
+    def match(self, host):
+        # Blocking rule that covers host, or None; @@ exceptions win at any level
+        hit = None
+        while host:
+            if host in self.allow:
+                return None
+            if hit is None and host in self.block:
+                hit = host
+            i = host.find(".")
+            if i < 0:
+                break
+            host = host[i + 1:]
+        return hit
+
+# Shared static-asset cache (Tools → Asset Cache). Only build output that is named by
+# content hash is redirected here, and only responses the server marks immutable or
+# long-lived are stored, so a cached copy can never go stale. No cookies or auth are
+# ever sent or stored.
+_ASSET_EXT_RE = re.compile(r"\.(?:js|mjs|css|woff2?|ttf|otf|eot|wasm)$", re.I)
+_ASSET_HASHED_RE = re.compile(
+    r"/_next/static/|/_nuxt/|/static/chunks/"                      # framework build dirs
+    r"|[._-][0-9a-f]{8,}(?:[._-][^/]*)?\.[a-z0-9]+$"                # app.3f9a1c2b.js, chunk-5f3e9d0a.min.css
+    r"|[._-](?=[A-Za-z_]*[0-9])(?=[0-9_]*[A-Za-z])[A-Za-z0-9_]{8,}\.[a-z0-9]+$",  # vite/esbuild: index-BkQ9x2Lz.js
+    re.I)
+_ASSET_AUTH_QS_RE = re.compile(r"(?:^|&)(?:token|sig|signature|auth|key|expires|x-amz-[^=]*|policy)=", re.I)
+
+def is_immutable_asset_url(url):
+    # Cheap pre-check used by the request interceptor (no network, no headers)
+    scheme, sep, rest = url.partition("://")
+    if not sep or scheme not in ("http", "https"):
+        return False
+    hostpath, _, query = rest.partition("?")
+    host, _, path = hostpath.partition("/")
+    path = "/" + path.split("#", 1)[0]
+    if not host or "@" in host or not _ASSET_EXT_RE.search(path):
+        return False
+    if query and _ASSET_AUTH_QS_RE.search(query):
+        return False  # signed / per-user URLs
+    return bool(_ASSET_HASHED_RE.search(path))
+
+def asset_response_cacheable(headers):
+    # headers: lower-cased name -> value
+    if headers.get("set-cookie"):
+        return False
+    vary = headers.get("vary", "").lower()
+    if "cookie" in vary or "authorization" in vary:
+        return False
+    cc = headers.get("cache-control", "").lower()
+    if "no-store" in cc or "private" in cc or "no-cache" in cc:
+        return False
+    if "immutable" in cc:
+        return True
+    m = re.search(r"(?:s-)?max-age=(\d+)", cc)
+    return bool(m and int(m.group(1)) >= 86400)
+
+def fetch_asset(url, referer=None, user_agent=None, timeout=20, max_bytes=32 * 1024 * 1024):
+    # Plain urllib GET: no cookie jar, no Authorization. Returns a result dict.
+    import urllib.request, urllib.error
+    hdrs = {"Accept": "*/*", "Accept-Encoding": "identity"}
+    if referer:
+        hdrs["Referer"] = referer
+    if user_agent:
+        hdrs["User-Agent"] = user_agent
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=hdrs), timeout=timeout) as r:
+            data = r.read(max_bytes + 1)
+            headers = {k.lower(): v for k, v in r.headers.items()}
+            too_big = len(data) > max_bytes
+            return {"status": r.status, "ctype": headers.get("content-type", "application/octet-stream"),
+                    "data": data[:max_bytes], "cacheable": r.status == 200 and not too_big and asset_response_cacheable(headers)}
+    except urllib.error.HTTPError as e:
+        return {"status": e.code, "ctype": "text/plain", "data": b"", "cacheable": False, "error": str(e)}
+    except Exception as e:
+        return {"status": 0, "ctype": "text/plain", "data": b"", "cacheable": False, "error": str(e)}
+
+class AssetCache:
+    # On-disk LRU of asset bodies keyed by URL (files named by sha1), with a size cap.
+    # Index + cumulative stats persist in <dir>/index.json; not thread-safe (GUI thread).
+    def __init__(self, root=ASSET_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        import collections
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.entries = collections.OrderedDict()  # url -> [file, size, ctype], oldest first
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "stored": 0, "evicted": 0}
+        self.dirty = False
+        self._load()
+
+    def _index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def _load(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+            for url, fname, size, ctype in data.get("entries") or []:
+                if os.path.exists(os.path.join(self.root, fname)):
+                    self.entries[url] = [fname, int(size), ctype]
+                    self.size += int(size)
+            self.stats.update({k: int(v) for k, v in (data.get("stats") or {}).items() if k in self.stats})
+        except Exception:
+            pass
+
+    def get(self, url):
+        ent = self.entries.get(url)
+        if ent is None:
+            self.stats["misses"] += 1
+            self.dirty = True
+            return None
+        try:
+            with open(os.path.join(self.root, ent[0]), "rb") as f:
+                data = f.read()
+        except Exception:
+            self._drop(url)
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(url)
+        self.stats["hits"] += 1
+        self.stats["bytes_saved"] += len(data)
+        self.dirty = True
+        return ent[2], data
+
+    def put(self, url, ctype, data):
+        import hashlib
+        if len(data) > self.max_bytes // 4:
+            return False
+        fname = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = os.path.join(self.root, fname + ".part")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.root, fname))
+        except Exception:
+            return False
+        old = self.entries.pop(url, None)
+        if old:
+            self.size -= old[1]
+        self.entries[url] = [fname, len(data), ctype]
+        self.size += len(data)
+        self.stats["stored"] += 1
+        while self.size > self.max_bytes and self.entries:
+            self._drop(next(iter(self.entries)))
+            self.stats["evicted"] += 1
+        self.dirty = True
+        return True
+
+    def _drop(self, url):
+        ent = self.entries.pop(url, None)
+        if ent:
+            self.size -= ent[1]
+            try:
+                os.remove(os.path.join(self.root, ent[0]))
+            except Exception:
+                pass
+
+    def clear(self):
+        for url in list(self.entries):
+            self._drop(url)
+        for k in self.stats:
+            self.stats[k] = 0
+        self.dirty = True
+        self.save()
+
+    def hit_ratio(self):
+        n = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / n if n else 0.0
+
+    def save(self):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = self._index_path() + ".part"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "stats": self.stats,
+                           "entries": [[u, e[0], e[1], e[2]] for u, e in self.entries.items()]}, f)
+            os.replace(tmp, self._index_path())
+            self.dirty = False
+            return True
+        except Exception:
+            return False
+
+# Updater. The update base URL serves a small manifest next to the files:
+#   {"version": "1.3.0", "files": {"sora2-browser-tool.py": {"sha256": "...", "size": 123456}, ...}}
+# Only files whose local sha256 differs are downloaded, into <name>.part (resumed with
+# Range/If-Range), hash-checked, then renamed to <name>.tmp. The pending marker is
+# written last: it is what makes a staged set complete for apply_pending_update().
+# Without a manifest (404) the old full-config version check is used instead.
+UPDATE_MANIFEST_NAME = "sora2_manifest.json"
+UPDATE_PENDING_NAME = "sora2_update.pending"
+UPDATE_FILES = ("sora2_config.json", "sora2-browser-tool.py")  # apply order: config first, script last
+
+def version_tuple(v):
+    # extract all ints; fallback (0,) if nothing
+    return tuple(int(x) for x in re.findall(r"\d+", str(v)) or [0])
+
+def file_sha256(path):
+    import hashlib
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def _write_json_atomic(path, data):
+    tmp = path + ".part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _read_json_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except Exception:
+        return None
+
+def fetch_update_manifest(base_url, state, timeout=15):
+    # Conditional GET (If-None-Match / If-Modified-Since); a 304 reuses state["manifest"].
+    # Raises urllib.error.HTTPError (404 = no manifest published) or ValueError.
+    import urllib.request, urllib.error
+    url = base_url.rstrip("/") + "/" + UPDATE_MANIFEST_NAME
+    hdrs = {"Accept": "application/json", "Accept-Encoding": "identity"}
+    cached = state.get("manifest")
+    if cached:
+        if state.get("etag"):
+            hdrs["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            hdrs["If-Modified-Since"] = state["last_modified"]
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=hdrs), timeout=timeout) as r:
+            data = json.loads(r.read(1 << 20).decode("utf-8"))
+            etag, modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return cached
+        raise
+    if not isinstance(data, dict) or not isinstance(data.get("files"), dict):
+        raise ValueError("malformed update manifest")
+    state.update({"manifest": data, "etag": etag, "last_modified": modified})
+    return data
+
+def legacy_update_manifest(base_url, timeout=15):
+    # Fallback: read "version" from the full remote config; no hashes, so both files
+    # are fetched (and the config is only checked to be valid JSON)
+    import urllib.request
+    url = base_url.rstrip("/") + "/sora2_config.json"
+    with urllib.request.urlopen(urllib.request.Request(url, headers={"Accept-Encoding": "identity"}), timeout=timeout) as r:
+        remote_cfg = json.loads(r.read().decode("utf-8", "ignore"))
+    return {"version": remote_cfg.get("version", "0.0.0"), "legacy": True,
+            "files": {name: {} for name in UPDATE_FILES}}
+
+def plan_update(manifest, base_dir, local_version, force=False):
+    # [(name, sha256 or None, size)] for files that need downloading
+    if not force and version_tuple(manifest.get("version")) <= version_tuple(local_version):
+        return []
+    todo = []
+    for name, info in (manifest.get("files") or {}).items():
+        if name not in UPDATE_FILES:
+            continue  # never write anything outside the known file set
+        if not isinstance(info, dict):
+            info = {"sha256": info}
+        want = str(info.get("sha256") or "").lower() or None
+        if want and file_sha256(os.path.join(base_dir, name)) == want:
+            continue
+        try:
+            size = int(info.get("size") or 0)
+        except (TypeError, ValueError):
+            size = 0
+        todo.append((name, want, size))
+    return todo
+
+def download_update_file(url, base_dir, name, sha256=None, size=0, state=None, progress=None,
+                         should_stop=None, timeout=15):
+    # Fetch url into <name>.part (resuming), verify, rename to <name>.tmp; returns bytes fetched
+    import urllib.request, urllib.error
+    part = os.path.join(base_dir, name + ".part")
+    tmp = os.path.join(base_dir, name + ".tmp")
+    if sha256 and file_sha256(tmp) == sha256:
+        return 0  # staged by an earlier run
+    parts = state.setdefault("parts", {}) if state is not None else {}
+    have = os.path.getsize(part) if os.path.exists(part) else 0
+    if (size and have > size) or (have and not (sha256 or parts.get(name))):
+        have = 0  # nothing to prove the partial file belongs to this version
+    hdrs = {"Accept-Encoding": "identity"}
+    if have:
+        hdrs["Range"] = f"bytes={have}-"
+        if parts.get(name):
+            hdrs["If-Range"] = parts[name]  # origin changed -> full 200 instead of 206
+    done = have
+    try:
+        r = urllib.request.urlopen(urllib.request.Request(url, headers=hdrs), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not have:
+            raise
+        r = None  # nothing past what we already have
+    if r is not None:
+        with r:
+            if r.status != 206:
+                have = done = 0  # Range ignored: start over
+            validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+            if validator:
+                parts[name] = validator
+            total = have + int(r.headers.get("Content-Length") or 0) or size
+            with open(part, "ab" if have else "wb") as f:
+                while True:
+                    if should_stop is not None and should_stop():
+                        raise RuntimeError("cancelled")  # .part kept for the next attempt
+                    chunk = r.read(64 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress is not None:
+                        progress(name, done, total)
+            if total and done < total:
+                raise RuntimeError(f"{name}: connection closed at {done} of {total} bytes")  # resumable
+    got = file_sha256(part)
+    if sha256 and got != sha256:
+        os.remove(part)
+        parts.pop(name, None)
+        raise ValueError(f"{name}: sha256 mismatch (got {str(got)[:12]}, expected {sha256[:12]})")
+    if name.endswith(".json"):
+        with open(part, "r", encoding="utf-8") as f:
+            json.load(f)  # a truncated/HTML error page must never replace the config
+    os.replace(part, tmp)
+    parts.pop(name, None)
+    return done - have
+
+def run_update(base_url, base_dir, local_version, state_path=UPDATE_STATE_PATH, check_only=False,
+               force=False, progress=None, should_stop=None, timeout=15):
+    # Check (and unless check_only, download + stage) an update. Returns a result dict;
+    # status is "uptodate", "available" (check_only) or "staged".
+    import urllib.error
+    state = _read_json_file(state_path) or {}
+    try:
+        manifest = fetch_update_manifest(base_url, state, timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            raise
+        manifest = legacy_update_manifest(base_url, timeout)
+    todo = plan_update(manifest, base_dir, local_version, force)
+    result = {"status": "available" if todo else "uptodate", "version": str(manifest.get("version", "0.0.0")),
+              "local": str(local_version), "files": [n for n, _, _ in todo],
+              "bytes": sum(sz for _, _, sz in todo), "legacy": bool(manifest.get("legacy"))}
+    try:
+        if check_only or not todo:
+            return result
+        fetched = 0
+        staged = {}
+        for name, sha, size in todo:
+            url = base_url.rstrip("/") + "/" + name
+            fetched += download_update_file(url, base_dir, name, sha, size, state, progress, should_stop, timeout)
+            staged[name] = sha or file_sha256(os.path.join(base_dir, name + ".tmp"))
+        _write_json_atomic(os.path.join(base_dir, UPDATE_PENDING_NAME),
+                           {"version": result["version"], "files": staged})
+        result.update(status="staged", fetched=fetched)
+        return result
+    finally:
+        try:
+            _write_json_atomic(state_path, state)
+        except Exception:
+            pass
+
+def apply_pending_update(base_dir, state_path=UPDATE_STATE_PATH):
+    # Swap staged .tmp files in. Returns "none", "applied", "discarded" or "deferred"
+    # (a file could not be replaced yet, e.g. locked; marker kept so a retry resumes).
+    pending = os.path.join(base_dir, UPDATE_PENDING_NAME)
+    marker = _read_json_file(pending)
+    tmps = {n: os.path.join(base_dir, n + ".tmp") for n in UPDATE_FILES}
+
+    def discard():
+        for path in list(tmps.values()) + [pending]:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception:
+                pass
+        return "discarded"
+
+    if marker is None:
+        present = [n for n, t in tmps.items() if os.path.exists(t)]
+        if not present:
+            return "none"
+        files = (((_read_json_file(state_path) or {}).get("manifest") or {}).get("files")) or {}
+        hashes = {n: files[n].get("sha256") for n in present if isinstance(files.get(n), dict)}
+        if len(present) == len(UPDATE_FILES) and not any(hashes.values()):
+            marker = {"files": {n: None for n in present}}  # legacy updater: both files staged, no hashes
+        else:
+            # Interrupted download: verified files stay for the next run, anything else goes
+            dropped = False
+            for n in present:
+                if not hashes.get(n) or file_sha256(tmps[n]) != hashes[n]:
+                    try:
+                        os.remove(tmps[n])
+                    except Exception:
+                        pass
+                    dropped = True
+            return "discarded" if dropped else "none"
+    files = marker.get("files") if isinstance(marker.get("files"), dict) else {}
+    for name, sha in files.items():
+        if name not in tmps:
+            return discard()
+        if os.path.exists(tmps[name]):
+            if sha and file_sha256(tmps[name]) != sha:
+                return discard()
+        elif not sha or file_sha256(os.path.join(base_dir, name)) != sha:
+            return discard()  # missing and not already swapped in by an earlier attempt
+    for name in UPDATE_FILES:
+        if name in files and os.path.exists(tmps[name]):
+            try:
+                os.replace(tmps[name], os.path.join(base_dir, name))
+            except OSError:
+                return "deferred"
+    try:
+        os.remove(pending)
+    except Exception:
+        pass
+    return "applied"
+
+# Three-way merge of shipped defaults into the user libraries. The snapshot file keeps,
+# per library, {key: content hash} of the defaults as last merged (no item bodies), so
+# base/defaults/user can be compared with three dict lookups per key.
+MERGE_FIELDS = {"prompts": ("title", "category", "tags", "text"),
+                "sites": ("name", "url", "category", "free_tier", "notes"),
+                "characters": ()}
+
+def merge_item_key(lib, obj):
+    if lib == "prompts":
+        return obj.get("id")
+    if lib == "sites":
+        return (obj.get("base") or _url_base(obj.get("url", ""))) or None
+    name = obj.get("name", "") if isinstance(obj, dict) else str(obj)
+    return (" ".join(name.split())).casefold() or None
+
+def _url_base(url):
+    m = re.match(r"^[a-z][a-z0-9+.-]*://(?:www\.)?([^/:?#]+)", str(url or "").strip(), re.I)
+    return m.group(1).lower() if m else ""
+
+def merge_item_hash(lib, obj, _sha1=None):
+    # 16 hex chars of sha1 over repr() of the compared fields (stable for JSON-shaped
+    # values); names are compared by their key alone
+    fields = MERGE_FIELDS[lib]
+    if not fields:
+        return merge_item_key(lib, obj)
+    if _sha1 is None:
+        import hashlib
+        _sha1 = hashlib.sha1
+    return _sha1(repr(tuple(map(obj.get, fields))).encode()).hexdigest()[:16]
+
+def merge_index(lib, items, with_hashes=True):
+    # One pass: ({key: hash} or None, {key: first position})
+    import hashlib
+    sha1, fields = hashlib.sha1, MERGE_FIELDS[lib]
+    hashes, pos = ({} if with_hashes else None), {}
+    by_id = lib == "prompts"
+    for i, obj in enumerate(items):
+        k = obj.get("id") if by_id else merge_item_key(lib, obj)
+        if k is None or k in pos:
+            continue
+        pos[k] = i
+        if with_hashes:
+            hashes[k] = sha1(repr(tuple(map(obj.get, fields))).encode()).hexdigest()[:16] if fields else k
+    return hashes, pos
+
+def merge_hashes(lib, items):
+    return merge_index(lib, items)[0]
+
+def three_way_merge(lib, base, defaults, user):
+    # base: {key: hash} snapshot; defaults/user: item lists. Non-conflicting default
+    # additions, changes and removals are applied to a copy of `user`; conflicts are
+    # returned for the caller to resolve (their snapshot entry stays at the old base so
+    # an unresolved conflict comes back next time). Defaults are hashed in full; user
+    # items only where the defaults actually moved, which keeps big libraries fast.
+    import hashlib
+    sha1 = hashlib.sha1
+    th, tpos = merge_index(lib, defaults)
+    _, index = merge_index(lib, user, with_hashes=False)
+    fields = MERGE_FIELDS[lib]
+    items = list(user)
+    snapshot, conflicts = {}, []
+    added = updated = removed = 0
+    drop = set()
+    for k, t in th.items():
+        b = base.get(k)
+        if b == t:
+            snapshot[k] = t  # default unchanged: whatever the user did stands
+            continue
+        i = index.get(k)
+        o = merge_item_hash(lib, items[i], sha1) if i is not None else None
+        if o == t:
+            snapshot[k] = t
+        elif o is None and b is None:
+            items.append(defaults[tpos[k]]); added += 1
+            snapshot[k] = t
+        elif o is not None and o == b:
+            items[i] = _merge_take(defaults[tpos[k]], items[i], fields); updated += 1
+            snapshot[k] = t
+        else:
+            conflicts.append({"key": k, "kind": "both-added" if b is None else
+                              ("deleted-locally" if o is None else "both-changed"),
+                              "ours": items[i] if o is not None else None, "theirs": defaults[tpos[k]]})
+            if b is not None:
+                snapshot[k] = b
+    for k, b in base.items():
+        i = index.get(k)
+        if i is None or k in th:
+            continue
+        if merge_item_hash(lib, items[i], sha1) == b:
+            drop.add(i); removed += 1
+        else:
+            conflicts.append({"key": k, "kind": "removed-upstream", "ours": items[i], "theirs": None})
+            snapshot[k] = b
+    if drop:
+        items = [o for i, o in enumerate(items) if i not in drop]
+    return {"items": items, "snapshot": snapshot, "conflicts": conflicts,
+            "added": added, "updated": updated, "removed": removed}
+
+def _merge_take(theirs, ours, fields):
+    # Default's compared fields, plus the user's own extra keys (per-site "ua", ids, ...)
+    if not isinstance(theirs, dict) or not isinstance(ours, dict):
+        return theirs
+    out = dict(theirs)
+    for k, v in ours.items():
+        if k not in out and k not in fields:
+            out[k] = v
+    return out
+
+def resolve_merge_conflicts(lib, result, choices):
+    # choices: {key: "theirs" | "ours"}; keys left out stay unresolved
+    items, snap = result["items"], result["snapshot"]
+    index = {merge_item_key(lib, o): i for i, o in enumerate(items)}
+    fields = MERGE_FIELDS[lib]
+    drop = set()
+    remaining = []
+    for c in result["conflicts"]:
+        choice = choices.get(c["key"])
+        if choice not in ("theirs", "ours"):
+            remaining.append(c)
+            continue
+        t = c["theirs"]
+        if choice == "theirs":
+            i = index.get(c["key"])
+            if t is None:
+                if i is not None:
+                    drop.add(i)
+            elif i is None:
+                items.append(t)
+            else:
+                items[i] = _merge_take(t, items[i], fields)
+        # Either way the current defaults are now "seen"
+        if t is None:
+            snap.pop(c["key"], None)
+        else:
+            snap.update(merge_hashes(lib, [t]))
+    if drop:
+        result["items"] = [o for i, o in enumerate(items) if i not in drop]
+    result["conflicts"] = remaining
+    return result
+
+def load_defaults_snapshot(path=DEFAULTS_SNAPSHOT_PATH):
+    return _read_json_file(path)
+
+def save_defaults_snapshot(data, path=DEFAULTS_SNAPSHOT_PATH):
+    try:
+        tmp = path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        return False
+
+def default_library_items(cfg, lib):
+    # Shipped defaults in the same shape as the user files
+    if lib == "prompts":
+        return _normalize_prompts_list(cfg.get("prompts", []))
+    if lib == "sites":
+        return [s for s in cfg.get("sites", []) if isinstance(s, dict)]
+    return CharacterRepository(cfg.get("characters", [])).names()
+
+# Headless CLI: `sora2-browser-tool.py --cli <command> ...`
+# Runs on the pure helpers above only; PyQt6 is never imported on this path.
+def _read_json_list(path, key):
+    # Read-only counterpart of the load_or_init_* loaders (never seeds or rewrites files)
+    try:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = data.get(key, []) if isinstance(data, dict) else data
+        return items if isinstance(items, list) else None
+    except Exception:
+        return None
+
+# Streaming record I/O for library import/export (JSON, JSONL, CSV, TXT; ".gz" = gzip)
+RECORD_FORMATS = ("json", "jsonl", "csv", "txt")
+RECORD_CSV_FIELDS = {"prompts": ("id", "title", "category", "tags", "text"),
+                     "characters": ("name", "category", "tags")}
+
+def record_format(path, default="json"):
+    stem = path[:-3] if path.endswith(".gz") else path
+    ext = os.path.splitext(stem)[1].lower().lstrip(".")
+    if ext == "ndjson":
+        return "jsonl"
+    return ext if ext in RECORD_FORMATS else default
+
+def _iter_json_items(f, key, chunk=1 << 16):
+    # Items of a top-level array, or of {key: [...]}, decoded one at a time from a text stream.
+    # Any other shape raises ValueError (an empty result would read as "no items").
+    dec = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def more():
+        nonlocal buf, pos, eof
+        data = f.read(chunk)
+        buf, pos, eof = buf[pos:] + data, 0, not data
+
+    while True:
+        more()
+        head = buf.lstrip()[:1]
+        if head == "[":
+            pos = buf.index("[") + 1
+            break
+        m = re.search(r'"%s"\s*:\s*\[' % re.escape(key), buf) if head == "{" else None
+        if m:
+            pos = m.end()
+            break
+        if eof or (head and head != "{"):
+            raise ValueError(f'expected a JSON array or an object with a "{key}" array')
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                return
+            more()
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = dec.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            more()
+            continue
+        if end == len(buf) and not eof:
+            more()  # a value ending exactly at the buffer edge may be cut short
+            continue
+        pos = end
+        yield obj
+
+def _iter_lines(f, sniff_json):
+    # Non-blank lines; with sniff_json, lines that parse as JSON become values
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if sniff_json and line[:1] in "{[\"":
+            try:
+                yield json.loads(line)
+                continue
+            except ValueError:
+                pass
+        yield line
+
+def iter_records(path, key, fmt=None, progress=None, every=1000):
+    # Stream records from a file ("-" = stdin); formats follow the extension, unknown
+    # ones are read as lines with JSON sniffing. progress(done_bytes, total_bytes) is
+    # called every `every` records (compressed bytes for .gz).
+    import io
+    fmt = fmt or record_format(path, None)
+    if path == "-":
+        raw, f, total = None, sys.stdin, 0
+    else:
+        raw = open(path, "rb")
+        total = os.fstat(raw.fileno()).st_size
+        src = raw
+        if path.endswith(".gz"):
+            import gzip
+            src = gzip.GzipFile(fileobj=raw)
+        f = io.TextIOWrapper(src, encoding="utf-8-sig", newline="" if fmt == "csv" else None)
+    try:
+        if fmt == "json":
+            items = _iter_json_items(f, key)
+        elif fmt == "csv":
+            import csv
+            items = csv.DictReader(f)
+        else:
+            items = _iter_lines(f, fmt != "txt")
+        n = 0
+        for rec in items:
+            yield rec
+            n += 1
+            if progress and n % every == 0:
+                progress(raw.tell() if raw is not None else 0, total)
+        if progress:
+            progress(total, total)
+    finally:
+        if raw is not None:
+            f.close()
+            raw.close()
+
+def _record_row(item, fields):
+    row = {k: item.get(k, "") for k in fields} if isinstance(item, dict) else {fields[0]: item}
+    if isinstance(row.get("tags"), list):
+        row["tags"] = ", ".join(map(str, row["tags"]))
+    return row
+
+def write_records(path, key, items, fmt=None, progress=None, should_stop=None, every=1000):
+    # Stream items to path ("-" = stdout) without building the document in memory.
+    # JSON is {key: [...]} with one item per line. Files are written to ".part" and
+    # renamed, so a cancelled or failed export never leaves a truncated file; returns
+    # the item count, or None when should_stop() cancelled it.
+    fmt = fmt or record_format(path)
+    part = None
+    if path == "-":
+        out = sys.stdout
+    else:
+        part = path + ".part"
+        if path.endswith(".gz"):
+            import gzip
+            out = gzip.open(part, "wt", encoding="utf-8", newline="", compresslevel=6)
+        else:
+            out = open(part, "w", encoding="utf-8", newline="")
+    count, ok = 0, False
+    try:
+        if fmt == "csv":
+            import csv
+            fields = RECORD_CSV_FIELDS.get(key)
+            w = None
+        elif fmt == "json":
+            out.write('{"%s": [' % key)
+        for it in items:
+            if fmt == "json":
+                out.write(("\n" if not count else ",\n") + json.dumps(it, ensure_ascii=False))
+            elif fmt == "jsonl":
+                out.write(json.dumps(it, ensure_ascii=False) + "\n")
+            elif fmt == "csv":
+                if w is None:
+                    fields = fields or (tuple(it) if isinstance(it, dict) else ("value",))
+                    w = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore", lineterminator="\n")
+                    w.writeheader()
+                w.writerow(_record_row(it, fields))
+            else:
+                val = it.get("text") or it.get("name") or it.get("url") if isinstance(it, dict) else it
+                out.write(" ".join(str(val or "").split("\n")) + "\n")
+            count += 1
+            if count % every == 0:
+                if progress:
+                    progress(count)
+                if should_stop and should_stop():
+                    return None
+        if fmt == "json":
+            out.write("\n]}\n")
+        elif fmt == "csv" and w is None and fields:
+            csv.DictWriter(out, fieldnames=fields, lineterminator="\n").writeheader()
+        ok = True
+    finally:
+        if part is not None:
+            out.close()
+            if ok:
+                os.replace(part, path)
+                note_own_write(path)
+            else:
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+    if progress:
+        progress(count)
+    return count
+
+def prompt_text_key(text):
+    # Dedupe key for prompt texts: whitespace- and case-insensitive, 8-byte digest
+    import hashlib
+    return hashlib.blake2b(" ".join((text or "").split()).casefold().encode("utf-8"), digest_size=8).digest()
+
+def import_prompt_records(current, records, mode="merge", should_stop=None):
+    # Merge streamed records into a prompt list: "merge" updates same-id prompts and adds
+    # new texts, "append" adds new texts under fresh ids, "replace" keeps only the records.
+    # Texts are deduped by prompt_text_key. Returns (prompt list, stats) or None if cancelled.
+    stats = {"added": 0, "updated": 0, "skipped": 0}
+    if mode == "replace":
+        current = []
+    out = list(current)
+    pos = {o.get("id"): i for i, o in enumerate(out)} if mode == "merge" else {}
+    seen = {prompt_text_key(o.get("text")) for o in out}
+    for n, r in enumerate(records):
+        if should_stop and n % 1000 == 0 and should_stop():
+            return None
+        if isinstance(r, dict) and isinstance(r.get("tags"), str):
+            r = dict(r, tags=[t.strip() for t in r["tags"].split(",") if t.strip()])
+        o = _p_to_obj(r) if not isinstance(r, dict) else r
+        if not isinstance(r, dict) or not r.get("id") or mode == "append":
+            o = dict(o); o.pop("id", None)
+        if not (o.get("text") or o.get("prompt") or "").strip():
+            stats["skipped"] += 1  # blank record (e.g. an empty CSV row)
+            continue
+        k = prompt_text_key(o.get("text") or o.get("prompt"))
+        i = pos.get(o.get("id")) if o.get("id") else None
+        if i is not None:
+            old = out[i]
+            if prompt_text_key(old.get("text")) != k:
+                seen.add(k)
+            given = _p_to_obj(o)  # only the fields the record actually carries
+            out[i] = dict(old, **{f: given[f] for f in ("title", "category", "tags", "text")
+                                  if f in o or (f == "text" and "prompt" in o)})
+            stats["updated"] += 1
+        elif k in seen:
+            stats["skipped"] += 1
+        else:
+            seen.add(k)
+            if o.get("id"):
+                pos[o["id"]] = len(out)
+            out.append(o)
+            stats["added"] += 1
+    if mode == "replace" and not out:
+        raise ValueError("no prompts read; the library was left as it is")
+    return out, stats
+
+def import_character_records(chars, records, mode="merge", clean=sanitize_character_name, should_stop=None):
+    # Fill a CharacterRepository in place (hand a worker chars.copy()): new names are added
+    # in every mode, "merge" also folds imported tags into existing characters and
+    # "replace" starts from an empty list. Returns (chars, stats) or None if cancelled.
+    stats = {"added": 0, "updated": 0, "skipped": 0}
+    # Names the library already knows keep their spelling ("J. R. R. Tolkien"); only new
+    # ones go through clean, so exporting and importing back changes nothing
+    known = chars.known_spellings()
+
+    def keep_known(name):
+        return known.get(_squash_ws(name).casefold()) or clean(name)
+
+    if mode == "replace":
+        chars.replace(())
+    for n, r in enumerate(records):
+        if should_stop and n % 1000 == 0 and should_stop():
+            return None
+        if chars.add(r, keep_known) is not None:
+            stats["added"] += 1
+            continue
+        name = chars.canonical(keep_known(r.get("name", ""))) if mode == "merge" and isinstance(r, dict) and r.get("tags") else None
+        if name:
+            tags = r["tags"].split(",") if isinstance(r["tags"], str) else r["tags"]
+            before = chars.tags_of(name)[1:]
+            if chars.set_tags(name, list(before) + list(tags)) != before:
+                stats["updated"] += 1
+                continue
+        stats["skipped"] += 1
+    if mode == "replace" and not len(chars):
+        raise ValueError("no characters read; the list was left as it is")
+    return chars, stats
+
+class _CliLibrary:
+    # Lazily loaded view of config + user files for CLI commands
+    def __init__(self):
+        self._cfg = None
+        self._prompts = None
+        self._chars = None
+
+    @property
+    def cfg(self):
+        if self._cfg is None:
+            self._cfg = load_config()
+        return self._cfg
+
+    @property
+    def prompts(self):
+        if self._prompts is None:
+            raw = _read_json_list(USER_PROMPTS_PATH, "prompts")
+            self._prompts = PromptRepository(raw if raw else self.cfg.get("prompts", []))
+            PromptJournal(PROMPT_JOURNAL_PATH).replay(self._prompts)
+        return self._prompts
+
+    @property
+    def characters(self):
+        if self._chars is None:
+            self._chars = CharacterRepository(self.cfg.get("characters", []),
+                                              _read_json_list(USER_CHARACTERS_PATH, "characters"))
+        return self._chars
+
+    def sites(self):
+        raw = _read_json_list(USER_SITES_PATH, "sites")
+        return raw if raw is not None else list(self.cfg.get("sites", []))
+
+    def mail_sites(self):
+        raw = _read_json_list(USER_MAIL_SITES_PATH, "mail_sites")
+        return raw if raw is not None else list(self.cfg.get("mail_sites", []))
+
+def _cli_open_out(path):
+    if path in (None, "-"):
+        return sys.stdout, False
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, "wt", encoding="utf-8", newline="\n"), True
+    return open(path, "w", encoding="utf-8", newline="\n"), True
+
+def _cli_render(lib, args):
+    def slot_args(pairs):
+        out = {}
+        for kv in pairs or ():
+            k, sep, v = str(kv).partition("=")
+            if sep:
+                out[placeholder_key(k)] = v
+        return out
+
+    def one(text, chars, values, named=None):
+        return render_prompt_text(text, list(chars or [])[:4] + list(values or []), named)
+
+    def resolve(ref_id, text):
+        if text is not None:
+            return None, text
+        o = lib.prompts.get(ref_id)
+        if o is None:
+            raise KeyError(f"unknown prompt id: {ref_id}")
+        return o.get("id"), o.get("text") or ""
+
+    if args.batch:
+        out, close = _cli_open_out(args.output)
+        src = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+        n = 0
+        try:
+            for line in src:
+                line = line.strip()
+                if not line:
+                    continue
+                req = json.loads(line) if line[:1] == "{" else {"text": line}
+                try:
+                    pid, text = resolve(req.get("id"), req.get("text"))
+                except KeyError as e:
+                    print(str(e), file=sys.stderr)
+                    continue
+                named = slot_args(args.slot)
+                named.update({placeholder_key(k): str(v) for k, v in (req.get("named") or {}).items()})
+                rendered = one(text, req.get("characters") or args.character, req.get("values") or args.value, named)
+                if args.format == "jsonl":
+                    out.write(json.dumps({"id": pid, "text": rendered}, ensure_ascii=False) + "\n")
+                else:
+                    out.write(" ".join(rendered.split("\n")) + "\n")
+                n += 1
+        finally:
+            if src is not sys.stdin:
+                src.close()
+            if close:
+                out.close()
+        print(f"rendered {n}", file=sys.stderr)
+        return 0
+
+    if args.id is None and args.text is None:
+        print("render: pass --id, --text or --batch", file=sys.stderr)
+        return 2
+    try:
+        pid, text = resolve(args.id, args.text)
+    except KeyError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(one(text, args.character, args.value, slot_args(args.slot)))
+    return 0
+
+def search_prompts(prompts, query=(), category=None):
+    # Yields prompts whose title/text/category/tags contain every query term (casefolded)
+    terms = [t.casefold() for t in query if t]
+    cat = category.casefold() if category else None
+    for o in prompts:
+        if cat and (o.get("category") or "Base").casefold() != cat:
+            continue
+        hay = " ".join([o.get("title") or "", o.get("text") or "", o.get("category") or "",
+                        " ".join(str(t) for t in (o.get("tags") or []))]).casefold()
+        if all(t in hay for t in terms):
+            yield o
+
+def _cli_search(lib, args):
+    hits = 0
+    for o in search_prompts(lib.prompts, args.query, args.category):
+        if args.json:
+            print(json.dumps(o, ensure_ascii=False))
+        else:
+            print(f"{o.get('id')}\t{o.get('category') or 'Base'}\t{o.get('title') or ''}")
+        hits += 1
+        if args.limit and hits >= args.limit:
+            break
+    return 0 if hits else 1
+
+def _cli_export(lib, args):
+    if args.what == "prompts":
+        items = lib.prompts.to_list()
+    elif args.what == "characters":
+        items = lib.characters.objects()
+    elif args.what == "sites":
+        items = lib.sites()
+    else:
+        items = lib.mail_sites()
+    n = write_records(args.output, args.what, items, args.format or record_format(args.output))
+    print(f"exported {n} {args.what}", file=sys.stderr)
+    return 0
+
+def _cli_import(lib, args):
+    records = iter_records(args.input, args.what, args.format)
+    try:
+        if args.what == "prompts":
+            items, st = import_prompt_records(lib.prompts.to_list(), records, args.mode)
+            repo = PromptRepository(items)
+        else:
+            repo, st = import_character_records(lib.characters, records, args.mode)
+    except ValueError as e:
+        print(f"import: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.what}: {len(repo)} ({st['added']} added, {st['updated']} updated, "
+          f"{st['skipped']} duplicates skipped)", file=sys.stderr)
+    if not args.dry_run:
+        saved = save_user_prompts(repo.to_list()) if args.what == "prompts" else save_user_characters(repo)
+        return 0 if saved else 1
+    return 0
+
+def _cli_dedupe(lib, args):
+    rc = 0
+    if args.what in ("prompts", "all"):
+        seen = set(); keep = []
+        for o in lib.prompts:
+            key = " ".join((o.get("text") or "").split()).casefold()
+            if key in seen:
+                continue
+            seen.add(key); keep.append(o)
+        print(f"prompts: {len(lib.prompts)} -> {len(keep)}", file=sys.stderr)
+        if not args.dry_run and len(keep) != len(lib.prompts):
+            rc |= 0 if save_user_prompts(keep) else 1
+    if args.what in ("characters", "all"):
+        raw = _read_json_list(USER_CHARACTERS_PATH, "characters") or []
+        chars = CharacterRepository(lib.cfg.get("characters", []), raw)
+        print(f"characters: {len(raw)} -> {len(chars)}", file=sys.stderr)
+        if not args.dry_run and len(chars) != len(raw):
+            rc |= 0 if save_user_characters(chars) else 1
+    return rc
+
+def _bench_characters(lib, n):
+    # Synthetic load: N config defs over 40 categories + 20 tags, a user list with ~10% case/space duplicates
+    import time
+    rnd = random.Random(7)
+    defs = [{"name": f"Name {i}", "category": f"Cat {i % 40}", "tags": [f"Tag {i % 7}", f"Tag {7 + i % 13}"]} for i in range(n)]
+    user = [f"name  {i}" if rnd.random() < 0.1 else f"Name {i}" for i in range(n)]
+    user += [f"NAME {rnd.randrange(n)}" for _ in range(n // 10)] + [{"name": "Mine", "category": "Own"}]
+    t0 = time.perf_counter()
+    chars = CharacterRepository(defs, user).sort()
+    t1 = time.perf_counter()
+    for c in chars.categories():
+        chars.names(c)
+    t2 = time.perf_counter()
+    chars.to_list()
+    t3 = time.perf_counter()
+    chars.tags()
+    t4 = time.perf_counter()
+    mask = chars.query("(Cat 1 OR Cat 2 OR Tag 3) AND NOT Tag 12")
+    counts = chars.facet_counts(mask)
+    hits = chars.names_for(mask)
+    t5 = time.perf_counter()
+    print(f"{len(user)} entries -> {len(chars)} characters in {len(chars.categories())} categories: "
+          f"load {(t1 - t0) * 1000:.0f} ms, per-category lists {(t2 - t1) * 1000:.1f} ms, "
+          f"serialize {(t3 - t2) * 1000:.0f} ms", file=sys.stderr)
+    print(f"tag bitsets {(t4 - t3) * 1000:.0f} ms; query + {len(counts)} facet counts + {len(hits)} names "
+          f"{(t5 - t4) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+def _cli_stats(lib, args):
+    import collections
+    if args.bench:
+        return _bench_characters(lib, args.bench)
+    pcats = collections.Counter((o.get("category") or "Base") for o in lib.prompts)
+    slots = sum(placeholder_count(o.get("text"), named=True) for o in lib.prompts)
+    ccats = collections.Counter({c: len(v) for c, v in lib.characters.groups().items()})
+    sites = lib.sites()
+    report = {
+        "version": lib.cfg.get("version"),
+        "prompts": {"total": len(lib.prompts), "placeholders": slots, "categories": dict(pcats.most_common())},
+        "characters": {"total": len(lib.characters), "categories": dict(ccats.most_common())},
+        "sites": {"total": len(sites)},
+        "mail_sites": {"total": len(lib.mail_sites())},
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0
+    print(f"version     {report['version']}")
+    print(f"prompts     {len(lib.prompts)} in {len(pcats)} categories, {slots} \"\" slots")
+    print(f"characters  {len(lib.characters)} in {len(ccats)} categories")
+    print(f"sites       {len(sites)}")
+    print(f"mail sites  {report['mail_sites']['total']}")
+    return 0
+
+def _cli_matrix(lib, args):
+    prompts = [o for o in lib.prompts if not args.category or (o.get("category") or "Base") in args.category]
+    pools = []
+    for spec in args.pool or []:
+        if spec.casefold() == "none":
+            pools.append([])
+        elif spec.casefold() == "all":
+            pools.append(lib.characters.names())
+        else:
+            # A category name is itself a tag query; "Animals AND NOT Cartoon" works too
+            try:
+                pools.append(lib.characters.names_for(lib.characters.query(spec)))
+            except ValueError as e:
+                print(f"bad pool {spec!r}: {e}", file=sys.stderr)
+                return 2
+    rows = iter_prompt_matrix(prompts, pools, limit=args.limit, sample=args.sample, seed=args.seed)
+    out, close = _cli_open_out(args.output)
+    try:
+        n = write_prompt_matrix(out, rows, args.format)
+    finally:
+        if close:
+            out.close()
+    print(f"wrote {n} of {prompt_matrix_size(prompts, pools)} combinations", file=sys.stderr)
+    return 0
+
+def _cli_bench_api(lib, args):
+    # Load-test a running app's local API: N keep-alive clients, latency percentiles
+    import http.client, threading, time
+    from urllib.parse import urlsplit
+    u = urlsplit(args.url)
+    args.concurrency = max(1, args.concurrency)
+    headers = {"Content-Type": "application/json"}
+    if args.token:
+        headers["Authorization"] = "Bearer " + args.token
+    body = args.body.encode("utf-8") if args.body else None
+    method = args.method or ("POST" if body else "GET")
+    lat, codes, lock = [], {}, threading.Lock()
+    per = [args.requests // args.concurrency + (1 if i < args.requests % args.concurrency else 0)
+           for i in range(args.concurrency)]
+
+    def client(n):
+        conn = http.client.HTTPConnection(u.hostname or "127.0.0.1", u.port or 80, timeout=args.timeout)
+        mine, mcodes = [], {}
+        for _ in range(n):
+            t0 = time.perf_counter()
+            try:
+                conn.request(method, u.path or "/", body=body, headers=headers)
+                r = conn.getresponse(); r.read()
+                code = r.status
+                if r.getheader("Connection", "").lower() == "close":
+                    conn.close()
+            except Exception:
+                code = "error"
+                conn.close()
+            mine.append(time.perf_counter() - t0)
+            mcodes[code] = mcodes.get(code, 0) + 1
+        conn.close()
+        with lock:
+            lat.extend(mine)
+            for k, v in mcodes.items():
+                codes[k] = codes.get(k, 0) + v
+
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in per if n]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    lat.sort()
+
+    def pct(q):
+        return lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+    report = {"requests": len(lat), "concurrency": args.concurrency, "seconds": round(wall, 3),
+              "rps": round(len(lat) / wall, 1) if wall else 0.0,
+              "p50_ms": round(pct(0.50), 2), "p95_ms": round(pct(0.95), 2), "p99_ms": round(pct(0.99), 2),
+              "max_ms": round(lat[-1] * 1000, 2) if lat else 0.0, "status": {str(k): v for k, v in codes.items()}}
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"{method} {args.url}: {report['requests']} requests, c={args.concurrency}, {report['seconds']}s, {report['rps']} req/s")
+        print(f"latency ms  p50 {report['p50_ms']}  p95 {report['p95_ms']}  p99 {report['p99_ms']}  max {report['max_ms']}")
+        print("status      " + "  ".join(f"{k}:{v}" for k, v in sorted(report["status"].items())))
+    return 0 if codes.get(200, 0) == len(lat) else 1
+
+def _cli_blocklist(lib, args):
+    import time
+    bl = DomainBlocklist(DEFAULT_BLOCKLIST)
+    files = list(args.list or [])
+    if not files and os.path.exists(BLOCKLIST_PATH):
+        files.append(BLOCKLIST_PATH)
+    for path in files:
+        n = bl.load_file(path)
+        print(f"{path}: {n} rules", file=sys.stderr)
+    print(f"{len(bl)} blocked domains, {len(bl.allow)} exceptions", file=sys.stderr)
+    for host in args.host:
+        print(f"{host}\t{bl.match(host.lower()) or '-'}")
+    if args.bench:
+        hosts = list(args.host) or ["cdn.assets.example-sora-site.com", "securepubads.g.doubleclick.net",
+                                    "www.google.com", "static.cloudflareinsights.com"]
+        t0 = time.perf_counter()
+        for i in range(args.bench):
+            bl.match(hosts[i % len(hosts)])
+        dt = time.perf_counter() - t0
+        print(f"{args.bench} lookups: {dt * 1e6 / args.bench:.2f} us/lookup", file=sys.stderr)
+    return 0
+
+def _cli_cache(lib, args):
+    ui_cfg = lib.cfg.get("ui") if isinstance(lib.cfg.get("ui"), dict) else {}
+    ac_cfg = ui_cfg.get("asset_cache") if isinstance(ui_cfg.get("asset_cache"), dict) else {}
+    cache = AssetCache(args.dir or ASSET_CACHE_DIR, int(ac_cfg.get("max_mb", 512)) * 1024 * 1024)
+    if args.action == "clear":
+        cache.clear()
+        print("cleared", file=sys.stderr)
+        return 0
+    rc = 0
+    for url in args.url:
+        if args.action != "fetch":
+            break
+        if not is_immutable_asset_url(url):
+            print(f"SKIP\t{url}\t(not a content-hashed asset URL)")
+            continue
+        hit = cache.get(url)
+        if hit is not None:
+            print(f"HIT\t{url}\t{len(hit[1])} bytes")
+            continue
+        res = fetch_asset(url)
+        if res["status"] != 200:
+            print(f"FAIL\t{url}\t{res['status']} {res.get('error', '')}")
+            rc = 1
+            continue
+        stored = res["cacheable"] and cache.put(url, res["ctype"], res["data"])
+        print(f"MISS\t{url}\t{len(res['data'])} bytes\t{'stored' if stored else 'not cacheable'}")
+    if cache.dirty:
+        cache.save()
+    st = cache.stats
+    print(f"entries {len(cache.entries)}, {cache.size / 1048576:.1f} of {cache.max_bytes / 1048576:.0f} MB; "
+          f"hits {st['hits']}, misses {st['misses']}, ratio {cache.hit_ratio():.0%}, "
+          f"saved {st['bytes_saved'] / 1048576:.1f} MB, evicted {st['evicted']}", file=sys.stderr)
+    return rc
+
+def _cli_merge(lib, args):
+    import time
+    if args.bench:
+        n = args.bench
+        rnd = random.Random(7)
+        base_items = [{"id": f"d{i}", "title": f"T{i}", "category": "Base", "tags": [], "text": f"text {i}"} for i in range(n)]
+        new_defaults = [dict(o, text=o["text"] + " v2") if rnd.random() < 0.05 else o
+                        for o in base_items if rnd.random() >= 0.02]
+        new_defaults += [{"id": f"n{i}", "title": f"N{i}", "category": "New", "tags": [], "text": f"new {i}"} for i in range(n // 30)]
+        user = [dict(o, title=o["title"] + "*") if rnd.random() < 0.03 else o
+                for o in base_items if rnd.random() >= 0.01]
+        user += [{"id": f"u{i}", "title": f"U{i}", "category": "Mine", "tags": [], "text": f"mine {i}"} for i in range(n // 100)]
+        snapshot = merge_hashes("prompts", base_items)
+        t0 = time.perf_counter()
+        res = three_way_merge("prompts", snapshot, new_defaults, user)
+        dt = time.perf_counter() - t0
+        print(f"{n} base / {len(new_defaults)} defaults / {len(user)} user: {dt * 1000:.0f} ms; "
+              f"{res['added']} added, {res['updated']} updated, {res['removed']} removed, {len(res['conflicts'])} conflicts")
+        return 0
+    snap = load_defaults_snapshot() or {}
+    libs = ("prompts", "sites", "characters") if args.what == "all" else (args.what,)
+    for name in libs:
+        defaults = default_library_items(lib.cfg, name)
+        if not isinstance(snap.get(name), dict):
+            snap[name] = merge_hashes(name, defaults)
+            print(f"{name}: baseline recorded ({len(snap[name])} defaults)")
+            continue
+        if name == "prompts":
+            user = lib.prompts.to_list()
+        elif name == "sites":
+            user = lib.sites()
+        else:
+            user = lib.characters.to_list()
+        res = three_way_merge(name, snap[name], defaults, user)
+        print(f"{name}: {res['added']} added, {res['updated']} updated, {res['removed']} removed, "
+              f"{len(res['conflicts'])} conflict(s)")
+        for c in res["conflicts"]:
+            print(f"  {c['kind']}\t{c['key']}")
+        if args.dry_run:
+            continue
+        if res["added"] or res["updated"] or res["removed"]:
+            items = res["items"]
+            if name == "prompts":
+                save_user_prompts(items)
+            elif name == "sites":
+                for i, s in enumerate(items, start=1):
+                    s["id"] = i
+                save_user_sites(items)
+            else:
+                save_user_characters(lib.characters.replace(items).sort())
+        snap[name] = res["snapshot"]
+    if not args.dry_run:
+        snap["version"] = str(lib.cfg.get("version", ""))
+        save_defaults_snapshot(snap)
+    return 0
+
+def _cli_update(lib, args):
+    import time
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if args.apply:
+        deadline = time.monotonic() + max(0.0, args.wait)
+        while True:
+            res = apply_pending_update(base_dir)
+            if res != "deferred" or time.monotonic() >= deadline:
+                break
+            time.sleep(0.5)
+        print(res)
+        return 0 if res in ("none", "applied") else 1
+    ui_cfg = lib.cfg.get("ui") if isinstance(lib.cfg.get("ui"), dict) else {}
+    url = args.url or ui_cfg.get("update_url") or UPDATE_BASE_URL
+
+    def prog(name, done, total):
+        print(f"\r{name}: {done // 1024} of {total // 1024 if total else '?'} KB", end="", file=sys.stderr)
+
+    res = run_update(url, base_dir, lib.cfg.get("version", "0.0.0"), check_only=args.check,
+                     force=args.force, progress=None if args.json else prog, timeout=args.timeout)
+    if args.json:
+        print(json.dumps(res))
+    else:
+        if res.get("fetched") is not None:
+            print(file=sys.stderr)
+        print(f"{res['status']}: local {res['local']}, remote {res['version']}"
+              + (f", files {', '.join(res['files'])}" if res["files"] else "")
+              + (" (legacy check, no manifest)" if res["legacy"] else ""))
+    return 0
+
+def cli_main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(prog="sora2-browser-tool.py --cli",
+                                 description="Headless prompt/character tools (no Qt).")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("render", help="fill \"\" and \"{name}\" placeholders of a prompt")
+    p.add_argument("--id"); p.add_argument("--text")
+    p.add_argument("-c", "--character", action="append", default=[], help="character 1-4 (repeatable)")
+    p.add_argument("--value", action="append", default=[], help="extra placeholder value (repeatable)")
+    p.add_argument("--slot", action="append", default=[], metavar="NAME=VALUE", help="named \"{NAME}\" value (repeatable)")
+    p.add_argument("--batch", help="JSONL requests {id|text, characters, values, named} or text lines; '-' = stdin")
+    p.add_argument("--format", choices=("text", "jsonl"), default="text")
+    p.add_argument("-o", "--output", default="-")
+    p.set_defaults(fn=_cli_render)
+
+    p = sub.add_parser("search", help="find prompts (all terms must match)")
+    p.add_argument("query", nargs="*")
+    p.add_argument("--category"); p.add_argument("--limit", type=int, default=0)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(fn=_cli_search)
+
+    p = sub.add_parser("export", help="write a library to a file")
+    p.add_argument("output", nargs="?", default="-")
+    p.add_argument("--what", choices=("prompts", "characters", "sites", "mail_sites"), default="prompts")
+    p.add_argument("--format", choices=RECORD_FORMATS, help="default: from the extension (.gz = gzip), else json")
+    p.set_defaults(fn=_cli_export)
+
+    p = sub.add_parser("import", help="load prompts/characters into the user files")
+    p.add_argument("input")
+    p.add_argument("--what", choices=("prompts", "characters"), default="prompts")
+    p.add_argument("--mode", choices=("merge", "append", "replace"), default="merge")
+    p.add_argument("--format", choices=RECORD_FORMATS, help="default: from the extension (.gz = gzip)")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(fn=_cli_import)
+
+    p = sub.add_parser("dedupe", help="drop duplicate prompts (by text) / characters (by name)")
+    p.add_argument("--what", choices=("prompts", "characters", "all"), default="all")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(fn=_cli_dedupe)
+
+    p = sub.add_parser("stats", help="library summary")
+    p.add_argument("--json", action="store_true")
+    p.add_argument("--bench", type=int, default=0, help="time loading N synthetic characters instead")
+    p.set_defaults(fn=_cli_stats)
+
+    p = sub.add_parser("matrix", help="stream prompts x character pools (see Prompts -> Generate Matrix)")
+    p.add_argument("output", nargs="?", default="-")
+    p.add_argument("--category", action="append", help="prompt category (repeatable; default all)")
+    p.add_argument("--pool", action="append", help="per slot: character category or tag query, 'all' or 'none'")
+    p.add_argument("--limit", type=int); p.add_argument("--sample", action="store_true")
+    p.add_argument("--seed", type=int); p.add_argument("--format", choices=("jsonl", "txt"), default="jsonl")
+    p.set_defaults(fn=_cli_matrix)
+
+    p = sub.add_parser("blocklist", help="check hosts against the ad/tracker blocklist")
+    p.add_argument("host", nargs="*")
+    p.add_argument("--list", action="append", help="hosts/ABP file (default: sora2_blocklist.txt if present)")
+    p.add_argument("--bench", type=int, default=0, help="time N lookups")
+    p.set_defaults(fn=_cli_blocklist)
+
+    p = sub.add_parser("cache", help="inspect / exercise the shared static-asset cache")
+    p.add_argument("action", choices=("stats", "fetch", "clear"))
+    p.add_argument("url", nargs="*")
+    p.add_argument("--dir", help="cache directory (default: sora2_asset_cache)")
+    p.set_defaults(fn=_cli_cache)
+
+    p = sub.add_parser("merge", help="three-way merge updated defaults into the user files (conflicts are only listed)")
+    p.add_argument("--what", choices=("prompts", "sites", "characters", "all"), default="all")
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--bench", type=int, default=0, help="time a synthetic merge of N prompts instead")
+    p.set_defaults(fn=_cli_merge)
+
+    p = sub.add_parser("update", help="check / download / apply an update (see Check For Updates)")
+    p.add_argument("--check", action="store_true", help="only report what would be downloaded")
+    p.add_argument("--apply", action="store_true", help="swap in staged .tmp files")
+    p.add_argument("--wait", type=float, default=0.0, help="with --apply: keep retrying locked files for N s")
+    p.add_argument("--url", help="update base URL (default: ui.update_url or the GitHub raw URL)")
+    p.add_argument("--force", action="store_true", help="ignore the version number, compare hashes only")
+    p.add_argument("--timeout", type=float, default=15.0)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(fn=_cli_update)
+
+    p = sub.add_parser("bench-api", help="load-test the running app's local API (Tools -> Local API)")
+    p.add_argument("url", nargs="?", default="http://127.0.0.1:8765/api/status")
+    p.add_argument("-n", "--requests", type=int, default=2000)
+    p.add_argument("-c", "--concurrency", type=int, default=8)
+    p.add_argument("-X", "--method"); p.add_argument("--body", help="JSON request body")
+    p.add_argument("--token"); p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(fn=_cli_bench_api)
+
+    args = ap.parse_args(argv)
+    try:
+        return args.fn(_CliLibrary(), args)
+    except BrokenPipeError:
+        return 0
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+# Headless entry point: handled before the dependency bootstrap and PyQt6 imports
+if __name__ == "__main__" and "--cli" in sys.argv[1:]:
+    _argv = list(sys.argv[1:]); _argv.remove("--cli")
+    sys.exit(cli_main(_argv))
+
+try:
+    _check_dependencies()
+except Exception:
+    pass
+
+# GUI-only stdlib imports (kept off the CLI startup path)
+import tempfile, mimetypes, pathlib, webbrowser, collections, time, threading, concurrent.futures
+from urllib.parse import urlparse, parse_qs
+
+from PyQt6.QtCore import (Qt, QUrl, QSize, QProcess, QThread, QTimer, QObject, QBuffer, QByteArray, QIODevice, pyqtSignal,
+    QFileSystemWatcher)
+from PyQt6.QtWidgets import (QTextEdit,
+    QApplication, QMainWindow, QSplitter, QWidget, QVBoxLayout, QHBoxLayout,
+    QListWidget, QListWidgetItem, QPushButton, QLineEdit, QComboBox, QLabel,
+    QMessageBox, QInputDialog, QTabWidget, QCheckBox, QCompleter, QFileDialog,
+    QSizePolicy, QWidgetAction, QDialog, QDialogButtonBox, QFormLayout, QSpinBox,
+    QProgressDialog, QTableWidget, QTableWidgetItem, QHeaderView, QProgressBar, QScrollArea
+)
+from PyQt6.QtWebEngineCore import (QWebEngineSettings, QWebEngineProfile, QWebEnginePage, QWebEngineDownloadRequest,
+    QWebEngineScript, QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo, QWebEngineUrlSchemeHandler,
+    QWebEngineUrlScheme, QWebEngineUrlRequestJob)
+from PyQt6.QtWebEngineWidgets import QWebEngineView
+from PyQt6.QtGui import QDesktopServices, QTextCursor
+from PyQt6.QtNetwork import QTcpServer, QHostAddress
+
+# Cloudflare/Turnstile compatibility flags (GPU + third-party cookies)
+# Must be set before QtWebEngine starts
+os.environ.setdefault(
+    "QTWEBENGINE_CHROMIUM_FLAGS",
+    "--enable-gpu --ignore-gpu-blocklist --enable-webgl --enable-accelerated-video-decode "
+    "--disable-features=BlockThirdPartyCookies,ThirdPartyStoragePartitioning"
+)
+
+def _qt_notify(level, title, message):
+    if level == "critical":
+        QMessageBox.critical(None, title, message)
+    elif level == "warning":
+        QMessageBox.warning(None, title, message)
+    else:
+        QMessageBox.information(None, title, message)
 
-def sanitize_character_name(name: str) -> str:
-    s = re.sub(r"[^A-Za-z0-9 '\-]", "", str(name))
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+_notify_hook = _qt_notify
+
+# Page timing probes (run in the ApplicationWorld, invisible to page scripts).
+# The observer must exist from document creation for LCP to be reported.
+PERF_OBSERVER_JS = (
+    "(function(){try{window.__sora2Lcp=0;new PerformanceObserver(function(l){var e=l.getEntries();"
+    "if(e.length)window.__sora2Lcp=e[e.length-1].startTime;})"
+    ".observe({type:'largest-contentful-paint',buffered:true});}catch(e){}})();"
+)
+PERF_COLLECT_JS = (
+    "(function(){var r={};try{var n=performance.getEntriesByType('navigation')[0];"
+    "if(n){r.ttfb=n.responseStart-n.startTime;r.dcl=n.domContentLoadedEventEnd-n.startTime;"
+    "r.onload=n.loadEventEnd-n.startTime;}else if(performance.timing){var t=performance.timing;"
+    "r.ttfb=t.responseStart-t.navigationStart;r.dcl=t.domContentLoadedEventEnd-t.navigationStart;"
+    "r.onload=t.loadEventEnd-t.navigationStart;}}catch(e){}"
+    "if(window.__sora2Lcp)r.lcp=window.__sora2Lcp;return JSON.stringify(r);})()"
+)
+
+# navigator overrides for sites with their own UA (site record "ua"): userAgent,
+# appVersion and platform follow the UA the interceptor sends for them, userAgentData
+# its client hints (undefined for Firefox/Safari UAs). Frames match on the top-level
+# host, as the interceptor does (first-party URL). __CFG__ is {site base: entry}
+# (entries from ua_navigator_js). The profile UA needs no script: setHttpUserAgent
+# already covers navigator.userAgent there.
+UA_OVERRIDE_JS = (
+    "(function(c){try{var a=location.ancestorOrigins,h=(a&&a.length?new URL(a[a.length-1]).hostname:location.hostname)"
+    ".replace(/^www\\./,''),e=null;"
+    "while(h){if(c[h]){e=c[h];break;}var i=h.indexOf('.');if(i<0)break;h=h.slice(i+1);}"
+    "if(!e)return;var P=Navigator.prototype,d=function(v){return{get:function(){return v;},configurable:true};};"
+    "Object.defineProperty(P,'userAgent',d(e.ua));Object.defineProperty(P,'appVersion',d(e.ua.replace(/^Mozilla\\//,'')));"
+    "if(e.platform)Object.defineProperty(P,'platform',d(e.platform));"
+    "var u;if(e.brands){var lo={brands:e.brands,mobile:e.mobile,platform:e.chPlatform};"
+    "u={brands:e.brands,mobile:e.mobile,platform:e.chPlatform,toJSON:function(){return lo;},"
+    "getHighEntropyValues:function(){var r=Object.assign({},lo);r.uaFullVersion=e.brands[0].version;"
+    "r.fullVersionList=e.brands;return Promise.resolve(r);}};}"
+    "Object.defineProperty(P,'userAgentData',d(u));}catch(x){}})(__CFG__);"
+)
 
-def save_user_characters(characters):
-    try:
-        with open(USER_CHARACTERS_PATH, "w", encoding="utf-8") as f:
-            json.dump({"characters": characters}, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception:
-        return False
 class Browser(QWebEngineView):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -394,51 +3770,807 @@ class Browser(QWebEngineView):
         s.setAttribute(QWebEngineSettings.WebAttribute.JavascriptCanOpenWindows, True)
         s.setAttribute(QWebEngineSettings.WebAttribute.JavascriptCanAccessClipboard, True)
 
-def load_or_init_user_characters(default_characters):
-    # Load user characters from USER_CHARACTERS_PATH; if missing/empty, seed with defaults and persist.
+class _LazyTab(QWidget):
+    # Stand-in for a restored session tab: holds url/zoom/profile without a renderer.
+    # Main._materialize_tab swaps in a real Browser the first time the tab is shown.
+    def __init__(self, url, title="", private=False, zoom=1.0, parent=None):
+        super().__init__(parent)
+        self._url = QUrl(url)
+        self._title = title or ""
+        self.private = bool(private)
+        self._zoom = float(zoom or 1.0)
+        lay = QVBoxLayout(self)
+        lab = QLabel(f"{self._title or url}\n\n(loads when selected)")
+        lab.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        lab.setWordWrap(True)
+        lay.addWidget(lab)
+
+    def url(self):
+        return QUrl(self._url)
+
+    def setUrl(self, url):
+        self._url = QUrl(url)
+
+    def title(self):
+        return self._title
+
+    def reload(self):
+        pass  # nothing loaded yet; current settings apply when materialized
+
+    def zoomFactor(self):
+        return self._zoom
+
+    def setZoomFactor(self, z):
+        self._zoom = float(z)
+
+ASSET_SCHEME = b"sora2cache"
+
+def _register_asset_scheme():
+    # Custom schemes must be registered before QApplication exists
     try:
-        if os.path.exists(USER_CHARACTERS_PATH):
-            with open(USER_CHARACTERS_PATH, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, dict):
-                characters = data.get("characters", [])
-            elif isinstance(data, list):
-                characters = data
-            else:
-                characters = []
+        sch = QWebEngineUrlScheme(ASSET_SCHEME)
+        sch.setSyntax(QWebEngineUrlScheme.Syntax.HostAndPort)
+        sch.setDefaultPort(443)
+        sch.setFlags(QWebEngineUrlScheme.Flag.SecureScheme | QWebEngineUrlScheme.Flag.CorsEnabled
+                     | QWebEngineUrlScheme.Flag.FetchApiAllowed)
+        QWebEngineUrlScheme.registerScheme(sch)
+    except Exception:
+        pass
+
+class AssetCacheHandler(QWebEngineUrlSchemeHandler):
+    # Serves sora2cache://host/path (an https asset URL with the scheme swapped, so relative
+    # references inside CSS/JS still resolve) from AssetCache. Misses are fetched without
+    # cookies on a small pool and answered back on the GUI thread.
+    _fetched = pyqtSignal(object, str, object)
+
+    def __init__(self, cache, interceptor, user_agent=None, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.interceptor = interceptor
+        self.user_agent = user_agent or (lambda: None)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=6)
+        self._fetched.connect(self._on_fetched)
+
+    def origin_url(self, qurl):
+        u = QUrl(qurl)
+        u.setScheme("http" if u.authority() in self.interceptor.http_hosts else "https")
+        return u.toString()
+
+    def requestStarted(self, job):
+        url = self.origin_url(job.requestUrl())
+        hit = self.cache.get(url)
+        if hit is not None:
+            self._reply(job, *hit)
+            return
+        try:
+            ref = job.initiator().toString()
+        except Exception:
+            ref = ""
+        self._pool.submit(self._fetch, job, url, (ref + "/") if ref and ref != "null" else None, self.user_agent())
+
+    def _fetch(self, job, url, referer, ua):
+        self._fetched.emit(job, url, fetch_asset(url, referer=referer, user_agent=ua))
+
+    def _on_fetched(self, job, url, res):
+        if res["status"] != 200:
+            self.interceptor.cache_skip.add(url)  # let the engine handle it normally next time
+            try:
+                job.fail(QWebEngineUrlRequestJob.Error.RequestFailed)
+            except RuntimeError:
+                pass
+            return
+        if not (res["cacheable"] and self.cache.put(url, res["ctype"], res["data"])):
+            self.interceptor.cache_skip.add(url)
+        self._reply(job, res["ctype"], res["data"])
+
+    def _reply(self, job, ctype, data):
+        try:
+            if hasattr(job, "setAdditionalResponseHeaders"):
+                job.setAdditionalResponseHeaders({QByteArray(b"Access-Control-Allow-Origin"): QByteArray(b"*")})
+            buf = QBuffer(job)
+            buf.setData(data)
+            buf.open(QIODevice.OpenModeFlag.ReadOnly)
+            job.reply(ctype.split(";")[0].strip().encode("latin-1") or b"application/octet-stream", buf)
+        except RuntimeError:
+            pass  # request was cancelled (tab closed / navigated away)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+class RequestInterceptor(QWebEngineUrlRequestInterceptor):
+    # Installed on both profiles; interceptRequest runs for every subresource, so it only
+    # does two host normalisations and a DomainBlocklist.match(). Main frames are never
+    # blocked. Counters are per first-party host (i.e. per site shown in a tab).
+    # Rough transfer sizes per blocked resource type, for the "saved" estimate
+    EST_BYTES = {"ResourceTypeScript": 40000, "ResourceTypeImage": 25000, "ResourceTypeSubFrame": 60000,
+                 "ResourceTypeStylesheet": 15000, "ResourceTypeFontResource": 30000, "ResourceTypeMedia": 250000,
+                 "ResourceTypeXhr": 3000, "ResourceTypePing": 500, "ResourceTypeBeacon": 500}
+
+    def __init__(self, blocklist, parent=None):
+        super().__init__(parent)
+        self.blocklist = blocklist  # swapped wholesale when lists are reloaded
+        self.enabled = True
+        self.allow_sites = set()  # first-party bases where nothing is blocked
+        self.blocked = {}  # first-party base -> [requests, estimated bytes]
+        self.total = 0
+        self.site_headers = {}  # site base -> [(name, value)] UA + client hints (site record "ua")
+        # Asset cache redirect (see AssetCacheHandler)
+        self.cache_enabled = False
+        self.cache_skip = set()  # URLs the origin marked uncacheable (or failed): leave alone
+        self.http_hosts = set()  # authorities redirected from plain http
+        RT = QWebEngineUrlRequestInfo.ResourceType
+        self._main_frame = getattr(RT, "ResourceTypeMainFrame", None)
+        self._est = {getattr(RT, k): v for k, v in self.EST_BYTES.items() if hasattr(RT, k)}
+        # Worker scripts are fetched same-origin only, so a redirect to another scheme fails
+        # them; they are never cached. The redirected assets load from the sora2cache:
+        # scheme, which a page whose CSP lists script-src/style-src/font-src sources
+        # without it will refuse (turn the cache off for such sites).
+        self._cache_types = {getattr(RT, k) for k in ("ResourceTypeScript", "ResourceTypeStylesheet",
+                                                       "ResourceTypeFontResource") if hasattr(RT, k)}
+
+    def interceptRequest(self, info, profile_headers=()):
+        try:
+            rt = info.resourceType()
+            url = info.requestUrl()
+            fp = (url if rt == self._main_frame else info.firstPartyUrl()).host()
+            if fp.startswith("www."):
+                fp = fp[4:]
+            # A site's own UA headers replace the profile's (a Firefox/Safari site UA
+            # must not carry the profile's Chromium client hints)
+            hs = lookup_host_suffix(self.site_headers, fp) if self.site_headers else None
+            for k, v in (hs or profile_headers):
+                info.setHttpHeader(k, v)
+            if rt == self._main_frame:
+                return
+            if self.enabled:
+                if fp not in self.allow_sites and self.blocklist.match(url.host()) is not None:
+                    info.block(True)
+                    row = self.blocked.get(fp)
+                    if row is None:
+                        row = self.blocked[fp] = [0, 0]
+                    row[0] += 1
+                    row[1] += self._est.get(rt, 5000)
+                    self.total += 1
+                    return
+            if self.cache_enabled and rt in self._cache_types:
+                s = url.toString()
+                if s not in self.cache_skip and is_immutable_asset_url(s) and bytes(info.requestMethod()) == b"GET":
+                    if url.scheme() == "http":
+                        self.http_hosts.add(url.authority())
+                    cached = QUrl(url)
+                    cached.setScheme(ASSET_SCHEME.decode())
+                    info.redirect(cached)
+        except Exception:
+            pass
+
+class ProfileInterceptor(QWebEngineUrlRequestInterceptor):
+    # One per profile: hands every request to the shared RequestInterceptor with that
+    # profile's UA + client-hint headers, stamped unless a site override applies.
+    def __init__(self, inner, parent=None):
+        super().__init__(parent)
+        self.inner = inner
+        self.headers = []  # [(name, value)] bytes; empty = engine defaults
+
+    def interceptRequest(self, info):
+        self.inner.interceptRequest(info, self.headers)
+
+class LoadScheduler(QObject):
+    # FIFO of page-load jobs with at most `limit` in flight. A job is a callable that
+    # starts a load and returns the QWebEngineView to watch (or None if nothing to wait
+    # for); its slot frees on loadFinished, on timeout, or when the view is destroyed.
+    changed = pyqtSignal()
+
+    def __init__(self, limit=4, timeout_ms=30000, parent=None):
+        super().__init__(parent)
+        self.limit = max(1, int(limit))
+        self.timeout_ms = max(1000, int(timeout_ms))
+        self._queue = collections.deque()
+        self._active = {}  # job id -> job
+        self._seq = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.durations = collections.deque(maxlen=200)  # seconds, most recent loads
+
+    def submit(self, start):
+        self._queue.append(start)
+        self._pump()
+
+    def cancel_pending(self):
+        n = len(self._queue)
+        self._queue.clear()
+        self.changed.emit()
+        return n
+
+    def queued(self):
+        return len(self._queue)
+
+    def active(self):
+        return len(self._active)
+
+    def stats(self):
+        d = sorted(self.durations)
+        return {"active": len(self._active), "queued": len(self._queue), "completed": self.completed,
+                "timeouts": self.timeouts, "p50": d[len(d) // 2] if d else None,
+                "p95": d[min(len(d) - 1, int(len(d) * 0.95))] if d else None}
+
+    def _pump(self):
+        while self._queue and len(self._active) < self.limit:
+            start = self._queue.popleft()
+            try:
+                view = start()
+            except Exception:
+                view = None
+            if view is None:
+                continue
+            self._seq += 1
+            job = {"id": self._seq, "view": view, "t0": time.monotonic(), "conns": []}
+            self._active[job["id"]] = job
+            try:
+                job["conns"].append((view.loadStarted, view.loadStarted.connect(lambda j=job: j.update(t0=time.monotonic()))))
+                job["conns"].append((view.loadFinished, view.loadFinished.connect(lambda ok, j=job: self._finish(j, False))))
+                job["conns"].append((view.destroyed, view.destroyed.connect(lambda *_, j=job: self._finish(j, False, gone=True))))
+            except Exception:
+                pass
+            QTimer.singleShot(self.timeout_ms, lambda j=job: self._finish(j, True))
+        self.changed.emit()
+
+    def _finish(self, job, timed_out, gone=False):
+        if self._active.pop(job["id"], None) is None:
+            return
+        if not gone:
+            for sig, conn in job["conns"]:
+                try:
+                    sig.disconnect(conn)
+                except Exception:
+                    pass
+        job["view"] = None
+        if timed_out:
+            self.timeouts += 1
         else:
-            characters = list(default_characters)
-            with open(USER_CHARACTERS_PATH, "w", encoding="utf-8") as f:
-                json.dump({"characters": characters}, f, indent=2, ensure_ascii=False)
-        if not isinstance(characters, list):
-            characters = []
-        characters = [(" ".join(str(x).split())).strip() for x in characters if isinstance(x, str) and x.strip()]
-        characters = sorted(set(characters), key=lambda s: s.lower())
-        return characters
-    except Exception as e:
+            self.completed += 1
+            if not gone:
+                self.durations.append(time.monotonic() - job["t0"])
+        self._pump()
+
+class MatrixExportWorker(QThread):
+    # Streams iter_prompt_matrix() rows to a file off the GUI thread.
+    progress = pyqtSignal(int)
+    done = pyqtSignal(int, str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, fmt, prompts, pools, limit, sample, seed=None, distinct_names=True, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.fmt = fmt
+        self.prompts = prompts
+        self.pools = pools
+        self.limit = limit
+        self.sample = sample
+        self.seed = seed
+        self.distinct_names = distinct_names
+
+    def run(self):
+        try:
+            rows = iter_prompt_matrix(self.prompts, self.pools, limit=self.limit, sample=self.sample,
+                                      seed=self.seed, distinct_names=self.distinct_names)
+            n = write_prompt_matrix(self.path, rows, self.fmt, progress=self.progress.emit,
+                                    should_stop=self.isInterruptionRequested)
+            self.done.emit(n, self.path)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class LibraryTransferWorker(QThread):
+    # Runs job(progress, should_stop) off the GUI thread; progress is per mille, and
+    # done carries the job's result (None when it was cancelled).
+    progress = pyqtSignal(int)
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+        self._last = -1
+
+    def _progress(self, permille):
+        permille = max(0, min(1000, int(permille)))
+        if permille != self._last:
+            self._last = permille
+            self.progress.emit(permille)
+
+    def run(self):
+        try:
+            self.done.emit(self.job(self._progress, self.isInterruptionRequested))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class UpdateWorker(QThread):
+    # run_update() off the GUI thread; progress is throttled to ~1% steps
+    progress = pyqtSignal(str, int, int)
+    done = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self, base_url, local_version, check_only=False, force=False, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url
+        self.local_version = local_version
+        self.check_only = check_only
+        self.force = force
+        self._last = (None, -1)
+
+    def _progress(self, name, done, total):
+        step = done * 100 // total if total else done >> 18
+        if (name, step) != self._last:
+            self._last = (name, step)
+            self.progress.emit(name, done, total)
+
+    def run(self):
+        try:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            self.done.emit(run_update(self.base_url, base_dir, self.local_version, check_only=self.check_only,
+                                      force=self.force, progress=self._progress,
+                                      should_stop=self.isInterruptionRequested))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+_HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+                 405: "Method Not Allowed", 413: "Payload Too Large", 415: "Unsupported Media Type",
+                 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+                 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+class ApiRequest:
+    # One parsed HTTP request handed to a LocalApiServer route
+    __slots__ = ("method", "path", "query", "headers", "body", "_server", "_sock", "_deferred")
+
+    def __init__(self, server, sock, method, path, query, headers, body):
+        self._server = server
+        self._sock = sock
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self._deferred = False
+
+    def json(self):
+        if not self.body:
+            return {}
+        data = json.loads(self.body.decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        return data
+
+    def defer(self):
+        # Route answers later via respond(); the socket stays parked, the Qt loop keeps running
+        self._deferred = True
+        return self
+
+    def respond(self, status, payload):
+        self._server._finish(self._sock, status, payload)
+
+class LocalApiServer(QObject):
+    # Minimal HTTP/1.1 JSON server on 127.0.0.1, driven entirely by the Qt event loop.
+    # Requests are parsed incrementally per socket, queued, and drained a few per tick so
+    # scripts can't starve the UI; deferred routes (long-poll, page JS) count as in-flight.
+    MAX_HEADER = 16 * 1024
+    MAX_BODY = 1024 * 1024
+    BATCH = 16
+
+    def __init__(self, routes, port=8765, token="", max_connections=32, max_queue=64, max_inflight=16, parent=None):
+        super().__init__(parent)
+        self.routes = routes
+        self.port = int(port)
+        self.token = token or ""
+        self.max_connections = max(1, int(max_connections))
+        self.max_queue = max(1, int(max_queue))
+        self.max_inflight = max(1, int(max_inflight))
+        self.served = 0
+        self.rejected = 0
+        self._server = QTcpServer(self)
+        self._server.newConnection.connect(self._on_new_connection)
+        self._conns = {}  # socket -> {"buf": bytearray, "busy": bool}
+        self._queue = collections.deque()
+        self._inflight = 0
+        self._drain = QTimer(self)
+        self._drain.setInterval(0)
+        self._drain.timeout.connect(self._drain_queue)
+
+    def start(self):
+        if self._server.isListening():
+            return True
+        return self._server.listen(QHostAddress(QHostAddress.SpecialAddress.LocalHost), self.port)
+
+    def stop(self):
+        self._server.close()
+        self._drain.stop()
+        self._queue.clear()
+        for sock in list(self._conns):
+            try:
+                sock.abort()
+            except Exception:
+                pass
+        self._conns.clear()
+        self._inflight = 0
+
+    def is_running(self):
+        return self._server.isListening()
+
+    def error_string(self):
+        return self._server.errorString()
+
+    def stats(self):
+        return {"connections": len(self._conns), "queued": len(self._queue), "inflight": self._inflight,
+                "served": self.served, "rejected": self.rejected}
+
+    def _on_new_connection(self):
+        while self._server.hasPendingConnections():
+            sock = self._server.nextPendingConnection()
+            if sock is None:
+                break
+            if len(self._conns) >= self.max_connections:
+                self.rejected += 1
+                sock.disconnected.connect(sock.deleteLater)  # never tracked in _conns
+                self._write(sock, 503, {"error": "too many connections"}, close=True)
+                continue
+            self._conns[sock] = {"buf": bytearray(), "busy": False, "close": False}
+            sock.readyRead.connect(lambda s=sock: self._on_ready_read(s))
+            sock.disconnected.connect(lambda s=sock: self._on_disconnected(s))
+
+    def _on_disconnected(self, sock):
+        self._conns.pop(sock, None)
+        sock.deleteLater()
+
+    def _on_ready_read(self, sock):
+        st = self._conns.get(sock)
+        if st is None:
+            return
+        st["buf"] += bytes(sock.readAll())
+        self._parse(sock, st)
+
+    def _parse(self, sock, st):
+        # One request per socket at a time keeps keep-alive responses in order
+        if st["busy"]:
+            return
+        buf = st["buf"]
+        end = buf.find(b"\r\n\r\n")
+        if end < 0:
+            if len(buf) > self.MAX_HEADER:
+                self._write(sock, 431, {"error": "headers too large"}, close=True)
+            return
+        try:
+            head = bytes(buf[:end]).decode("latin-1").split("\r\n")
+            method, target, version = head[0].split(" ", 2)
+            headers = {}
+            for line in head[1:]:
+                k, _, v = line.partition(":")
+                headers[k.strip().lower()] = v.strip()
+            length = int(headers.get("content-length") or 0)
+            if length < 0:
+                raise ValueError("negative Content-Length")
+        except Exception:
+            st["busy"] = True  # closing: nothing after a malformed head is parsed
+            self._write(sock, 400, {"error": "bad request"}, close=True)
+            return
+        if length > self.MAX_BODY:
+            self._write(sock, 413, {"error": "body too large"}, close=True)
+            return
+        if len(buf) < end + 4 + length:
+            return
+        body = bytes(buf[end + 4:end + 4 + length])
+        del buf[:end + 4 + length]
+        conn = headers.get("connection", "").lower()
+        st["close"] = conn == "close" or (version.upper() == "HTTP/1.0" and conn != "keep-alive")
+        path, _, qs = target.partition("?")
+        query = {k: v[-1] for k, v in parse_qs(qs).items()}
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            self._write(sock, 503, {"error": "queue full"}, close=st["close"])
+            return
+        st["busy"] = True
+        self._queue.append(ApiRequest(self, sock, method.upper(), path, query, headers, body))
+        if not self._drain.isActive():
+            self._drain.start()
+
+    def _drain_queue(self):
+        for _ in range(self.BATCH):
+            if not self._queue:
+                break
+            self._dispatch(self._queue.popleft())
+        if not self._queue:
+            self._drain.stop()
+
+    def _dispatch(self, req):
+        if req._sock not in self._conns:
+            return
+        # Web pages in the embedded browser can reach 127.0.0.1 too: refuse anything a browser
+        # would send cross-site (Origin header, non-JSON POST, rebinding Host)
+        host = req.headers.get("host", "").rsplit(":", 1)[0].strip("[]").lower()
+        if "origin" in req.headers or host not in ("127.0.0.1", "localhost", "::1"):
+            self._finish(req._sock, 403, {"error": "forbidden"})
+            return
+        if req.method == "POST" and req.body and "json" not in req.headers.get("content-type", "").lower():
+            self._finish(req._sock, 415, {"error": "use Content-Type: application/json"})
+            return
+        if self.token:
+            auth = req.headers.get("authorization", "")
+            given = auth[7:] if auth.lower().startswith("bearer ") else req.headers.get("x-api-token", "")
+            if given != self.token:
+                self._finish(req._sock, 401, {"error": "unauthorized"})
+                return
+        fn = self.routes.get((req.method, req.path))
+        if fn is None:
+            known = any(p == req.path for _, p in self.routes)
+            self._finish(req._sock, 405 if known else 404, {"error": "method not allowed" if known else "not found"})
+            return
+        try:
+            res = fn(req)
+        except ValueError as e:
+            self._finish(req._sock, 400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._finish(req._sock, 500, {"error": str(e)})
+            return
+        if res is req and req._deferred:
+            if self._inflight >= self.max_inflight:
+                self._finish(req._sock, 503, {"error": "too many pending requests"})
+                req._sock = None  # a late respond() becomes a no-op
+                return
+            self._inflight += 1
+            req._sock = ("deferred", req._sock)
+            return
+        status, payload = res
+        self._finish(req._sock, status, payload)
+
+    def _finish(self, sock, status, payload):
+        if sock is None:
+            return
+        if isinstance(sock, tuple):
+            self._inflight = max(0, self._inflight - 1)
+            sock = sock[1]
+        st = self._conns.get(sock)
+        if st is None:
+            return
+        self.served += 1
+        self._write(sock, status, payload, close=st["close"])
+        st["busy"] = False
+        if not st["close"] and st["buf"]:
+            self._parse(sock, st)
+
+    def _write(self, sock, status, payload, close=False):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = _HTTP_REASONS.get(status, "OK")
+        head = (f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n\r\n")
         try:
-            QMessageBox.critical(None, "Characters", str(e))
+            sock.write(head.encode("latin-1") + data)
+            if close:
+                sock.disconnectFromHost()
         except Exception:
             pass
-        return list(default_characters)
 
 class Main(QMainWindow):
 
     def _get_prompt_pid(self, obj, text):
-        # Return a stable id for the selected prompt, using explicit id
-        # or hashing "title|text" when no explicit id is present.
-        import hashlib
+        # Prompts carry a stable id once loaded through PromptRepository; the
+        # "title|text" hash is only a fallback for objects from elsewhere.
         if isinstance(obj, dict):
-            pid = obj.get("id")
-            title = obj.get("title", "")
-            base_text = obj.get("text", text or "")
-        else:
-            pid = None
-            title = ""
-            base_text = text or ""
-        if not pid:
-            pid = hashlib.sha1((title + "|" + (base_text or "")).encode("utf-8")).hexdigest()
-        return pid
+            if obj.get("id"):
+                return obj["id"]
+            return prompt_content_hash({"title": obj.get("title", ""), "text": obj.get("text", text or "")})
+        return prompt_content_hash({"title": "", "text": text or ""})
+
+    @property
+    def user_prompts(self):
+        return self.prompt_repo.to_list()
+
+    def _save_prompts(self):
+        # Full snapshot write; also moves the journal base (see save_user_prompts)
+        ok = save_user_prompts(self.prompt_repo.to_list())
+        self.prompt_journal.load()
+        return ok
+
+    # Prompt changes go to PromptJournal as small ops; each logged batch is one undo step
+    def _log_prompt_ops(self, ops):
+        try:
+            recs = self.prompt_journal.append(ops)
+        except Exception as e:
+            self.statusBar().showMessage(f"Prompt journal write failed ({e}); saving the full list.", 5000)
+            self._save_prompts()
+            return
+        self._track_prompt_versions(ops)
+        self._prompt_undo.append(recs)
+        del self._prompt_undo[:-self.PROMPT_UNDO_DEPTH]
+        self._prompt_redo.clear()
+        if len(self.prompt_journal.pending()) >= PromptJournal.COMPACT_AFTER:
+            QTimer.singleShot(0, self._save_prompts)
+
+    def _log_prompt_reset(self, before):
+        # Bulk replace (restore, clear, import, merge): one reset op, then a snapshot
+        self._log_prompt_ops([PromptJournal.reset_op(before, self.prompt_repo.to_list())])
+        if "before" not in self._prompt_undo[-1][0]:
+            self._prompt_undo.clear()  # too large to keep images for; cannot be undone
+        return self._save_prompts()
+
+    PROMPT_UNDO_DEPTH = 200
+
+    def _step_prompt_history(self, src, dst, label):
+        if not src:
+            self.statusBar().showMessage(f"Nothing to {label.lower()}.", 3000)
+            return
+        batch = src.pop()
+        inv = [prompt_op_inverse(r) for r in reversed(batch)]
+        for r in inv:
+            apply_prompt_op(self.prompt_repo, r)
+        dst.append(self.prompt_journal.append(inv))
+        self._track_prompt_versions(inv)
+        if len(self.prompt_journal.pending()) >= PromptJournal.COMPACT_AFTER:
+            QTimer.singleShot(0, self._save_prompts)
+        self.refresh_prompts_list()
+        pid = next((r.get("id") for r in inv if r["op"] != "remove" and r.get("id")), None)
+        if pid:
+            self._reselect_prompt(pid)
+        self.statusBar().showMessage(f"{label}: {self._describe_prompt_batch(batch)}", 4000)
+
+    def _track_prompt_versions(self, ops):
+        # Every text a prompt gets (add, edit, undo, revert) becomes a version in PromptHistory
+        hist = getattr(self, "prompt_history", None)
+        if hist is None:
+            return
+        try:
+            for r in ops:
+                after = r.get("after")
+                if r["op"] in ("add", "edit") and isinstance(after, dict):
+                    hist.record(r.get("id"), after.get("text"), after.get("title"), before=r.get("before"))
+        except Exception:
+            pass
+
+    def prompt_versions_dialog(self):
+        # Versions of the selected prompt, a side-by-side word diff against the current text, revert
+        item = self.promptList.currentItem()
+        obj = item.data(Qt.ItemDataRole.UserRole) if item else None
+        pid = obj.get("id") if isinstance(obj, dict) else None
+        hist = getattr(self, "prompt_history", None)
+        vers = hist.versions(pid) if (hist is not None and pid) else []
+        if len(vers) < 2:
+            QMessageBox.information(self, "Prompt Versions", "This prompt has no earlier versions yet.")
+            return
+        dlg = QDialog(self)
+        dlg.setWindowTitle(f"Versions: {obj.get('title') or pid}")
+        dlg.resize(980, 620)
+        v = QVBoxLayout(dlg)
+        lst = QListWidget(); lst.setMaximumHeight(160)
+        for ver in vers:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ver["ts"]))
+            cur = " (current)" if ver["hash"] == PromptHistory.text_hash(obj.get("text")) else ""
+            it = QListWidgetItem(f"{when}   {ver['title']}{cur}")
+            it.setData(Qt.ItemDataRole.UserRole, ver)
+            lst.addItem(it)
+        v.addWidget(lst)
+        split = QSplitter(Qt.Orientation.Horizontal)
+        left, right = QTextEdit(), QTextEdit()
+        for ed in (left, right):
+            ed.setReadOnly(True)
+            split.addWidget(ed)
+        v.addWidget(split, 1)
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        btn_revert = bb.addButton("Revert to Selected", QDialogButtonBox.ButtonRole.ActionRole)
+        bb.rejected.connect(dlg.reject)
+        v.addWidget(bb)
+
+        def _show():
+            it = lst.currentItem()
+            if it is None:
+                return
+            ver = it.data(Qt.ItemDataRole.UserRole)
+            a, b = diff_html(hist.text(ver["hash"]) or "", (self.prompt_repo.get(pid) or {}).get("text") or "")
+            left.setHtml(f"<b>Selected version</b><br><br>{a}")
+            right.setHtml(f"<b>Current</b><br><br>{b}")
+            btn_revert.setEnabled(ver["hash"] != PromptHistory.text_hash((self.prompt_repo.get(pid) or {}).get("text")))
+
+        def _revert():
+            ver = lst.currentItem().data(Qt.ItemDataRole.UserRole)
+            self._revert_prompt_version(pid, ver)
+            dlg.accept()
+
+        lst.currentRowChanged.connect(lambda _: _show())
+        btn_revert.clicked.connect(_revert)
+        lst.setCurrentRow(1)
+        dlg.exec()
+
+    def _revert_prompt_version(self, pid, ver):
+        cur = self.prompt_repo.get(pid)
+        text = self.prompt_history.text(ver["hash"])
+        if cur is None or text is None:
+            return
+        before = dict(cur)
+        fills = self.placeholders.get(pid)[0]
+        self.prompt_repo.update(pid, text=text, title=ver["title"] or cur.get("title"))
+        self._log_prompt_ops([{"op": "edit", "id": pid, "before": before, "after": dict(cur)}])
+        try:
+            if fills:
+                self.prompt_history.set_fills(pid, before.get("text"), fills)
+        except Exception:
+            pass
+        self.placeholders.put(pid, values=list(ver.get("fills") or []))
+        self._placeholder_save_timer.start()
+        self._fill = None  # fill panel shows the restored values
+        self._update_prompt_item(cur)
+        self._reselect_prompt(pid)
+        try:
+            self.update_prompt_preview()
+        except Exception:
+            pass
+        self.statusBar().showMessage("Prompt reverted; Undo Prompt Change goes back.", 4000)
+
+    def undo_prompt_change(self):
+        self._step_prompt_history(self._prompt_undo, self._prompt_redo, "Undo")
+
+    def redo_prompt_change(self):
+        self._step_prompt_history(self._prompt_redo, self._prompt_undo, "Redo")
+
+    @staticmethod
+    def _describe_prompt_batch(batch):
+        r = batch[0]
+        if r["op"] == "reset":
+            return "replace the whole list"
+        if len(batch) > 1:
+            return f"{len(batch)} prompt changes"
+        o = r.get("after") or r.get("before") or {}
+        return f"{r['op']} \"{(o.get('title') or '')[:40]}\""
+
+    def prompt_history_dialog(self):
+        # Browse the journal and restore the library to how it was before a chosen change
+        hist = self.prompt_journal.history()
+        if not hist:
+            QMessageBox.information(self, "Prompt History", "No recorded prompt changes yet.")
+            return
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Prompt History")
+        dlg.resize(640, 420)
+        v = QVBoxLayout(dlg)
+        v.addWidget(QLabel("Select a change to restore your prompts to how they were just before it:"))
+        lst = QListWidget()
+        for i in range(len(hist) - 1, -1, -1):
+            r = hist[i]
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r.get("t", 0)))
+            it = QListWidgetItem(f"{when}   {self._describe_prompt_batch([r])}")
+            it.setData(Qt.ItemDataRole.UserRole, i)
+            lst.addItem(it)
+        lst.setCurrentRow(0)
+        v.addWidget(lst)
+        info = QLabel("")
+        v.addWidget(info)
+
+        def _target():
+            i = lst.currentItem().data(Qt.ItemDataRole.UserRole)
+            return prompt_state_before(self.prompt_repo.to_list(), hist[i:])
+
+        def _preview():
+            try:
+                ops = prompt_diff_ops(self.prompt_repo.to_list(), _target())
+                info.setText(f"Restoring this point changes {len(ops)} prompt(s).")
+            except ValueError as e:
+                info.setText(str(e))
+
+        lst.currentRowChanged.connect(lambda _: _preview())
+        _preview()
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Cancel)
+        bb.addButton("Restore", QDialogButtonBox.ButtonRole.AcceptRole)
+        bb.accepted.connect(dlg.accept); bb.rejected.connect(dlg.reject)
+        v.addWidget(bb)
+        if dlg.exec() != QDialog.DialogCode.Accepted or lst.currentItem() is None:
+            return
+        try:
+            ops = prompt_diff_ops(self.prompt_repo.to_list(), _target())
+        except ValueError as e:
+            QMessageBox.warning(self, "Prompt History", str(e))
+            return
+        if not ops:
+            return
+        for r in ops:
+            apply_prompt_op(self.prompt_repo, r)
+        self._log_prompt_ops(ops)
+        self.refresh_prompts_list()
+        self.statusBar().showMessage(f"Restored prompts ({len(ops)} change(s)); Undo reverts it.", 5000)
 
     def __init__(self):
         super().__init__()
@@ -498,6 +4630,48 @@ class Main(QMainWindow):
         except Exception:
             pass
 
+        # Ad/tracker blocking on both profiles (Tools → Ad/Tracker Blocking)
+        self.request_interceptor = RequestInterceptor(DomainBlocklist(DEFAULT_BLOCKLIST), self)
+        _adb = self._adblock_cfg()
+        self.request_interceptor.enabled = bool(_adb.get("enabled", True))
+        self.request_interceptor.allow_sites = set(_adb.get("allow_sites") or [])
+        self.profile_interceptors = {}
+        for _prof in (self.profile, self.private_profile):
+            _pi = self.profile_interceptors[_prof] = ProfileInterceptor(self.request_interceptor, self)
+            try:
+                _prof.setUrlRequestInterceptor(_pi)
+            except Exception:
+                pass
+        self._reload_blocklists()
+
+        # Shared static-asset cache (opt-in; Tools → Asset Cache)
+        _ac = self._asset_cache_cfg()
+        try:
+            _ac_cap = int(_ac.get("max_mb", 512)) * 1024 * 1024
+        except Exception:
+            _ac_cap = 512 * 1024 * 1024
+        self.asset_cache = AssetCache(ASSET_CACHE_DIR, _ac_cap)
+        self.asset_handler = AssetCacheHandler(self.asset_cache, self.request_interceptor,
+                                               lambda: self.profile.httpUserAgent(), self)
+        for _prof in (self.profile, self.private_profile):
+            try:
+                _prof.installUrlSchemeHandler(ASSET_SCHEME, self.asset_handler)
+            except Exception:
+                pass
+        self.request_interceptor.cache_enabled = bool(_ac.get("enabled", False))
+        self._asset_cache_timer = QTimer(self)
+        self._asset_cache_timer.setInterval(30000)
+        self._asset_cache_timer.timeout.connect(lambda: self.asset_cache.dirty and self.asset_cache.save())
+        self._asset_cache_timer.start()
+
+        # UA presets: built-ins plus cfg "user_agents" (see UALibrary)
+        self.ua_library = UALibrary.from_config(self.cfg.get("user_agents"))
+        try:
+            self._engine_ua = self.profile.httpUserAgent()  # before any override
+        except Exception:
+            self._engine_ua = ""
+        # Rotate mode: every session's fresh off-the-record profile gets a weighted random UA
+        self._private_rotated = self.ua_library.pick() if (self.cfg.get("ui") or {}).get("ua_rotate_private") else None
         window_cfg = self.cfg.get("window") or {}
         ua_label = window_cfg.get("user_agent", "Default (Engine)")
         if not isinstance(ua_label, str):
@@ -505,12 +4679,13 @@ class Main(QMainWindow):
         if ua_label.startswith("Default"):
             self.current_ua = "Default (Engine)"
         else:
-            self.current_ua = PRESET_UAS.get(ua_label, ua_label)
+            self.current_ua = self.ua_library.ua(ua_label, ua_label)
             try:
                 self.profile.setHttpUserAgent(self.current_ua)
             except Exception:
                 pass
-                
+        self._apply_ua_rules()
+
         self.profile.downloadRequested.connect(self.on_download)
 
         if self.cfg['window'].get('fullscreen', False):
@@ -530,6 +4705,10 @@ class Main(QMainWindow):
         act_open_ext.triggered.connect(self.open_external)
         act_open_media = m_file.addAction("Open Media…")
         act_open_media.triggered.connect(self.open_media_externally)
+        m_file.addSeparator()
+        self.act_restore_session = m_file.addAction("Restore Tabs on Startup"); self.act_restore_session.setCheckable(True)
+        self.act_restore_session.setChecked(self._session_restore_enabled())
+        self.act_restore_session.toggled.connect(self.toggle_session_restore)
 
         m_view = menubar.addMenu("View")
         act_switch_tb = m_view.addAction("Switch Top/Bottom")
@@ -544,12 +4723,12 @@ class Main(QMainWindow):
         self.act_toggle_right_fs.triggered.connect(self.toggle_right_pane_fullscreen)
 
         m_view.addSeparator()
-        self.act_zoom_left_in = m_view.addAction("Zoom In (Sites Pane)")
+        self.act_zoom_left_in = m_view.addAction("Zoom In (Current Site)")
         self.act_zoom_left_in.triggered.connect(lambda: self.change_left_zoom(0.1))
-        self.act_zoom_left_out = m_view.addAction("Zoom Out (Sites Pane)")
+        self.act_zoom_left_out = m_view.addAction("Zoom Out (Current Site)")
         self.act_zoom_left_out.triggered.connect(lambda: self.change_left_zoom(-0.1))
-        self.act_zoom_left_reset = m_view.addAction("Reset Zoom (Sites Pane)")
-        self.act_zoom_left_reset.triggered.connect(lambda: self.set_left_zoom(1.0))
+        self.act_zoom_left_reset = m_view.addAction("Reset Zoom (Current Site)")
+        self.act_zoom_left_reset.triggered.connect(self.reset_site_zoom)
 
         m_view.addSeparator()
         self.act_zoom_right_in = m_view.addAction("Zoom In (Mail Pane)")
@@ -570,10 +4749,21 @@ class Main(QMainWindow):
         
         # mirror the preset list in a submenu
         m_tools_ua.addAction('Default (Engine)').triggered.connect(lambda _, lab='Default (Engine)': self.set_user_agent(None, preset_label=lab))
-        for label in PRESET_UAS.keys():
+        for label in self.ua_library.labels():
             a = m_tools_ua.addAction(label)
-            a.triggered.connect(lambda _, lab=label: self.set_user_agent(PRESET_UAS[lab], preset_label=lab))
-            
+            a.triggered.connect(lambda _, lab=label: self.set_user_agent(self.ua_library.ua(lab), preset_label=lab))
+        m_tools_ua.addSeparator()
+        m_ua_private = m_tools_ua.addMenu("Private Tabs")
+        m_ua_private.addAction("Engine Default").triggered.connect(lambda _: self.set_private_user_agent(None))
+        for label in self.ua_library.labels():
+            m_ua_private.addAction(label).triggered.connect(lambda _, lab=label: self.set_private_user_agent(lab))
+        m_ua_private.addSeparator()
+        self.act_ua_rotate = m_ua_private.addAction("Rotate Each Session"); self.act_ua_rotate.setCheckable(True)
+        self.act_ua_rotate.setChecked(self._private_rotated is not None)
+        self.act_ua_rotate.toggled.connect(self.toggle_private_ua_rotation)
+        m_ua_private.addAction("Rotate Now").triggered.connect(lambda _: self.rotate_private_user_agent())
+        a_site_ua = m_tools_ua.addAction("For Selected Site…"); a_site_ua.triggered.connect(self.set_site_user_agent_dialog)
+
         #m_tools_ua.addSeparator()
         #a_apply = m_tools_ua.addAction("Apply UA (from fields)"); a_apply.triggered.connect(self.apply_ua_clicked)
         #a_random = m_tools_ua.addAction("Random UA"); a_random.triggered.connect(self.random_ua_clicked)
@@ -585,6 +4775,32 @@ class Main(QMainWindow):
         a_fix_cf = m_tools_cap.addAction("Fix Captcha (Cloudflare)"); a_fix_cf.triggered.connect(self.fix_captcha_cloudflare)
         self.act_aggr_spoof = m_tools_cap.addAction("Aggressive Spoof"); self.act_aggr_spoof.setCheckable(True)
         self.act_aggr_spoof.toggled.connect(self.toggle_aggressive_spoof)
+        m_tools.addSeparator()
+        a_analytics = m_tools.addAction("Analytics…"); a_analytics.triggered.connect(self.show_analytics_dialog)
+        a_perf = m_tools.addAction("Performance…"); a_perf.triggered.connect(self.show_performance_dialog)
+        m_tools_adb = m_tools.addMenu("Ad/Tracker Blocking")
+        self.act_adblock = m_tools_adb.addAction("Enabled"); self.act_adblock.setCheckable(True)
+        self.act_adblock.setChecked(self.request_interceptor.enabled)
+        self.act_adblock.toggled.connect(self.toggle_adblock)
+        self.act_adblock_allow = m_tools_adb.addAction("Allow on Current Site"); self.act_adblock_allow.setCheckable(True)
+        self.act_adblock_allow.toggled.connect(self.toggle_adblock_current_site)
+        m_tools_adb.aboutToShow.connect(self._sync_adblock_menu)
+        m_tools_adb.addSeparator()
+        a_adb_add = m_tools_adb.addAction("Add Blocklist File…"); a_adb_add.triggered.connect(self.add_blocklist_file)
+        a_adb_stats = m_tools_adb.addAction("Blocked Requests…"); a_adb_stats.triggered.connect(self.show_blocked_dialog)
+        m_tools_ac = m_tools.addMenu("Asset Cache")
+        self.act_asset_cache = m_tools_ac.addAction("Cache Static Assets (shared by all profiles)")
+        self.act_asset_cache.setCheckable(True); self.act_asset_cache.setChecked(self.request_interceptor.cache_enabled)
+        self.act_asset_cache.toggled.connect(self.toggle_asset_cache)
+        a_ac_stats = m_tools_ac.addAction("Statistics…"); a_ac_stats.triggered.connect(self.show_asset_cache_stats)
+        a_ac_clear = m_tools_ac.addAction("Clear Asset Cache…"); a_ac_clear.triggered.connect(self.clear_asset_cache)
+        m_tools_api = m_tools.addMenu("Local API")
+        self.act_local_api = m_tools_api.addAction("Enable Local API Server"); self.act_local_api.setCheckable(True)
+        self.act_local_api.toggled.connect(self.toggle_local_api)
+        a_api_settings = m_tools_api.addAction("Settings…"); a_api_settings.triggered.connect(self.local_api_settings_dialog)
+        m_tools.addSeparator()
+        a_merge_defaults = m_tools.addAction("Merge Updated Defaults…")
+        a_merge_defaults.triggered.connect(lambda: self.merge_updated_defaults(interactive=True))
         
         m_sites = menubar.addMenu("Sites")
         a_sites_restore = m_sites.addAction("Restore Default 100…"); a_sites_restore.triggered.connect(self.restore_default_sites)
@@ -592,16 +4808,29 @@ class Main(QMainWindow):
         m_sites.addSeparator()
         a_sites_add = m_sites.addAction("Add Current Page"); a_sites_add.triggered.connect(self.add_site_from_current)
         a_sites_remove = m_sites.addAction("Remove Selected"); a_sites_remove.triggered.connect(self.remove_selected_site)
+        m_sites.addSeparator()
+        a_sites_open_sel = m_sites.addAction("Open Selected"); a_sites_open_sel.triggered.connect(self.open_selected_sites)
+        self.m_sites_open_cat = m_sites.addMenu("Open Category")
+        self.m_sites_open_cat.aboutToShow.connect(self._populate_open_category_menu)
+        a_sites_stop = m_sites.addAction("Stop Queued Loads"); a_sites_stop.triggered.connect(self.stop_queued_loads)
 
         m_prompts = menubar.addMenu("Prompts")
-        a_p_copy = m_prompts.addAction("Copy Selected"); a_p_copy.triggered.connect(self.copy_selected_prompt)
+        self.act_prompt_copy = m_prompts.addAction("Copy Selected"); self.act_prompt_copy.triggered.connect(self.copy_selected_prompt)
+        a_p_random = m_prompts.addAction("Randomize"); a_p_random.triggered.connect(self.randomize_prompt)
         a_p_add = m_prompts.addAction("Add…"); a_p_add.triggered.connect(self.add_prompt_dialog)
         a_p_remove = m_prompts.addAction("Remove"); a_p_remove.triggered.connect(self.remove_selected_prompt)
         m_prompts.addSeparator()
+        self.act_prompt_undo = m_prompts.addAction("Undo Prompt Change"); self.act_prompt_undo.triggered.connect(self.undo_prompt_change)
+        self.act_prompt_redo = m_prompts.addAction("Redo Prompt Change"); self.act_prompt_redo.triggered.connect(self.redo_prompt_change)
+        a_p_hist = m_prompts.addAction("History…"); a_p_hist.triggered.connect(self.prompt_history_dialog)
+        a_p_vers = m_prompts.addAction("Versions of Selected…"); a_p_vers.triggered.connect(self.prompt_versions_dialog)
+        m_prompts.addSeparator()
         a_p_restore = m_prompts.addAction("Restore Default Prompts…"); a_p_restore.triggered.connect(self.restore_default_prompts)
         a_p_clear = m_prompts.addAction("Clear User Prompts…"); a_p_clear.triggered.connect(self.clear_user_prompts)
         a_p_export = m_prompts.addAction("Export…"); a_p_export.triggered.connect(self.export_prompts_dialog)
         a_p_import = m_prompts.addAction("Import…"); a_p_import.triggered.connect(self.import_prompts_dialog)
+        m_prompts.addSeparator()
+        a_p_matrix = m_prompts.addAction("Generate Matrix…"); a_p_matrix.triggered.connect(self.generate_prompt_matrix_dialog)
         
         m_characters = menubar.addMenu("Characters")
         a_rp = m_characters.addAction("Restore Default Characters…"); a_rp.triggered.connect(self.restore_default_characters)
@@ -609,6 +4838,8 @@ class Main(QMainWindow):
         m_characters.addSeparator()
         a_ep = m_characters.addAction("Export…"); a_ep.triggered.connect(self.export_characters_dialog)
         a_ip = m_characters.addAction("Import…"); a_ip.triggered.connect(self.import_characters_dialog)
+        m_characters.addSeparator()
+        a_ct = m_characters.addAction("Edit Character Tags…"); a_ct.triggered.connect(self.edit_character_tags_dialog)
         a_clear_data = menubar.addAction("Clear Site Data"); a_clear_data.triggered.connect(self.clear_site_data)
         self.m_mail_sites = menubar.addMenu("Switch Email Site")
         self._build_mail_sites_menu(self.m_mail_sites)
@@ -631,8 +4862,8 @@ class Main(QMainWindow):
         row.addWidget(QLabel("URL:")); row.addWidget(self.addr,1)
 
         #row.addWidget(QLabel("UA:"))
-        self.uaPreset = QComboBox(); self.uaPreset.addItem('Default (Engine)'); self.uaPreset.addItems(list(PRESET_UAS.keys()))
-        preset_label = 'Default (Engine)' if self.current_ua == 'Default (Engine)' else next((k for k,v in PRESET_UAS.items() if v==self.current_ua), "Chrome (Windows)")
+        self.uaPreset = QComboBox(); self.uaPreset.addItem('Default (Engine)'); self.uaPreset.addItems(self.ua_library.labels())
+        preset_label = 'Default (Engine)' if self.current_ua == 'Default (Engine)' else self.ua_library.label_for(self.current_ua, "Chrome (Windows)")
         self.uaPreset.setCurrentText(preset_label)
         #self.uaCustom = QLineEdit(); self.uaCustom.setPlaceholderText("Custom UA…")
 
@@ -661,9 +4892,25 @@ class Main(QMainWindow):
         qrow.addWidget(self.quick,1); qrow.addWidget(btn_open,0)
         la_v.addWidget(quick)
 
+        # Per-site page-load timings (Tools → Performance…)
+        try:
+            perf_window = int((self.cfg.get("ui") or {}).get("perf_window", 50))
+        except Exception:
+            perf_window = 50
+        self.perf_stats = SiteLoadStats.load(PERF_PATH, perf_window)
+        self._perf_save_timer = QTimer(self)
+        self._perf_save_timer.setSingleShot(True)
+        self._perf_save_timer.setInterval(5000)
+        self._perf_save_timer.timeout.connect(self.perf_stats.save)
+        self._site_items = {}  # site base -> QListWidgetItem in listw
+        for _prof in (self.profile, self.private_profile):
+            self._install_perf_probe(_prof)
+
         # Sites list (from user-sites JSON)
         self.user_sites = load_or_init_user_sites(self.cfg.get("sites", []))
+        self._apply_ua_rules()  # per-site "ua" overrides
         self.listw = QListWidget()
+        self.listw.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)  # Ctrl/Shift-click to pick several
         self.refresh_sites_list()
         self.listw.itemClicked.connect(self.load_from_list)
         la_v.addWidget(self.listw,1)
@@ -674,8 +4921,11 @@ class Main(QMainWindow):
         #btnClearSites = QPushButton("Clear User Sites"); btnClearSites.clicked.connect(self.clear_user_sites)
         btnAddSite = QPushButton("Add Current Page"); btnAddSite.clicked.connect(self.add_site_from_current)
         btnRemoveSite = QPushButton("Remove Selected"); btnRemoveSite.clicked.connect(self.remove_selected_site)
+        self.site_sort_mode = "original"
+        self.btnSiteSort = QPushButton("Sort: Original"); self.btnSiteSort.clicked.connect(self.toggle_site_sort)
         #row_sites_h.addWidget(info,1)
-        for b in (btnRestore, btnAddSite, btnRemoveSite):
+        btnOpenSelected = QPushButton("Open Selected"); btnOpenSelected.clicked.connect(self.open_selected_sites)
+        for b in (btnRestore, btnAddSite, btnRemoveSite, self.btnSiteSort, btnOpenSelected):
             row_sites_h.addWidget(b,0)
             
         # Keep Restore/Clear accessible via the Sites menu
@@ -706,27 +4956,54 @@ class Main(QMainWindow):
         rp_row.addWidget(self.btnPromptSort)
 
         self.btnPromptCopy = QPushButton("Copy"); self.btnPromptCopy.clicked.connect(self.copy_selected_prompt)
+        self.btnPromptRandom = QPushButton("Random"); self.btnPromptRandom.clicked.connect(self.randomize_prompt)
         self.btnPromptAdd = QPushButton("Add"); self.btnPromptAdd.clicked.connect(self.add_prompt_dialog)
         self.btnPromptRemove = QPushButton("Remove"); self.btnPromptRemove.clicked.connect(self.remove_selected_prompt)
         self.btnPromptRestore = QPushButton("Restore Default Prompts"); self.btnPromptRestore.clicked.connect(self.restore_default_prompts)
         self.btnPromptExport = QPushButton("Export"); self.btnPromptExport.clicked.connect(self.export_prompts_dialog)
         self.btnPromptImport = QPushButton("Import"); self.btnPromptImport.clicked.connect(self.import_prompts_dialog)
-        for b in (self.btnPromptCopy,self.btnPromptAdd,self.btnPromptRemove,self.btnPromptRestore,self.btnPromptExport,self.btnPromptImport):
+        for b in (self.btnPromptCopy,self.btnPromptRandom,self.btnPromptAdd,self.btnPromptRemove,self.btnPromptRestore,self.btnPromptExport,self.btnPromptImport):
             rp_row.addWidget(b, 0)
         rp_v.addWidget(rp_header, 0)
 
-        self.user_prompts = load_or_init_user_prompts(self.cfg.get("prompts", []))
-        self._manual_placeholder_cache = {}  # remembers manual "" values per prompt
-        self._prompt_objs = _normalize_prompts_list(self.user_prompts)
-        
-        # Characters (with categories from config)
-        cfg_chars_raw = self.cfg.get("characters", [])
-        self.character_defs = _normalize_characters_cfg_list(cfg_chars_raw)
-        default_char_names = [c.get("name", "") for c in self.character_defs]
-        self.user_characters = load_or_init_user_characters(default_char_names)
+        self.prompt_repo = PromptRepository(load_or_init_user_prompts(self.cfg.get("prompts", [])))
+        self.prompt_journal = PromptJournal(PROMPT_JOURNAL_PATH)
+        self.prompt_journal.replay(self.prompt_repo)  # changes logged since the last snapshot
+        self._prompt_undo, self._prompt_redo = [], []
+        try:
+            self.prompt_history = PromptHistory(HISTORY_DB_PATH)
+        except Exception:
+            self.prompt_history = None
+        if self.prompt_repo.migrated:
+            self._save_prompts()
+        self._prompt_items = {}  # prompt id -> QListWidgetItem currently in promptList
+        self.placeholders = PlaceholderStore(PLACEHOLDERS_PATH)  # filled slots per prompt, read on first use
+        self._placeholder_save_timer = QTimer(self)
+        self._placeholder_save_timer.setSingleShot(True)
+        self._placeholder_save_timer.setInterval(2000)
+        self._placeholder_save_timer.timeout.connect(self.placeholders.save)
+
+        try:
+            self.analytics = AnalyticsStore(ANALYTICS_PATH)
+        except Exception:
+            self.analytics = None
+        # Usage counts (rebuilt from the event log) drive Randomize weights (less used =
+        # more likely) and the Recent/Frequent sorts
+        self.usage_stats = UsageStats.from_analytics(self.analytics)
+        _ui = self.cfg.get("ui") if isinstance(self.cfg.get("ui"), dict) else {}
+        try:
+            no_repeat = int(_ui.get("random_no_repeat", 8))
+        except Exception:
+            no_repeat = 8
+        self._prompt_picker = RandomPicker(lambda k: 1.0 / (1 + self.usage_stats.count("prompts", k)), no_repeat)
+        self._character_picker = RandomPicker(lambda k: 1.0 / (1 + self.usage_stats.count("characters", k)), no_repeat)
+        self._downloads = []  # session download log served by the local API
+        self._download_items = {}  # id -> in-progress QWebEngineDownloadRequest
+        self._download_waiters = []  # parked /api/downloads/wait requests
+        self._prompt_objs = self.prompt_repo.to_list()
         
-        # Build merged character objects
-        self._rebuild_character_objects()
+        # Characters (user list over the config defs; categories indexed once)
+        self.characters = load_or_init_user_characters(self.cfg.get("characters", []))
 
         # Category + Character selectors
         characterRow = QHBoxLayout()
@@ -734,13 +5011,22 @@ class Main(QMainWindow):
         self.characterCategoryBox = QComboBox(); self.characterCategoryBox.addItem("Show All")
         self.characterCategoryBox.currentIndexChanged.connect(self._reload_character_boxes)
         characterRow.addWidget(self.characterCategoryBox)
+        # Tag query ("Animals AND Cartoon", "not Musicians"); evaluated as bitset ops
+        self.characterQueryEdit = QLineEdit(); self.characterQueryEdit.setClearButtonEnabled(True)
+        self.characterQueryEdit.setPlaceholderText("Tags: Animals AND NOT Musicians")
+        self.characterQueryEdit.setMaximumWidth(220)
+        self.characterQueryEdit.textChanged.connect(self._reload_character_boxes)
+        characterRow.addWidget(self.characterQueryEdit)
+        self.characterFacetBtn = QPushButton("Facets"); self.characterFacetBtn.setCheckable(True)
+        self.characterFacetBtn.setToolTip("Show tag counts for the current filter; click a tag to require it, again to exclude it")
+        characterRow.addWidget(self.characterFacetBtn)
         characterRow.addSpacing(12)
 
         #lblP1 = QLabel("Character 1:"); lblP1.setStyleSheet("font-size: 11px;")
         #characterRow.addWidget(lblP1)
         self.character1Box = QComboBox()
         self.character1Box.addItem("— None —")
-        self.character1Box.addItems(self.user_characters)
+        self.character1Box.addItems(self.characters.names())
         characterRow.addWidget(self.character1Box)
         characterRow.addSpacing(8)
 
@@ -748,7 +5034,7 @@ class Main(QMainWindow):
         #characterRow.addWidget(lblP2)
         self.character2Box = QComboBox()
         self.character2Box.addItem("— None —")
-        self.character2Box.addItems(self.user_characters)
+        self.character2Box.addItems(self.characters.names())
         characterRow.addWidget(self.character2Box)
         characterRow.addSpacing(8)
 
@@ -756,7 +5042,7 @@ class Main(QMainWindow):
         #characterRow.addWidget(lblP3)
         self.character3Box = QComboBox()
         self.character3Box.addItem("— None —")
-        self.character3Box.addItems(self.user_characters)
+        self.character3Box.addItems(self.characters.names())
         characterRow.addWidget(self.character3Box)
         characterRow.addSpacing(8)
 
@@ -764,13 +5050,24 @@ class Main(QMainWindow):
         #characterRow.addWidget(lblP4)
         self.character4Box = QComboBox()
         self.character4Box.addItem("— None —")
-        self.character4Box.addItems(self.user_characters)
+        self.character4Box.addItems(self.characters.names())
         characterRow.addWidget(self.character4Box)
         characterRow.addSpacing(8)
         self.keepNamesCheck = QCheckBox("Keep"); self.keepNamesCheck.setChecked(True)
         characterRow.addWidget(self.keepNamesCheck)
         rp_v.addLayout(characterRow)
 
+        # Facet panel: one tri-state item per tag (checked = require, partial = exclude)
+        self.characterFacetList = QListWidget()
+        self.characterFacetList.setFlow(QListWidget.Flow.LeftToRight)
+        self.characterFacetList.setWrapping(True)
+        self.characterFacetList.setResizeMode(QListWidget.ResizeMode.Adjust)
+        self.characterFacetList.setMaximumHeight(96)
+        self.characterFacetList.setVisible(False)
+        self.characterFacetList.itemChanged.connect(self._on_character_facet_changed)
+        self.characterFacetBtn.toggled.connect(self.characterFacetList.setVisible)
+        rp_v.addWidget(self.characterFacetList)
+
         # Populate character category dropdown and boxes initially
         try:
             self._reload_character_boxes()
@@ -779,10 +5076,11 @@ class Main(QMainWindow):
         try:
             self.character1Box.setEditable(True); self.character2Box.setEditable(True)
             self.character3Box.setEditable(True); self.character4Box.setEditable(True)
-            _c1 = QCompleter(self.user_characters, self.character1Box); _c1.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-            _c2 = QCompleter(self.user_characters, self.character2Box); _c2.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-            _c3 = QCompleter(self.user_characters, self.character3Box); _c3.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-            _c4 = QCompleter(self.user_characters, self.character4Box); _c4.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+            all_names = self.characters.names()
+            _c1 = QCompleter(all_names, self.character1Box); _c1.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+            _c2 = QCompleter(all_names, self.character2Box); _c2.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+            _c3 = QCompleter(all_names, self.character3Box); _c3.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+            _c4 = QCompleter(all_names, self.character4Box); _c4.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
             self.character1Box.setCompleter(_c1); self.character2Box.setCompleter(_c2)
             self.character3Box.setCompleter(_c3); self.character4Box.setCompleter(_c4)
         except Exception:
@@ -801,10 +5099,24 @@ class Main(QMainWindow):
         self.previewEdit.setReadOnly(True)
         self.previewEdit.setPlaceholderText("Prompt preview…")
         self.previewEdit.setLineWrapMode(QTextEdit.LineWrapMode.WidgetWidth)
+        # Fill panel under the preview: one field per placeholder of the selected prompt
+        self.placeholderPanel = QWidget()
+        self.placeholderForm = QFormLayout(self.placeholderPanel)
+        self.placeholderForm.setContentsMargins(4, 4, 4, 4)
+        self.placeholderScroll = QScrollArea()
+        self.placeholderScroll.setWidgetResizable(True)
+        self.placeholderScroll.setWidget(self.placeholderPanel)
+        self.placeholderScroll.setMaximumHeight(200)
+        self.placeholderScroll.setVisible(False)
+        self._fill = None  # fill panel state, see _sync_fill_panel
+        previewPane = QWidget()
+        _pv = QVBoxLayout(previewPane); _pv.setContentsMargins(0, 0, 0, 0); _pv.setSpacing(2)
+        _pv.addWidget(self.previewEdit, 1)
+        _pv.addWidget(self.placeholderScroll)
         # Splitter to hold list + preview
         self.promptsSplitter = QSplitter(Qt.Orientation.Horizontal)
         self.promptsSplitter.addWidget(self.promptList)
-        self.promptsSplitter.addWidget(self.previewEdit)
+        self.promptsSplitter.addWidget(previewPane)
         _sizes = (self.cfg.get('ui', {}) or {}).get('prompts_splitter_sizes', [680, 520])
         try:
             self.promptsSplitter.setSizes([int(_sizes[0]), int(_sizes[1])])
@@ -877,6 +5189,17 @@ class Main(QMainWindow):
         pane_zoom["left"] = float(self.left_zoom)
         pane_zoom["right"] = float(self.right_zoom)
         ui_cfg["pane_zoom"] = pane_zoom
+        # Per-site memory: ui.site_zoom {base: factor}, ui.site_scroll {base: [path, y]}
+        for _k in ("site_zoom", "site_scroll"):
+            if not isinstance(ui_cfg.get(_k), dict):
+                ui_cfg[_k] = {}
+
+        # Batched config writer for settings that change often (zoom, scroll):
+        # callers mark the config dirty and one write happens after things settle
+        self._cfg_save_timer = QTimer(self)
+        self._cfg_save_timer.setSingleShot(True)
+        self._cfg_save_timer.setInterval(2000)
+        self._cfg_save_timer.timeout.connect(self._flush_config)
 
         # Pane fullscreen defaults (per pane)
         pane_fs = ui_cfg.get("pane_fullscreen")
@@ -902,18 +5225,8 @@ class Main(QMainWindow):
         # link_splitters: True = keep actions/content splitters in sync (default); False = decouple
         self.link_splitters = bool(ui_cfg.get("link_splitters", True))
 
-        # Apply configured hotkeys to fullscreen and zoom actions
-        try:
-            self.act_toggle_left_fs.setShortcut(hotkeys.get("fullscreen_left", "F1"))
-            self.act_toggle_right_fs.setShortcut(hotkeys.get("fullscreen_right", "F2"))
-            self.act_zoom_left_in.setShortcut(hotkeys.get("zoom_left_in", "F3"))
-            self.act_zoom_left_out.setShortcut(hotkeys.get("zoom_left_out", "F4"))
-            self.act_zoom_left_reset.setShortcut(hotkeys.get("zoom_left_reset", "F5"))
-            self.act_zoom_right_in.setShortcut(hotkeys.get("zoom_right_in", "F6"))
-            self.act_zoom_right_out.setShortcut(hotkeys.get("zoom_right_out", "F7"))
-            self.act_zoom_right_reset.setShortcut(hotkeys.get("zoom_right_reset", "F8"))
-        except Exception:
-            pass
+        # Apply configured hotkeys to fullscreen, zoom and prompt actions
+        self._apply_hotkeys(hotkeys)
 
         # Initialize independent splitter sizes
         ui_cfg = (self.cfg.get("ui") or {})
@@ -946,16 +5259,19 @@ class Main(QMainWindow):
         self.leftTabs.tabCloseRequested.connect(self.close_left_tab)
         self.leftTabs.currentChanged.connect(self.on_left_tab_changed)
         
-        # Initial tab
-        _b0 = self._create_browser_with_profile(self._get_default_profile())
-        try:
-            _b0.setHtml(self.startup_html)
-        except Exception:
-            pass
-        self.leftTabs.addTab(_b0, "New Tab")
+        # Initial tab: last session's tabs (as lazy placeholders) or the help page
+        self._materializing = False
+        session = load_session() if self._session_restore_enabled() else None
+        if not self._restore_session_tabs(session):
+            _b0 = self._create_browser_with_profile(self._get_default_profile())
+            try:
+                _b0.setHtml(self.startup_html)
+            except Exception:
+                pass
+            self.leftTabs.addTab(_b0, "New Tab")
         self.right = Browser()
         self.right.settings().setAttribute(QWebEngineSettings.WebAttribute.AllowRunningInsecureContent, True)
-        self.right.setUrl(QUrl(self.cfg["window"].get("mail_url","https://www.guerrillamail.com/inbox")))
+        self.right.setUrl(QUrl((session or {}).get("mail_url") or self.cfg["window"].get("mail_url","https://www.guerrillamail.com/inbox")))
 
         self.contentSplit.addWidget(self.leftTabs); self.contentSplit.addWidget(self.right)
         self.contentSplit.setStretchFactor(0,1); self.contentSplit.setStretchFactor(1,1)
@@ -995,8 +5311,79 @@ class Main(QMainWindow):
 
         self.statusBar().showMessage("Ready")
 
+        # Crash recovery: write the tab session periodically (only when it changed)
+        self._session_last = None
+        self._session_timer = QTimer(self)
+        try:
+            autosave = max(5, int((self.cfg.get("ui") or {}).get("session_autosave_sec", 30)))
+        except Exception:
+            autosave = 30
+        self._session_timer.setInterval(autosave * 1000)
+        self._session_timer.timeout.connect(self.save_session_now)
+        self._session_timer.start()
+
+        # Bulk site opening: lazy tabs materialized K at a time (ui.max_concurrent_loads)
+        _ui = self.cfg.get("ui") if isinstance(self.cfg.get("ui"), dict) else {}
+        try:
+            k = int(_ui.get("max_concurrent_loads", 4))
+            timeout_ms = int(float(_ui.get("load_timeout_sec", 30)) * 1000)
+        except Exception:
+            k, timeout_ms = 4, 30000
+        self.load_scheduler = LoadScheduler(k, timeout_ms, self)
+        self.load_scheduler.changed.connect(self._update_load_status)
+        self.loadStatusLabel = QLabel("")
+        self.statusBar().addPermanentWidget(self.loadStatusLabel)
+        self.blockStatusLabel = QLabel("")
+        self.statusBar().addPermanentWidget(self.blockStatusLabel)
+        self._block_status_timer = QTimer(self)
+        self._block_status_timer.setInterval(1000)
+        self._block_status_timer.timeout.connect(self._update_block_status)
+        self._block_status_timer.start()
+
+        # Optional local HTTP API for scripts (Tools → Local API)
+        self.api_server = None
+        self._apply_local_api_cfg()
+
+        # Hot reload: the user files and the config, edited by hand or synced from elsewhere.
+        # Changes are debounced, parsed off the GUI thread and applied as list diffs.
+        self._watched = {USER_PROMPTS_PATH: "prompts", USER_SITES_PATH: "sites",
+                         USER_MAIL_SITES_PATH: "mail_sites", USER_CHARACTERS_PATH: "characters",
+                         CONFIG_PATH: "config"}
+        self._watch_sigs = {p: file_signature(p) for p in self._watched}
+        self._reload_pending = set()
+        self._reload_worker = None
+        self._reload_timer = QTimer(self)
+        self._reload_timer.setSingleShot(True)
+        self._reload_timer.setInterval(400)
+        self._reload_timer.timeout.connect(self._check_watched_files)
+        self._file_watcher = QFileSystemWatcher(self)
+        # The directory too: a file replaced by rename (ours, editors, sync tools) drops out of the watch
+        self._file_watcher.addPaths([p for p in self._watched if os.path.exists(p)] + [os.path.dirname(CONFIG_PATH)])
+        self._file_watcher.fileChanged.connect(lambda _p: self._reload_timer.start())
+        self._file_watcher.directoryChanged.connect(lambda _p: self._reload_timer.start())
+
+        # New defaults shipped by an update are merged in once the window is up
+        QTimer.singleShot(0, lambda: self.merge_updated_defaults(interactive=False))
+
+    def _apply_hotkeys(self, hotkeys):
+        try:
+            self.act_toggle_left_fs.setShortcut(hotkeys.get("fullscreen_left", "F1"))
+            self.act_toggle_right_fs.setShortcut(hotkeys.get("fullscreen_right", "F2"))
+            self.act_zoom_left_in.setShortcut(hotkeys.get("zoom_left_in", "F3"))
+            self.act_zoom_left_out.setShortcut(hotkeys.get("zoom_left_out", "F4"))
+            self.act_zoom_left_reset.setShortcut(hotkeys.get("zoom_left_reset", "F5"))
+            self.act_zoom_right_in.setShortcut(hotkeys.get("zoom_right_in", "F6"))
+            self.act_zoom_right_out.setShortcut(hotkeys.get("zoom_right_out", "F7"))
+            self.act_zoom_right_reset.setShortcut(hotkeys.get("zoom_right_reset", "F8"))
+            self.act_prompt_undo.setShortcut(hotkeys.get("prompt_undo", "Ctrl+Alt+Z"))
+            self.act_prompt_redo.setShortcut(hotkeys.get("prompt_redo", "Ctrl+Alt+Y"))
+            self.act_prompt_copy.setShortcut(hotkeys.get("prompt_copy", "Ctrl+Alt+C"))
+        except Exception:
+            pass
+
     # UA logic
     def set_user_agent(self, ua, preset_label=None):
+        before = self._ua_state()
         if ua is None or (isinstance(ua, str) and ua.startswith("Default")):
             self.current_ua = "Default (Engine)"
             try:
@@ -1017,20 +5404,170 @@ class Main(QMainWindow):
             except Exception:
                 pass
 
-        # Reload all left tabs and the right pane
+        # Reload only what the change affects (site and private-profile rules win)
+        self._reload_for_ua_change(before)
+    
+    # Effective UA per tab: site record "ua" -> profile rule (ui.profile_user_agents) -> global
+    def _resolve_ua(self, value):
+        # Preset label, "Default…" (engine UA, returned as "") or a literal UA string
+        if not value or not isinstance(value, str) or value.startswith("Default"):
+            return ""
+        return self.ua_library.ua(value, value)
+
+    def _ua_state(self):
+        rules = (self.cfg.get("ui") or {}).get("profile_user_agents") or {}
+        private = rules.get("private") or getattr(self, "_private_rotated", None)
+        site_map = {}
+        for s in getattr(self, "user_sites", []):
+            if s.get("ua"):
+                base = s.get("base") or self._base_of(s.get("url", ""))
+                if base:
+                    site_map[base] = self._resolve_ua(s["ua"])
+        return {"global": self._resolve_ua(self.current_ua), "private": self._resolve_ua(private),
+                "sites": site_map}
+
+    def _effective_ua(self, url, private, state):
+        ua = lookup_host_suffix(state["sites"], self._base_of(url))
+        if ua is not None:
+            return ua
+        # The global preset only ever applied to the default profile
+        return state["private"] if private else state["global"]
+
+    def _apply_ua_rules(self):
+        state = self._ua_state()
+        lib = self.ua_library
+        sites = {b: ua for b, ua in state["sites"].items() if ua}
+        self.request_interceptor.site_headers = {b: lib.headers(ua) for b, ua in sites.items()}
+        site_nav = {b: ua_navigator_js(lib.entry_for(ua)) for b, ua in sites.items()}
+        # The interceptor can set headers but not remove them. With the engine default UA the
+        # engine adds its own Chromium Sec-CH-UA* to every request, which would go out next to
+        # a site's Firefox/Safari UA. An explicit UA switches those off, so in that case the
+        # default string is pinned and its hints are stamped by the ProfileInterceptor instead.
+        pin = getattr(self, "_engine_ua", "") if any(not lib.entry_for(ua).get("brands") for ua in sites.values()) else ""
+        for prof, ua in ((self.profile, state["global"]), (self.private_profile, state["private"])):
+            ua = ua or pin
+            try:
+                prof.setHttpUserAgent(ua)  # "" = engine default
+            except Exception:
+                pass
+            # Engine default UA: leave the engine's own (consistent) client hints alone
+            pi = getattr(self, "profile_interceptors", {}).get(prof)
+            if pi is not None:
+                pi.headers = lib.headers(ua) if ua else []
+            try:
+                scripts = prof.scripts()
+                for old in scripts.find("sora2-ua"):
+                    scripts.remove(old)
+                if site_nav:
+                    sc = QWebEngineScript()
+                    sc.setName("sora2-ua")
+                    sc.setSourceCode(UA_OVERRIDE_JS.replace("__CFG__", json.dumps(site_nav)))
+                    sc.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentCreation)
+                    sc.setWorldId(QWebEngineScript.ScriptWorldId.MainWorld)
+                    sc.setRunsOnSubFrames(True)  # challenge iframes must see the same identity
+                    scripts.insert(sc)
+            except Exception:
+                pass
+        return state
+
+    def _reload_for_ua_change(self, before):
+        after = self._apply_ua_rules()
+        visible, deferred = [], 0
+        for i in range(self.leftTabs.count()):
+            w = self.leftTabs.widget(i)
+            if isinstance(w, _LazyTab):
+                continue  # picks up the new UA when materialized
+            url = w.url().toString() if w.url().isValid() else ""
+            if not url.startswith(("http://", "https://")):
+                continue
+            priv = bool(getattr(w, "private", False))
+            if self._effective_ua(url, priv, before) == self._effective_ua(url, priv, after):
+                continue
+            if i == self.leftTabs.currentIndex():
+                visible.append(w)
+            else:
+                w._ua_stale = True  # reloaded by on_left_tab_changed when shown
+                deferred += 1
         try:
-            for i in range(self.leftTabs.count()):
-                b = self.leftTabs.widget(i)
-                if b.url().isValid():
-                    b.reload()
+            rurl = self.right.url().toString() if self.right.url().isValid() else ""
+            if rurl and self._effective_ua(rurl, False, before) != self._effective_ua(rurl, False, after):
+                visible.append(self.right)
+        except Exception:
+            pass
+        sched = getattr(self, "load_scheduler", None)
+        for b in visible:
+            if sched is not None:
+                sched.submit(lambda b=b: (b.reload(), b)[1])
+            else:
+                b.reload()
+        if visible or deferred:
+            self.statusBar().showMessage(f"User agent changed: reloading {len(visible)} visible view(s); "
+                                         f"{deferred} background tab(s) reload when shown", 5000)
+
+    def set_private_user_agent(self, label):
+        before = self._ua_state()
+        ui_cfg = self.cfg.setdefault("ui", {})
+        rules = ui_cfg.get("profile_user_agents") if isinstance(ui_cfg.get("profile_user_agents"), dict) else {}
+        if label:
+            rules["private"] = label
+        else:
+            rules.pop("private", None)
+        ui_cfg["profile_user_agents"] = rules
+        try:
+            save_config(self.cfg)
         except Exception:
             pass
+        self._reload_for_ua_change(before)
+
+    def toggle_private_ua_rotation(self, checked):
+        self.cfg.setdefault("ui", {})["ua_rotate_private"] = bool(checked)
         try:
-            if self.right.url().isValid():
-                self.right.reload()
+            save_config(self.cfg)
         except Exception:
             pass
-    
+        if checked and self._private_rotated is None:
+            self.rotate_private_user_agent()
+        elif not checked and self._private_rotated is not None:
+            before = self._ua_state()
+            self._private_rotated = None
+            self._reload_for_ua_change(before)
+
+    def rotate_private_user_agent(self):
+        # Fresh weighted pick for private tabs (a fixed Private Tabs preset still wins)
+        before = self._ua_state()
+        self._private_rotated = self.ua_library.pick(exclude=self._private_rotated)
+        self._reload_for_ua_change(before)
+        self.statusBar().showMessage(f"Private tabs UA: {self._private_rotated}", 4000)
+
+    def set_site_user_agent_dialog(self):
+        item = self.listw.currentItem()
+        if not item:
+            QMessageBox.information(self, "Site User Agent", "Select a site in the list first.")
+            return
+        site = item.data(Qt.ItemDataRole.UserRole) or {}
+        base = site.get("base") or self._base_of(site.get("url", ""))
+        choices = ["(use global / profile UA)", "Default (Engine)"] + self.ua_library.labels() + ["Custom…"]
+        cur = site.get("ua") or ""
+        idx = choices.index(cur) if cur in choices else (len(choices) - 1 if cur else 0)
+        choice, ok = QInputDialog.getItem(self, "Site User Agent", f"User agent for {base}:", choices, idx, False)
+        if not ok:
+            return
+        if choice == "Custom…":
+            text, ok = QInputDialog.getText(self, "Site User Agent", "User agent string:", text=cur if cur not in choices else "")
+            if not ok or not text.strip():
+                return
+            choice = text.strip()
+        before = self._ua_state()
+        for s in self.user_sites:
+            if (s.get("base") or self._base_of(s.get("url", ""))) == base:
+                if choice == choices[0]:
+                    s.pop("ua", None)
+                else:
+                    s["ua"] = choice
+        save_user_sites(self.user_sites)
+        self._reload_for_ua_change(before)
+        self.statusBar().showMessage(f"User agent for {base}: {choice}", 4000)
+
     def swap_left_right(self):
         try:
             if self.contentSplit.count() >= 2:
@@ -1076,6 +5613,578 @@ class Main(QMainWindow):
         self.set_user_agent(PRESET_UAS["Chrome (Android)"], "Chrome (Android)")
     '''
     
+    def show_analytics_dialog(self):
+        a = getattr(self, "analytics", None)
+        if a is None:
+            QMessageBox.information(self, "Analytics", "Analytics store is not available.")
+            return
+        a.flush()
+        repo = self.prompt_repo
+        reports = [
+            ("Top Prompts", ("Prompt", "Copies"), [((repo.get(pid) or {}).get("title") or pid, n) for pid, n in a.top_prompts()]),
+            ("Top Sites", ("Site", "Opens"), a.top_sites()),
+            ("Downloads per Site", ("Site", "Downloads"), a.downloads_per_site()),
+            ("Download Sources", ("Source Host", "Downloads"), a.download_sources()),
+        ]
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Analytics")
+        dlg.resize(640, 480)
+        v = QVBoxLayout(dlg)
+        tabs = QTabWidget()
+        for title, headers, rows in reports:
+            tbl = QTableWidget(len(rows), 2)
+            tbl.setHorizontalHeaderLabels(list(headers))
+            tbl.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+            tbl.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+            for r, (key, n) in enumerate(rows):
+                tbl.setItem(r, 0, QTableWidgetItem(str(key)))
+                cnt = QTableWidgetItem()
+                cnt.setData(Qt.ItemDataRole.DisplayRole, int(n))
+                tbl.setItem(r, 1, cnt)
+            tabs.addTab(tbl, title)
+        v.addWidget(tabs)
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        bb.rejected.connect(dlg.reject)
+        v.addWidget(bb)
+        dlg.exec()
+
+    # Ad/tracker blocking (RequestInterceptor + DomainBlocklist); config in ui.adblock
+    def _adblock_cfg(self):
+        ui_cfg = self.cfg.setdefault("ui", {})
+        if not isinstance(ui_cfg.get("adblock"), dict):
+            ui_cfg["adblock"] = {"enabled": True, "lists": [], "allow_sites": []}
+        return ui_cfg["adblock"]
+
+    def _save_adblock_cfg(self):
+        adb = self._adblock_cfg()
+        adb["enabled"] = bool(self.request_interceptor.enabled)
+        adb["allow_sites"] = sorted(self.request_interceptor.allow_sites)
+        try:
+            save_config(self.cfg)
+        except Exception:
+            pass
+
+    def _reload_blocklists(self):
+        # Big hosts lists take a while to parse: compile off the GUI thread, then swap
+        paths = [p for p in (self._adblock_cfg().get("lists") or []) if isinstance(p, str)]
+        if os.path.exists(BLOCKLIST_PATH):
+            paths.insert(0, BLOCKLIST_PATH)
+        if not paths:
+            return
+
+        def _build(paths=paths, icpt=self.request_interceptor):
+            bl = DomainBlocklist(DEFAULT_BLOCKLIST)
+            for path in paths:
+                bl.load_file(path)
+            icpt.blocklist = bl
+        threading.Thread(target=_build, daemon=True).start()
+
+    def toggle_adblock(self, checked):
+        self.request_interceptor.enabled = bool(checked)
+        self._save_adblock_cfg()
+        self.statusBar().showMessage("Ad/tracker blocking " + ("on" if checked else "off") + " (reload tabs to apply)", 4000)
+
+    def _current_site_base(self):
+        br = self.current_browser()
+        return self._base_of(br.url().toString()) if (br and br.url().isValid()) else ""
+
+    def _sync_adblock_menu(self):
+        base = self._current_site_base()
+        self.act_adblock_allow.blockSignals(True)
+        self.act_adblock_allow.setEnabled(bool(base))
+        self.act_adblock_allow.setText(f"Allow on {base}" if base else "Allow on Current Site")
+        self.act_adblock_allow.setChecked(base in self.request_interceptor.allow_sites)
+        self.act_adblock_allow.blockSignals(False)
+
+    def toggle_adblock_current_site(self, checked):
+        base = self._current_site_base()
+        if not base:
+            return
+        if checked:
+            self.request_interceptor.allow_sites.add(base)
+        else:
+            self.request_interceptor.allow_sites.discard(base)
+        self._save_adblock_cfg()
+        br = self.current_browser()
+        if br:
+            br.reload()
+
+    def add_blocklist_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Add Blocklist", "", "Blocklists (*.txt *.hosts);;All Files (*)")
+        if not path:
+            return
+        n = DomainBlocklist().load_file(path)
+        if not n:
+            QMessageBox.warning(self, "Add Blocklist", "No hosts-file or ||domain^ rules found in that file.")
+            return
+        adb = self._adblock_cfg()
+        lists = [p for p in (adb.get("lists") or []) if p != path]
+        adb["lists"] = lists + [path]
+        self._save_adblock_cfg()
+        self._reload_blocklists()
+        self.statusBar().showMessage(f"Added blocklist with {n} rules", 4000)
+
+    def _update_block_status(self):
+        icpt = self.request_interceptor
+        base = self._current_site_base()
+        row = icpt.blocked.get(base) if icpt.enabled else None
+        text = f"Blocked {row[0]} (~{row[1] // 1024} KB)" if row else ""
+        if text != self.blockStatusLabel.text():
+            self.blockStatusLabel.setText(text)
+
+    def show_blocked_dialog(self):
+        icpt = self.request_interceptor
+        rows = sorted(icpt.blocked.items(), key=lambda kv: -kv[1][0])
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Blocked Requests")
+        dlg.resize(560, 440)
+        v = QVBoxLayout(dlg)
+        v.addWidget(QLabel(f"{icpt.total} requests blocked this session, ~{sum(r[1] for _, r in rows) // 1024} KB saved "
+                           f"(estimated), {len(icpt.blocklist)} blocked domains loaded."))
+        tbl = QTableWidget(len(rows), 3)
+        tbl.setHorizontalHeaderLabels(["Site", "Blocked", "Est. KB saved"])
+        tbl.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        tbl.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        for r, (base, (n, nbytes)) in enumerate(rows):
+            tbl.setItem(r, 0, QTableWidgetItem(base or "(unknown)"))
+            for c, val in ((1, n), (2, nbytes // 1024)):
+                cell = QTableWidgetItem()
+                cell.setData(Qt.ItemDataRole.DisplayRole, int(val))
+                tbl.setItem(r, c, cell)
+        tbl.setSortingEnabled(True)
+        v.addWidget(tbl)
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        bb.rejected.connect(dlg.reject)
+        v.addWidget(bb)
+        dlg.exec()
+
+    # Static-asset cache (AssetCache + AssetCacheHandler); config in ui.asset_cache
+    def _asset_cache_cfg(self):
+        ui_cfg = self.cfg.setdefault("ui", {})
+        if not isinstance(ui_cfg.get("asset_cache"), dict):
+            ui_cfg["asset_cache"] = {"enabled": False, "max_mb": 512}
+        return ui_cfg["asset_cache"]
+
+    def toggle_asset_cache(self, checked):
+        self.request_interceptor.cache_enabled = bool(checked)
+        self._asset_cache_cfg()["enabled"] = bool(checked)
+        try:
+            save_config(self.cfg)
+        except Exception:
+            pass
+        self.statusBar().showMessage("Asset cache " + ("on" if checked else "off"), 3000)
+
+    def show_asset_cache_stats(self):
+        c = self.asset_cache
+        st = c.stats
+        QMessageBox.information(self, "Asset Cache",
+            f"Entries: {len(c.entries)}\n"
+            f"Size: {c.size / 1048576:.1f} MB of {c.max_bytes / 1048576:.0f} MB\n"
+            f"Hits: {st['hits']}   Misses: {st['misses']}   Hit ratio: {c.hit_ratio():.0%}\n"
+            f"Bytes saved: {st['bytes_saved'] / 1048576:.1f} MB\n"
+            f"Stored: {st['stored']}   Evicted: {st['evicted']}\n"
+            f"Skipped (not cacheable): {len(self.request_interceptor.cache_skip)} this session")
+
+    def clear_asset_cache(self):
+        if QMessageBox.question(self, "Asset Cache", "Delete all cached assets?") != QMessageBox.StandardButton.Yes:
+            return
+        self.asset_cache.clear()
+        self.statusBar().showMessage("Asset cache cleared", 3000)
+
+    # Page-load instrumentation (per site base; see SiteLoadStats)
+    def _install_perf_probe(self, profile):
+        if profile is None:
+            return
+        try:
+            scripts = profile.scripts()
+            for old in scripts.find("sora2-perf-probe"):
+                scripts.remove(old)
+            sc = QWebEngineScript()
+            sc.setName("sora2-perf-probe")
+            sc.setSourceCode(PERF_OBSERVER_JS)
+            sc.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentCreation)
+            sc.setWorldId(QWebEngineScript.ScriptWorldId.ApplicationWorld)
+            sc.setRunsOnSubFrames(False)
+            scripts.insert(sc)
+        except Exception:
+            pass
+
+    def _perf_load_started(self, br):
+        br._perf_t0 = time.monotonic()
+        br._perf_progress = 0
+
+    def _perf_load_finished(self, br, ok):
+        t0 = getattr(br, "_perf_t0", None)
+        br._perf_t0 = None
+        if t0 is None:
+            return
+        try:
+            url = br.url().toString()
+        except RuntimeError:
+            return
+        if not url.startswith(("http://", "https://")):
+            return
+        base = self._base_of(url)
+        if not ok:
+            # Aborted navigations (user moved on) are not failures of the site
+            if getattr(br, "_perf_progress", 0) < 100:
+                self.perf_stats.fail(base)
+        else:
+            self.perf_stats.add(base, "load", (time.monotonic() - t0) * 1000.0)
+            # Give LCP a moment to settle before reading the page's timing entries
+            QTimer.singleShot(1500, lambda b=br, base=base: self._perf_collect(b, base))
+        self._perf_changed(base)
+
+    def _perf_collect(self, br, base):
+        def _cb(res, base=base):
+            try:
+                data = json.loads(res) if isinstance(res, str) else {}
+            except ValueError:
+                data = {}
+            for metric in ("ttfb", "dcl", "onload", "lcp"):
+                v = data.get(metric)
+                if isinstance(v, (int, float)):
+                    self.perf_stats.add(base, metric, v)
+            self._perf_changed(base)
+        try:
+            if self._base_of(br.url().toString()) != base:
+                return
+            br.page().runJavaScript(PERF_COLLECT_JS, QWebEngineScript.ScriptWorldId.ApplicationWorld, _cb)
+        except (RuntimeError, TypeError):
+            pass
+
+    def _perf_changed(self, base):
+        self._perf_save_timer.start()
+        it = self._site_items.get(base)
+        if it is not None:
+            try:
+                self._update_site_item(it)
+            except RuntimeError:
+                self._site_items.pop(base, None)
+
+    PERF_COLUMNS = (("Site", None), ("Loads", "loads"), ("Failures", "failures"),
+                    ("Load p50 (ms)", "load_p50"), ("Load p95 (ms)", "load_p95"),
+                    ("TTFB p50", "ttfb_p50"), ("DCL p50", "dcl_p50"), ("Onload p50", "onload_p50"),
+                    ("LCP p50", "lcp_p50"), ("LCP p95", "lcp_p95"))
+
+    def show_performance_dialog(self):
+        rows = self.perf_stats.rows()
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Performance")
+        dlg.resize(900, 520)
+        v = QVBoxLayout(dlg)
+        v.addWidget(QLabel(f"Rolling stats over the last {self.perf_stats.window} loads per site (slowest first)."))
+        cols = self.PERF_COLUMNS
+        tbl = QTableWidget(len(rows), len(cols))
+        tbl.setHorizontalHeaderLabels([c[0] for c in cols])
+        tbl.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        tbl.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        for r, (base, sm) in enumerate(rows):
+            tbl.setItem(r, 0, QTableWidgetItem(base))
+            for c, (_, key) in enumerate(cols[1:], start=1):
+                cell = QTableWidgetItem()
+                val = sm.get(key)
+                if val is not None:
+                    cell.setData(Qt.ItemDataRole.DisplayRole, int(round(val)))
+                tbl.setItem(r, c, cell)
+        tbl.setSortingEnabled(True)
+        v.addWidget(tbl)
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        btn_csv = bb.addButton("Export CSV…", QDialogButtonBox.ButtonRole.ActionRole)
+        btn_csv.clicked.connect(lambda: self.export_performance_csv(rows))
+        btn_reset = bb.addButton("Reset", QDialogButtonBox.ButtonRole.ResetRole)
+
+        def _reset():
+            if QMessageBox.question(dlg, "Performance", "Clear all recorded load timings?") == QMessageBox.StandardButton.Yes:
+                self.perf_stats.clear()
+                self.perf_stats.save()
+                tbl.setRowCount(0)
+                self.refresh_sites_list()
+        btn_reset.clicked.connect(_reset)
+        bb.rejected.connect(dlg.reject)
+        v.addWidget(bb)
+        dlg.exec()
+
+    def export_performance_csv(self, rows=None):
+        import csv
+        path, _ = QFileDialog.getSaveFileName(self, "Export Performance", "sora2_performance.csv", "CSV Files (*.csv)")
+        if not path:
+            return
+        rows = self.perf_stats.rows() if rows is None else rows
+        try:
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow([c[0] for c in self.PERF_COLUMNS])
+                for base, sm in rows:
+                    w.writerow([base] + ["" if sm.get(k) is None else round(sm[k]) for _, k in self.PERF_COLUMNS[1:]])
+            self.statusBar().showMessage(f"Exported {len(rows)} site(s) to {path}", 4000)
+        except Exception as e:
+            QMessageBox.warning(self, "Export Performance", f"Could not write CSV:\n{e}")
+
+    # Local HTTP API (opt-in, 127.0.0.1 only; see README "Local API")
+    LOCAL_API_DEFAULTS = {"enabled": False, "port": 8765, "token": "",
+                          "max_connections": 32, "max_queue": 64, "max_inflight": 16}
+
+    def _local_api_cfg(self):
+        ui_cfg = self.cfg.get("ui") if isinstance(self.cfg.get("ui"), dict) else {}
+        raw = ui_cfg.get("local_api") if isinstance(ui_cfg.get("local_api"), dict) else {}
+        api_cfg = dict(self.LOCAL_API_DEFAULTS)
+        api_cfg.update({k: v for k, v in raw.items() if k in api_cfg})
+        return api_cfg
+
+    def _save_local_api_cfg(self, api_cfg):
+        ui_cfg = self.cfg.get("ui") or {}
+        if not isinstance(ui_cfg, dict):
+            ui_cfg = {}
+        self.cfg["ui"] = ui_cfg
+        ui_cfg["local_api"] = api_cfg
+        try:
+            save_config(self.cfg)
+        except Exception:
+            pass
+
+    def _apply_local_api_cfg(self):
+        api_cfg = self._local_api_cfg()
+        if self.api_server is not None:
+            self.api_server.stop()
+            self.api_server.deleteLater()
+            self.api_server = None
+        if api_cfg["enabled"]:
+            try:
+                srv = LocalApiServer(self._local_api_routes(), port=int(api_cfg["port"]), token=str(api_cfg["token"] or ""),
+                                     max_connections=int(api_cfg["max_connections"]), max_queue=int(api_cfg["max_queue"]),
+                                     max_inflight=int(api_cfg["max_inflight"]), parent=self)
+                if srv.start():
+                    self.api_server = srv
+                    self.statusBar().showMessage(f"Local API listening on http://127.0.0.1:{srv.port}/api/", 4000)
+                else:
+                    self.statusBar().showMessage(f"Local API failed to start: {srv.error_string()}", 6000)
+                    srv.deleteLater()
+            except Exception as e:
+                self.statusBar().showMessage(f"Local API failed to start: {e}", 6000)
+        act = getattr(self, "act_local_api", None)
+        if act is not None:
+            act.blockSignals(True)
+            act.setChecked(self.api_server is not None)
+            act.blockSignals(False)
+
+    def toggle_local_api(self, checked):
+        api_cfg = self._local_api_cfg()
+        api_cfg["enabled"] = bool(checked)
+        self._save_local_api_cfg(api_cfg)
+        self._apply_local_api_cfg()
+
+    def local_api_settings_dialog(self):
+        api_cfg = self._local_api_cfg()
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Local API Settings")
+        form = QFormLayout(dlg)
+        port = QSpinBox(); port.setRange(1024, 65535); port.setValue(int(api_cfg["port"]))
+        token = QLineEdit(str(api_cfg["token"] or "")); token.setPlaceholderText("optional bearer token")
+        queue = QSpinBox(); queue.setRange(1, 10000); queue.setValue(int(api_cfg["max_queue"]))
+        inflight = QSpinBox(); inflight.setRange(1, 1000); inflight.setValue(int(api_cfg["max_inflight"]))
+        form.addRow("Port", port)
+        form.addRow("Token", token)
+        form.addRow("Max queued requests", queue)
+        form.addRow("Max pending (long-poll/page)", inflight)
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        bb.accepted.connect(dlg.accept); bb.rejected.connect(dlg.reject)
+        form.addRow(bb)
+        if dlg.exec() != QDialog.DialogCode.Accepted:
+            return
+        api_cfg.update({"port": port.value(), "token": token.text().strip(),
+                        "max_queue": queue.value(), "max_inflight": inflight.value()})
+        self._save_local_api_cfg(api_cfg)
+        self._apply_local_api_cfg()
+
+    def _local_api_routes(self):
+        return {
+            ("GET", "/api/status"): self._api_status,
+            ("GET", "/api/tabs"): self._api_tabs,
+            ("GET", "/api/sites"): self._api_sites,
+            ("GET", "/api/prompts"): self._api_prompts,
+            ("GET", "/api/downloads"): self._api_downloads,
+            ("GET", "/api/downloads/wait"): self._api_downloads_wait,
+            ("POST", "/api/open"): self._api_open,
+            ("POST", "/api/ua"): self._api_ua,
+            ("POST", "/api/mail"): self._api_mail,
+            ("POST", "/api/render"): self._api_render,
+            ("POST", "/api/send"): self._api_send,
+        }
+
+    def _api_status(self, req):
+        br = self.current_browser()
+        return 200, {
+            "version": self.cfg.get("version"),
+            "tabs": self.leftTabs.count(),
+            "current_tab": self.leftTabs.currentIndex(),
+            "url": br.url().toString() if br is not None else "",
+            "user_agent": self.current_ua,
+            "mail_url": self.right.url().toString(),
+            "server": self.api_server.stats() if self.api_server is not None else {},
+        }
+
+    def _api_tabs(self, req):
+        tabs = []
+        for i in range(self.leftTabs.count()):
+            b = self.leftTabs.widget(i)
+            tabs.append({"index": i, "title": self.leftTabs.tabToolTip(i) or self.leftTabs.tabText(i),
+                         "url": b.url().toString() if b is not None else ""})
+        return 200, {"tabs": tabs, "current": self.leftTabs.currentIndex()}
+
+    def _api_sites(self, req):
+        return 200, {"sites": list(self.user_sites)}
+
+    def _api_prompts(self, req):
+        try:
+            limit = int(req.query.get("limit") or 0)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        out = []
+        for o in search_prompts(self.prompt_repo, (req.query.get("q") or "").split(), req.query.get("category")):
+            out.append(o)
+            if limit and len(out) >= limit:
+                break
+        return 200, {"prompts": out}
+
+    def _api_open(self, req):
+        data = req.json()
+        url = data.get("url") or ""
+        site = data.get("site")
+        if not url and site is not None:
+            for s in self.user_sites:
+                if str(s.get("id")) == str(site) or self._base_of(s.get("url", "")) == str(site).lower():
+                    url = s.get("url", "")
+                    break
+            else:
+                raise ValueError(f"unknown site: {site}")
+        url = self._normalize_url_text(url)
+        if not url:
+            raise ValueError("pass a valid 'url' or 'site'")
+        if data.get("private"):
+            self.open_url_in_private_tab(url)
+        else:
+            self.open_url_in_new_tab(url)
+        return 200, {"tab": self.leftTabs.currentIndex(), "url": url}
+
+    def _api_ua(self, req):
+        data = req.json()
+        preset = data.get("preset")
+        if preset:
+            if preset == "Default (Engine)":
+                self.set_user_agent(None, preset_label=preset)
+            elif preset in self.ua_library:
+                self.set_user_agent(self.ua_library.ua(preset), preset_label=preset)
+            else:
+                raise ValueError(f"unknown preset: {preset}")
+        elif data.get("ua"):
+            self.set_user_agent(str(data["ua"]))
+        else:
+            raise ValueError("pass 'preset' or 'ua'")
+        return 200, {"user_agent": self.current_ua}
+
+    def _api_mail(self, req):
+        url = (req.json().get("url") or "").strip()
+        if not url:
+            raise ValueError("pass 'url'")
+        self.open_mail_site(url)
+        return 200, {"mail_url": self.right.url().toString()}
+
+    def _api_render_text(self, data):
+        # {"id"|"text", "characters": [...], "values": [...], "named": {slot: value}}; characters default
+        # to the UI selection, named slots to the values remembered for the prompt
+        text = data.get("text")
+        named = {}
+        if text is None:
+            o = self.prompt_repo.get(data.get("id"))
+            if o is None:
+                raise ValueError(f"unknown prompt id: {data.get('id')}")
+            text = o.get("text") or ""
+            named = self.placeholders.get(o.get("id"))[1]
+        named.update({placeholder_key(k): str(v) for k, v in (data.get("named") or {}).items() if v})
+        chars = data.get("characters")
+        if chars is None:
+            chars = [b.currentText() if b.currentIndex() > 0 else "" for b in
+                     (self.character1Box, self.character2Box, self.character3Box, self.character4Box)]
+        values = [str(c) for c in list(chars)[:4] if c] + [str(v) for v in (data.get("values") or [])]
+        return render_prompt_text(str(text), values, named)
+
+    def _api_render(self, req):
+        return 200, {"text": self._api_render_text(req.json())}
+
+    def _api_send(self, req):
+        # Render, then write into the page's focused (or first) text box via page JS
+        data = req.json()
+        text = self._api_render_text(data)
+        idx = data.get("tab", self.leftTabs.currentIndex())
+        br = self.leftTabs.widget(int(idx)) if str(idx).lstrip("-").isdigit() else None
+        if br is None or not hasattr(br, "page"):
+            raise ValueError(f"no such tab (or not loaded yet): {idx}")
+        js = ("(function(t){var e=document.activeElement;"
+              "function ok(x){return x&&(x.tagName==='TEXTAREA'||x.isContentEditable||"
+              "(x.tagName==='INPUT'&&/^(text|search|)$/i.test(x.type||'')));}"
+              "if(!ok(e))e=document.querySelector('textarea,[contenteditable=\"true\"],input[type=text]');"
+              "if(!e)return false;e.focus();"
+              "if(e.isContentEditable){e.textContent=t;}else{"
+              "var p=e.tagName==='TEXTAREA'?HTMLTextAreaElement.prototype:HTMLInputElement.prototype;"
+              "Object.getOwnPropertyDescriptor(p,'value').set.call(e,t);}"
+              "e.dispatchEvent(new Event('input',{bubbles:true}));"
+              "e.dispatchEvent(new Event('change',{bubbles:true}));return true;})(" + json.dumps(text) + ")")
+        state = {"done": False}
+
+        def _reply(status, payload):
+            if not state["done"]:
+                state["done"] = True
+                req.respond(status, payload)
+        br.page().runJavaScript(js, lambda ok: _reply(200, {"sent": bool(ok), "tab": int(idx), "text": text}))
+        QTimer.singleShot(10000, lambda: _reply(504, {"error": "page did not answer"}))
+        return req.defer()
+
+    def _download_view(self, d):
+        item = self._download_items.get(d["id"])
+        if item is not None:
+            try:
+                d["received"] = int(item.receivedBytes()); d["total"] = int(item.totalBytes())
+            except Exception:
+                pass
+        return dict(d)
+
+    def _api_downloads(self, req):
+        try:
+            after = int(req.query.get("after") or 0)
+        except ValueError:
+            raise ValueError("after must be an integer")
+        return 200, {"downloads": [self._download_view(d) for d in self._downloads if d["id"] > after]}
+
+    def _api_downloads_wait(self, req):
+        # Long-poll: answers when a download newer than ?after= finishes, or after ?timeout= s
+        try:
+            after = int(req.query.get("after") or 0)
+            timeout = min(120.0, max(0.0, float(req.query.get("timeout") or 30)))
+        except ValueError:
+            raise ValueError("after/timeout must be numbers")
+        ready = [dict(d) for d in self._downloads if d["id"] > after and d["state"] != "in_progress"]
+        if ready or timeout == 0:
+            return 200, {"downloads": ready, "timeout": not ready}
+        waiter = {"after": after, "req": req, "done": False}
+        self._download_waiters.append(waiter)
+
+        def _expire(w=waiter):
+            if not w["done"]:
+                w["done"] = True
+                self._download_waiters.remove(w)
+                w["req"].respond(200, {"downloads": [], "timeout": True})
+        QTimer.singleShot(int(timeout * 1000), _expire)
+        return req.defer()
+
+    def _notify_download_waiters(self):
+        for w in list(self._download_waiters):
+            ready = [dict(d) for d in self._downloads if d["id"] > w["after"] and d["state"] != "in_progress"]
+            if ready and not w["done"]:
+                w["done"] = True
+                self._download_waiters.remove(w)
+                w["req"].respond(200, {"downloads": ready, "timeout": False})
+
     # Cookies
     def clear_recaptcha_cookies(self):
         self.profile.cookieStore().deleteAllCookies()
@@ -1138,6 +6247,47 @@ class Main(QMainWindow):
         item.accept()
         self.statusBar().showMessage(f"Downloading to {downloads/fname}", 4000)
 
+        # Analytics: attribute the download to the site tab that requested it
+        try:
+            page = item.page() if hasattr(item, "page") else None
+            origin = page.url().toString() if page is not None else ""
+        except Exception:
+            origin = ""
+        if not origin:
+            br = self.current_browser()
+            origin = br.url().toString() if (br and br.url().isValid()) else ""
+        site = self._base_of(origin) or None
+        source = self._base_of(item.url().toString()) or None
+
+        entry = {"id": (self._downloads[-1]["id"] + 1) if self._downloads else 1, "url": item.url().toString(),
+                 "path": str(downloads / fname), "site": site, "state": "in_progress",
+                 "received": 0, "total": -1, "started": time.time(), "finished": None}
+        self._downloads.append(entry)
+        del self._downloads[:-500]
+        self._download_items[entry["id"]] = item
+
+        def _on_state(*_, it=item, site=site, source=source, entry=entry):
+            try:
+                st = it.state()
+                if st == QWebEngineDownloadRequest.DownloadState.DownloadCompleted:
+                    self._record_event("download_completed", site=site, detail=source)
+                    entry["state"] = "completed"
+                elif st == QWebEngineDownloadRequest.DownloadState.DownloadCancelled:
+                    entry["state"] = "cancelled"
+                elif st == QWebEngineDownloadRequest.DownloadState.DownloadInterrupted:
+                    entry["state"] = "interrupted"
+                if entry["state"] != "in_progress":
+                    entry["received"] = int(it.receivedBytes()); entry["total"] = int(it.totalBytes())
+                    entry["finished"] = time.time()
+                    self._download_items.pop(entry["id"], None)
+                    self._notify_download_waiters()
+            except Exception:
+                pass
+        try:
+            item.stateChanged.connect(_on_state)
+        except Exception:
+            pass
+
     # Splitter sync
     def _apply_split_sizes(self, sizes):
         # If link_splitters is False, do not propagate sizes between top/bottom splitters
@@ -1179,11 +6329,14 @@ class Main(QMainWindow):
             z = 1.0
         z = max(0.25, min(5.0, z))
         self.left_zoom = z
+        # Pane default; tabs on sites with a remembered zoom keep theirs
         try:
+            site_zoom = self.cfg.get("ui", {}).get("site_zoom") or {}
             for i in range(self.leftTabs.count()):
                 w = self.leftTabs.widget(i)
-                if isinstance(w, QWebEngineView):
-                    w.setZoomFactor(z)
+                if isinstance(w, (QWebEngineView, _LazyTab)):
+                    if self._base_of(w.url().toString()) not in site_zoom and abs(w.zoomFactor() - z) > 1e-3:
+                        w.setZoomFactor(z)
         except Exception:
             pass
         try:
@@ -1197,7 +6350,103 @@ class Main(QMainWindow):
             pass
 
     def change_left_zoom(self, delta: float):
-        self.set_left_zoom(getattr(self, "left_zoom", 1.0) + float(delta))
+        # F3/F4: zoom the current site only (remembered per base)
+        br = self.current_browser()
+        if br is not None:
+            self._set_site_zoom(br, br.zoomFactor() + float(delta))
+
+    def reset_site_zoom(self):
+        br = self.current_browser()
+        if br is not None:
+            self._set_site_zoom(br, getattr(self, "left_zoom", 1.0))
+
+    def _site_zoom_for(self, base):
+        try:
+            return float(self.cfg["ui"]["site_zoom"][base])
+        except Exception:
+            return getattr(self, "left_zoom", 1.0)
+
+    def _set_site_zoom(self, br, value):
+        z = round(max(0.25, min(5.0, float(value))), 2)
+        base = self._base_of(br.url().toString())
+        if base:
+            site_zoom = self.cfg.setdefault("ui", {}).setdefault("site_zoom", {})
+            if abs(z - getattr(self, "left_zoom", 1.0)) < 1e-3:
+                site_zoom.pop(base, None)  # only non-default values are stored
+            else:
+                site_zoom[base] = z
+            self.schedule_config_save()
+            # Other open tabs on the same site follow; everything else is left alone
+            for i in range(self.leftTabs.count()):
+                w = self.leftTabs.widget(i)
+                if w is not br and getattr(w, "_zoom_base", None) == base and abs(w.zoomFactor() - z) > 1e-3:
+                    w.setZoomFactor(z)
+        br.setZoomFactor(z)
+        self.statusBar().showMessage(f"Zoom {int(round(z * 100))}%" + (f" for {base}" if base else ""), 2000)
+
+    def _apply_site_zoom(self, br, url):
+        # urlChanged: only touch the renderer when the site (and so its zoom) changed
+        base = self._base_of(url.toString())
+        if getattr(br, "_zoom_base", None) == base:
+            return
+        br._zoom_base = base
+        z = self._site_zoom_for(base)
+        if abs(br.zoomFactor() - z) > 1e-3:
+            br.setZoomFactor(z)
+
+    def _remember_scroll(self, br):
+        key = getattr(br, "_scroll_key", None)
+        if not key:
+            return
+        try:
+            y = int(br.page().scrollPosition().y())
+        except Exception:
+            return
+        base, path = key
+        store = self.cfg.setdefault("ui", {}).setdefault("site_scroll", {})
+        old = store.get(base)
+        if y > 0:
+            if old == [path, y]:
+                return
+            store.pop(base, None)
+            store[base] = [path, y]  # most recent last
+            while len(store) > 500:
+                store.pop(next(iter(store)))
+        elif old and old[0] == path:
+            del store[base]
+        else:
+            return
+        self.schedule_config_save()
+
+    def _restore_scroll(self, br, ok):
+        try:
+            u = br.url()
+        except RuntimeError:
+            return
+        if u.scheme() not in ("http", "https"):
+            br._scroll_key = None
+            return
+        base, path = self._base_of(u.toString()), u.path() or "/"
+        br._scroll_key = (base, path)
+        ent = (self.cfg.get("ui", {}).get("site_scroll") or {}).get(base)
+        if ok and ent and ent[0] == path and ent[1] > 0:
+            try:
+                br.page().runJavaScript(f"window.scrollTo(0,{int(ent[1])})")
+            except Exception:
+                pass
+
+    def schedule_config_save(self):
+        t = getattr(self, "_cfg_save_timer", None)
+        if t is not None:
+            t.start()  # restarts: one write per burst of changes
+        else:
+            self._flush_config()
+
+    def _flush_config(self):
+        try:
+            save_config(self.cfg)
+        except Exception:
+            pass
 
     def set_right_zoom(self, value: float):
         try:
@@ -1313,6 +6562,12 @@ class Main(QMainWindow):
     def _connect_left_browser(self, br: QWebEngineView):
         br.titleChanged.connect(lambda t, b=br: self.on_tab_title_changed(b, t))
         br.urlChanged.connect(lambda u, b=br: self.on_tab_url_changed(b, u))
+        br.loadStarted.connect(lambda b=br: self._remember_scroll(b))  # still showing the old page
+        br.loadStarted.connect(lambda b=br: self._perf_load_started(b))
+        br.loadStarted.connect(lambda b=br: setattr(b, "_ua_stale", False))  # any load picks up the current UA
+        br.loadProgress.connect(lambda p, b=br: setattr(b, "_perf_progress", p))
+        br.loadFinished.connect(lambda ok, b=br: self._perf_load_finished(b, ok))
+        br.loadFinished.connect(lambda ok, b=br: self._restore_scroll(b, ok))
 
     def on_tab_title_changed(self, br: QWebEngineView, title: str):
         idx = self.leftTabs.indexOf(br)
@@ -1322,11 +6577,19 @@ class Main(QMainWindow):
             self.leftTabs.setTabToolTip(idx, ttl)
 
     def on_tab_url_changed(self, br: QWebEngineView, url: QUrl):
+        self._apply_site_zoom(br, url)
         if br is self.current_browser():
             self.addr.setText(url.toString())
 
     def on_left_tab_changed(self, index: int):
+        if getattr(self, "_materializing", False):
+            return
+        if isinstance(self.leftTabs.widget(index), _LazyTab):
+            self._materialize_tab(index)
         br = self.current_browser()
+        if br is not None and getattr(br, "_ua_stale", False):
+            br._ua_stale = False
+            br.reload()
         if br and br.url().isValid():
             self.addr.setText(br.url().toString())
         else:
@@ -1342,11 +6605,113 @@ class Main(QMainWindow):
             self.leftTabs.setTabToolTip(index, "New Tab")
             return
         w = self.leftTabs.widget(index)
+        if isinstance(w, QWebEngineView):
+            self._remember_scroll(w)
         self.leftTabs.removeTab(index)
         if w:
             w.deleteLater()
 
 
+    # Tab session (sora2_session.json): restored tabs stay _LazyTab until first shown
+    def _session_restore_enabled(self):
+        ui_cfg = self.cfg.get("ui") if isinstance(self.cfg.get("ui"), dict) else {}
+        return bool(ui_cfg.get("restore_session", True))
+
+    def toggle_session_restore(self, checked):
+        self.cfg.setdefault("ui", {})["restore_session"] = bool(checked)
+        try:
+            save_config(self.cfg)
+        except Exception:
+            pass
+
+    def _restore_session_tabs(self, session):
+        tabs = [t for t in (session or {}).get("tabs", []) if isinstance(t, dict) and t.get("url")]
+        if not tabs:
+            return False
+        self._materializing = True
+        try:
+            for t in tabs:
+                title = str(t.get("title") or "")
+                try:
+                    zoom = float(t.get("zoom") or getattr(self, "left_zoom", 1.0))
+                except Exception:
+                    zoom = getattr(self, "left_zoom", 1.0)
+                lazy = _LazyTab(str(t["url"]), title, bool(t.get("private")), zoom)
+                idx = self.leftTabs.addTab(lazy, (title or "…")[:30])
+                self.leftTabs.setTabToolTip(idx, title or str(t["url"]))
+            try:
+                active = int(session.get("active") or 0)
+            except Exception:
+                active = 0
+            active = max(0, min(active, self.leftTabs.count() - 1))
+            self.leftTabs.setCurrentIndex(active)
+        finally:
+            self._materializing = False
+        self._materialize_tab(active)
+        return True
+
+    def _materialize_tab(self, index):
+        # Swap a _LazyTab for a real Browser at the same position and start its load
+        w = self.leftTabs.widget(index)
+        if not isinstance(w, _LazyTab):
+            return w
+        profile = getattr(self, "private_profile", None) if w.private else getattr(self, "profile", None)
+        br = self._create_browser_with_profile(profile)
+        try:
+            br.setZoomFactor(w.zoomFactor())
+        except Exception:
+            pass
+        was_current = self.leftTabs.currentIndex() == index
+        text, tip = self.leftTabs.tabText(index), self.leftTabs.tabToolTip(index)
+        self._materializing = True
+        try:
+            self.leftTabs.insertTab(index, br, text)
+            self.leftTabs.setTabToolTip(index, tip)
+            self.leftTabs.removeTab(index + 1)
+            if was_current:
+                self.leftTabs.setCurrentIndex(index)
+        finally:
+            self._materializing = False
+        br.setUrl(w.url())
+        w.deleteLater()
+        return br
+
+    def _session_snapshot(self):
+        tabs, active = [], 0
+        for i in range(self.leftTabs.count()):
+            w = self.leftTabs.widget(i)
+            try:
+                url = w.url().toString() if w.url().isValid() else ""
+            except Exception:
+                url = ""
+            # about:blank / the help page / data: URLs are not worth restoring
+            if not url.startswith(("http://", "https://", "file:")):
+                continue
+            try:
+                zoom = round(float(w.zoomFactor()), 3)
+            except Exception:
+                zoom = 1.0
+            if i == self.leftTabs.currentIndex():
+                active = len(tabs)
+            tabs.append({"url": url, "title": self.leftTabs.tabToolTip(i) or self.leftTabs.tabText(i),
+                         "private": bool(getattr(w, "private", False)), "zoom": zoom})
+        try:
+            mail_url = self.right.url().toString() if self.right.url().isValid() else ""
+        except Exception:
+            mail_url = ""
+        return {"version": 1, "active": active, "mail_url": mail_url or self.cfg.get("window", {}).get("mail_url", ""), "tabs": tabs}
+
+    def save_session_now(self):
+        snap = self._session_snapshot()
+        key = json.dumps(snap, sort_keys=True)
+        if key == self._session_last:
+            return True
+        snap["saved"] = time.time()
+        ok = save_session(snap)
+        if ok:
+            self._session_last = key
+        return ok
+
     def _normalize_url_text(self, text: str) -> str:
         text = (text or "").strip()
         if not text:
@@ -1379,6 +6744,7 @@ class Main(QMainWindow):
                 br.setPage(page)
             except Exception:
                 pass
+        br.private = profile is not None and profile is getattr(self, "private_profile", None)
         self._connect_left_browser(br)
         try:
             br.setZoomFactor(getattr(self, "left_zoom", 1.0))
@@ -1395,6 +6761,7 @@ class Main(QMainWindow):
         self.leftTabs.setCurrentIndex(idx)
         br.setUrl(QUrl(url))
         self.addr.setText(url)
+        self._record_event("site_opened", site=self._base_of(url) or None, detail=url)
 
     def open_url_in_private_tab(self, url: str):
         url = self._normalize_url_text(url)
@@ -1405,6 +6772,7 @@ class Main(QMainWindow):
         self.leftTabs.setCurrentIndex(idx)
         br.setUrl(QUrl(url))
         self.addr.setText(url)
+        self._record_event("site_opened", site=self._base_of(url) or None, detail=url)
 
     # Navigation helpers
     def open_external(self):
@@ -1473,10 +6841,98 @@ class Main(QMainWindow):
         if u:
             self.open_url_in_new_tab(u)
     def load_from_list(self, item: QListWidgetItem):
+        # Ctrl/Shift-click only extends the selection (see Open Selected)
+        mods = QApplication.keyboardModifiers()
+        if mods & (Qt.KeyboardModifier.ControlModifier | Qt.KeyboardModifier.ShiftModifier):
+            return
         site = item.data(Qt.ItemDataRole.UserRole); u = site.get("url","")
         if u:
             self.open_url_in_new_tab(u)
+            try:
+                self.usage_stats.touch("sites", self._site_item_key(item))
+                mode = getattr(self, "site_sort_mode", "original")
+                if mode in ("recent", "frequent"):
+                    self._bump_item_rank(self.listw, "sites", mode, item, self._site_item_key)
+            except Exception:
+                pass
             
+    def open_selected_sites(self):
+        items = self.listw.selectedItems()
+        if not items:
+            QMessageBox.information(self, "Open Selected", "Select one or more sites (Ctrl/Shift-click) first.")
+            return
+        # Keep list order, not click order
+        items.sort(key=self.listw.row)
+        self.open_sites_queued([it.data(Qt.ItemDataRole.UserRole) for it in items])
+
+    def _populate_open_category_menu(self):
+        menu = self.m_sites_open_cat
+        menu.clear()
+        counts = {}
+        for s in self.user_sites:
+            cat = (s.get("category") or "uncategorized").strip() or "uncategorized"
+            counts[cat] = counts.get(cat, 0) + 1
+        for cat in sorted(counts, key=str.casefold):
+            a = menu.addAction(f"{cat} ({counts[cat]})")
+            a.triggered.connect(lambda _, c=cat: self.open_site_category(c))
+
+    def open_site_category(self, category):
+        self.open_sites_queued([s for s in self.user_sites
+                                if ((s.get("category") or "uncategorized").strip() or "uncategorized") == category])
+
+    def open_sites_queued(self, sites):
+        # Tabs appear at once as placeholders; LoadScheduler starts at most K real loads
+        profile = self._get_default_profile()
+        private = profile is not None and profile is getattr(self, "private_profile", None)
+        n = 0
+        for site in sites:
+            url = self._normalize_url_text((site or {}).get("url", ""))
+            if not url:
+                continue
+            title = (site.get("name") or self._base_of(url) or url)
+            lazy = _LazyTab(url, title, private, getattr(self, "left_zoom", 1.0))
+            idx = self.leftTabs.addTab(lazy, title[:30])
+            self.leftTabs.setTabToolTip(idx, url)
+            self.load_scheduler.submit(lambda t=lazy: self._start_queued_tab(t))
+            base = site.get("base") or self._base_of(url)
+            self._record_event("site_opened", site=base or None, detail=url)
+            if base:
+                self.usage_stats.touch("sites", base)
+            n += 1
+        if n:
+            self.statusBar().showMessage(f"Queued {n} site(s)", 3000)
+
+    def _start_queued_tab(self, lazy):
+        # Returns the Browser to watch, or None if the tab was closed/already shown
+        try:
+            idx = self.leftTabs.indexOf(lazy)
+        except RuntimeError:
+            return None
+        if idx < 0:
+            return None
+        return self._materialize_tab(idx)
+
+    def stop_queued_loads(self):
+        n = self.load_scheduler.cancel_pending()
+        self.statusBar().showMessage(f"Dropped {n} queued load(s); those tabs load when selected", 4000)
+
+    def _update_load_status(self):
+        st = self.load_scheduler.stats()
+        if not st["active"] and not st["queued"] and not st["completed"] and not st["timeouts"]:
+            self.loadStatusLabel.setText("")
+            return
+        parts = []
+        if st["active"] or st["queued"]:
+            parts.append(f"Loading {st['active']}/{self.load_scheduler.limit}, queued {st['queued']}")
+        else:
+            parts.append("Loads idle")
+        if st["p50"] is not None:
+            parts.append(f"p50 {st['p50']:.1f}s p95 {st['p95']:.1f}s")
+        parts.append(f"done {st['completed']}")
+        if st["timeouts"]:
+            parts.append(f"timeouts {st['timeouts']}")
+        self.loadStatusLabel.setText(" · ".join(parts))
+
     def load_left_addr(self):
         u = self._normalize_url_text(self.addr.text())
         br = self.current_browser()
@@ -1486,14 +6942,51 @@ class Main(QMainWindow):
             
     def refresh_sites_list(self):
         self.listw.clear()
-        for site in self.user_sites:
-            txt = f'{site.get("id",0):02d}. {site.get("url","")}'
-            it = QListWidgetItem(txt)
-            it.setData(Qt.ItemDataRole.UserRole, site)
-            it.setToolTip(site.get("url",""))
-            it.setSizeHint(QSize(100,28))
+        self._site_items = {}
+        for site in self._sorted_sites():
+            it = self._new_site_item(site)
+            self._site_items.setdefault(self._site_key(site), it)
             self.listw.addItem(it)
 
+    def _site_key(self, site):
+        return site.get("base") or self._base_of(site.get("url", ""))
+
+    def _new_site_item(self, site):
+        it = QListWidgetItem()
+        it.setData(Qt.ItemDataRole.UserRole, site)
+        it.setSizeHint(QSize(100,28))
+        self._update_site_item(it)
+        return it
+
+    def _sorted_sites(self):
+        sites = list(self.user_sites)
+        mode = getattr(self, "site_sort_mode", "original")
+        if mode in ("recent", "frequent") and hasattr(self, "usage_stats"):
+            sites = self._usage_order(sites, "sites", mode, self._site_key)
+        elif mode == "fastest" and hasattr(self, "perf_stats"):
+            # Measured sites by median load time; unmeasured keep their order below them
+            def _p50(s):
+                sm = self.perf_stats.summary(s.get("base") or self._base_of(s.get("url", "")))
+                return sm["load_p50"] if sm and sm["load_p50"] else float("inf")
+            sites.sort(key=_p50)
+        return sites
+
+    def _update_site_item(self, it):
+        # Item text carries the load-time "column": "07. https://…   [1.8s / p95 4.2s]"
+        site = it.data(Qt.ItemDataRole.UserRole) or {}
+        txt = f'{site.get("id",0):02d}. {site.get("url","")}'
+        tip = site.get("url","")
+        sm = self.perf_stats.summary(site.get("base") or self._base_of(site.get("url", ""))) if hasattr(self, "perf_stats") else None
+        if sm and sm["load_p50"]:
+            txt += f'   [{sm["load_p50"] / 1000:.1f}s / p95 {sm["load_p95"] / 1000:.1f}s]'
+            tip += f'\nload p50 {sm["load_p50"]:.0f} ms, p95 {sm["load_p95"]:.0f} ms over {sm["loads"]} loads'
+            if sm["lcp_p50"]:
+                tip += f'\nLCP p50 {sm["lcp_p50"]:.0f} ms'
+            if sm["failures"]:
+                tip += f'\n{sm["failures"]} failed loads'
+        it.setText(txt)
+        it.setToolTip(tip)
+
     def _base_of(self, url: str) -> str:
         try:
             host = urlparse(url).netloc.lower()
@@ -1736,40 +7229,97 @@ class Main(QMainWindow):
             QMessageBox.critical(self, "Import Error", str(e))
 
     # Prompts helpers
+    PROMPT_SORT_MODES = ("original", "name", "category", "recent", "frequent")
+    SITE_SORT_MODES = ("original", "recent", "frequent", "fastest")
+
     def toggle_prompt_sort(self):
-        # Cycle prompt sort mode: original -> name -> category -> original
+        # Cycle prompt sort mode: original -> name -> category -> recent -> frequent -> original
+        modes = self.PROMPT_SORT_MODES
         mode = getattr(self, "prompt_sort_mode", "original")
+        nxt = modes[(modes.index(mode) + 1) % len(modes)] if mode in modes else "original"
+        self.prompt_sort_mode = nxt
+        try:
+            after = modes[(modes.index(nxt) + 1) % len(modes)]
+            self.btnPromptSort.setText(f"Sort By {after.title()}")
+        except Exception:
+            pass
 
-        if mode == "original":
-            # Next: sort by name
-            self.prompt_sort_mode = "name"
-            try:
-                self.btnPromptSort.setText("Sort By Category")
-            except Exception:
-                pass
-        elif mode == "name":
-            # Next: sort by category
-            self.prompt_sort_mode = "category"
-            try:
-                self.btnPromptSort.setText("Sort By Original")
-            except Exception:
-                pass
-        else:
-            # Currently category -> next: back to original JSON order
-            self.prompt_sort_mode = "original"
-            try:
-                self.btnPromptSort.setText("Sort By Name")
-            except Exception:
-                pass
+        if "name" not in (mode, nxt):
+            # Same labels as the previous mode: move the existing items, recreate nothing
+            self._patch_prompts_list()
+            return
 
         # Rebuild list with new sort
         self.refresh_prompts_list()
 
+    def _prompt_item_key(self, item):
+        o = item.data(Qt.ItemDataRole.UserRole)
+        return o.get("id") if isinstance(o, dict) else None
+
+    def _site_item_key(self, item):
+        site = item.data(Qt.ItemDataRole.UserRole) or {}
+        return site.get("base") or self._base_of(site.get("url", ""))
+
+    def _ranked_keys(self, ns, mode):
+        if mode == "recent":
+            return self.usage_stats.recent_keys(ns)
+        return self.usage_stats.frequent_keys(ns)
+
+    def _usage_order(self, objs, ns, mode, key_fn):
+        # The one Recent/Frequent order: used items first in rank order, the rest in the
+        # order given (JSON order). List rebuilds and sort toggles both go through here.
+        rank = {k: i for i, k in enumerate(self._ranked_keys(ns, mode))}
+        return sorted(objs, key=lambda o: rank.get(key_fn(o), len(rank)))
+
+    def _bump_item_rank(self, lw, ns, mode, item, key_fn):
+        # After a use, move just this item to its new rank position
+        if item is None or lw.row(item) < 0:
+            return
+        lw.blockSignals(True)
+        try:
+            cur = lw.currentItem()
+            r = lw.row(item)
+            if mode == "recent":
+                target = 0
+            else:
+                mine = self.usage_stats.score(ns, key_fn(item)) or float("-inf")
+                target = r
+                while target > 0:
+                    above = self.usage_stats.score(ns, key_fn(lw.item(target - 1)))
+                    if above is not None and above >= mine:
+                        break
+                    target -= 1
+            if target != r:
+                lw.takeItem(r)
+                lw.insertItem(target, item)
+            if cur is not None:
+                lw.setCurrentItem(cur)
+        finally:
+            lw.blockSignals(False)
+
+    def toggle_site_sort(self):
+        modes = self.SITE_SORT_MODES
+        mode = getattr(self, "site_sort_mode", "original")
+        nxt = modes[(modes.index(mode) + 1) % len(modes)] if mode in modes else "original"
+        self.site_sort_mode = nxt
+        try:
+            self.btnSiteSort.setText(f"Sort: {nxt.title()}")
+        except Exception:
+            pass
+        self._patch_sites_list()
+
     def refresh_prompts_list(self):
         self.promptList.clear()
-        
-        # Normalize merged prompts list (supports string or object items)
-        self._prompt_objs = _normalize_prompts_list(self.user_prompts)
+        self._prompt_items = {}
+        for obj in self._visible_prompt_objs():
+            it = self._new_prompt_item(obj)
+            self.promptList.addItem(it)
+            self._prompt_items[obj.get('id')] = it
+
+    def _visible_prompt_objs(self):
+        # Sorts self._prompt_objs, rebuilds the category filter (keeping its selection)
+        # and returns the prompts the list shows, in order
+        self._prompt_objs = self.prompt_repo.to_list()
 
         # Apply current sort mode
         mode = getattr(self, "prompt_sort_mode", "original")
@@ -1791,6 +7341,8 @@ class Main(QMainWindow):
                     (o.get("category") or "Base").casefold(),
                 )
             )
+        elif mode in ("recent", "frequent"):
+            objs = self._usage_order(objs, "prompts", mode, lambda o: o.get("id"))
         # else: "original" -> keep JSON order as loaded (no sort)
 
         self._prompt_objs = objs
@@ -1810,20 +7362,39 @@ class Main(QMainWindow):
         else:
             selected = 'Show All'
 
-        for obj in self._prompt_objs:
-            cat = obj.get('category') or 'Base'
-            if selected != 'Show All' and cat != selected:
-                continue
-            title = obj.get('title') or 'Untitled'
-            # When sorting by name, hide category in the list label
-            if mode == "name":
-                display_text = title
-            else:
-                display_text = f"{cat} · {title}"
-            it = QListWidgetItem(display_text)
-            it.setData(Qt.ItemDataRole.UserRole, obj)
-            it.setToolTip(obj.get('text',''))
-            self.promptList.addItem(it)
+        try:
+            self._sync_prompt_picker()
+        except Exception:
+            pass
+
+        if selected == 'Show All':
+            return list(self._prompt_objs)
+        return [o for o in self._prompt_objs if (o.get('category') or 'Base') == selected]
+
+    def _new_prompt_item(self, obj):
+        # Label is "Category · Title", or just the title when sorting by name
+        it = QListWidgetItem(self._prompt_display_text(obj))
+        it.setData(Qt.ItemDataRole.UserRole, obj)
+        it.setToolTip(obj.get('text', ''))
+        return it
+
+    def _prompt_display_text(self, obj):
+        title = obj.get('title') or 'Untitled'
+        if getattr(self, "prompt_sort_mode", "original") == "name":
+            return title
+        return f"{obj.get('category') or 'Base'} · {title}"
+
+    def _selected_character_names(self, keep_only=True):
+        # Character 1-4 in slot order ("" = none); cleared when "Keep" is off (copy only)
+        names = []
+        for box in (self.character1Box, self.character2Box, self.character3Box, self.character4Box):
+            try:
+                names.append(box.currentText() if box.currentIndex() > 0 else "")
+            except Exception:
+                names.append("")
+        if keep_only and hasattr(self, "keepNamesCheck") and not self.keepNamesCheck.isChecked():
+            return ["", "", "", ""]
+        return names
 
     def copy_selected_prompt(self):
         item = self.promptList.currentItem()
@@ -1837,53 +7408,101 @@ class Main(QMainWindow):
         base_text = (obj.get("text") if isinstance(obj, dict) else item.text()) or ""
 
         pid = self._get_prompt_pid(obj, base_text)
-        if not hasattr(self, "_manual_placeholder_cache"):
-            self._manual_placeholder_cache = {}
-        cached_vals = list(self._manual_placeholder_cache.get(pid, []))
-
-        def replace_once(s, val):
-            return re.sub(r'""', f'"{val}"', s, count=1) if val else s
-
-        p1 = self.character1Box.currentText() if hasattr(self, "character1Box") and self.character1Box.currentIndex() > 0 else ""
-        p2 = self.character2Box.currentText() if hasattr(self, "character2Box") and self.character2Box.currentIndex() > 0 else ""
-        p3 = self.character3Box.currentText() if hasattr(self, "character3Box") and self.character3Box.currentIndex() > 0 else ""
-        p4 = self.character4Box.currentText() if hasattr(self, "character4Box") and self.character4Box.currentIndex() > 0 else ""
-        if hasattr(self, "keepNamesCheck") and not self.keepNamesCheck.isChecked():
-            p1 = ""; p2 = ""; p3 = ""; p4 = ""
-        txt = replace_once(base_text, p1)
-        txt = replace_once(txt, p2)
-        txt = replace_once(txt, p3)
-        txt = replace_once(txt, p4)
-
-        for v in cached_vals:
-            if v:
-                txt = re.sub(r'""', f'"{v}"', txt, count=1)
+        chars = self._selected_character_names()
+        values, named = self.placeholders.get(pid)
+        fills = fill_placeholders(base_text, chars, named, values)
+        QApplication.clipboard().setText(join_placeholders(base_text, fills))
+        empty = fills.count(None)
+        if empty:
+            # Nothing blocks: the copy goes through and the first empty field of the fill panel takes focus
+            self.statusBar().showMessage(f"Prompt copied; {empty} placeholder(s) still empty - fill them under the preview.", 4000)
+            st = self._fill
+            if st is not None and st["pid"] == pid:
+                for edit, idxs, _name, _pos in st["fields"]:
+                    if edit.isEnabled() and fills[idxs[0]] is None:
+                        edit.setFocus()
+                        break
+        else:
+            self.statusBar().showMessage("Prompt copied to clipboard.", 3000)
+        try:
+            self._record_prompt_usage(obj, chars)
+        except Exception:
+            pass
+        try:
+            self.update_prompt_preview()
+        except Exception:
+            pass
 
-        remaining = len(re.findall(r'""', txt))
-        if remaining > 0:
-            resp = QMessageBox.question(
-                self,
-                'Fill Empty Fields?',
-                f'There are {remaining} empty "" fields.\nDo you want to fill them now?',
-                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-                QMessageBox.StandardButton.Yes
-            )
-            if resp == QMessageBox.StandardButton.Yes:
-                applied = []
-                for i in range(remaining):
-                    val, ok = QInputDialog.getText(self, "Fill Placeholder", f'Value for placeholder #{i+1}:')
-                    if ok and val:
-                        txt = re.sub(r'""', f'"{val}"', txt, count=1)
-                        applied.append(val)
-                if applied:
-                    self._manual_placeholder_cache[pid] = cached_vals + applied
-
-        QApplication.clipboard().setText(txt)
-        self.statusBar().showMessage("Prompt copied to clipboard.", 3000)
+    def _sync_prompt_picker(self):
+        groups = {}
+        for o in self.prompt_repo:
+            groups.setdefault(o.get("category") or "Base", []).append(o.get("id"))
+        self._prompt_picker.set_groups(groups)
+
+    def _record_event(self, kind, prompt_id=None, site=None, detail=None):
+        a = getattr(self, "analytics", None)
+        if a is not None:
+            try:
+                a.record(kind, prompt_id, site, detail)
+            except Exception:
+                pass
+
+    def _record_prompt_usage(self, obj, names):
+        br = self.current_browser()
+        site = self._base_of(br.url().toString()) if (br and br.url().isValid()) else None
+        self._record_event("prompt_copied", obj.get("id") if isinstance(obj, dict) else None, site or None)
+        if isinstance(obj, dict) and obj.get("id"):
+            self.usage_stats.touch("prompts", obj["id"])
+            self._prompt_picker.invalidate(obj["id"])
+            mode = getattr(self, "prompt_sort_mode", "original")
+            if mode in ("recent", "frequent"):
+                self._bump_item_rank(self.promptList, "prompts", mode, self.promptList.currentItem(), self._prompt_item_key)
+        for n in names:
+            if n:
+                self.usage_stats.bump("characters", n)
+                self._character_picker.invalidate(n)
+                self._record_event("character_used", detail=n)
+
+    def randomize_prompt(self):
+        # Pick a prompt from the current category and fill the character boxes
+        cat = self.categoryBox.currentText() if hasattr(self, "categoryBox") else "Show All"
+        pid = self._prompt_picker.pick(None if cat in ("", "Show All") else cat)
+        if pid is None:
+            self.statusBar().showMessage("No prompts to pick from.", 3000)
+            return
+        target = self._prompt_items.get(pid)
+        if target is None:
+            return
+
+        text = (target.data(Qt.ItemDataRole.UserRole) or {}).get("text") or ""
+        slots = min(4, placeholder_count(text))
+        group = getattr(self, "_character_group", None)
+        picked = []
+        for _ in range(slots):
+            name = self._character_picker.pick(group, exclude=picked)
+            if name is None or name in picked:
+                break
+            picked.append(name)
+
+        boxes = (self.character1Box, self.character2Box, self.character3Box, self.character4Box)
+        for i, box in enumerate(boxes):
+            box.blockSignals(True)
+            if i < len(picked):
+                idx = box.findText(picked[i])
+                if idx >= 0:
+                    box.setCurrentIndex(idx)
+                else:
+                    box.setCurrentText(picked[i])
+            else:
+                box.setCurrentIndex(0)
+            box.blockSignals(False)
+        self.promptList.setCurrentItem(target)
+        self.promptList.scrollToItem(target)
         try:
             self.update_prompt_preview()
         except Exception:
             pass
+        self.statusBar().showMessage(f"Random prompt: {target.text()}", 3000)
 
     def update_prompt_preview(self, *_):
         # Get selected item safely
@@ -1894,6 +7513,7 @@ class Main(QMainWindow):
 
         if not item:
             try:
+                self._sync_fill_panel(None, "")
                 self.previewEdit.clear()
             except Exception:
                 pass
@@ -1912,47 +7532,123 @@ class Main(QMainWindow):
             except Exception:
                 base_text = ''
 
-        text = base_text  # ensure defined
-
-        # Helper: replace the first "" with val
-        def replace_once(s, val):
-            return re.sub(r'""', f'"{val}"', s, count=1) if (s and val) else s
-
-        # Apply Character 1–4 to the first slots
-        try:
-            p1 = self.character1Box.currentText() if hasattr(self, "character1Box") and self.character1Box.currentIndex() > 0 else ''
-        except Exception:
-            p1 = ''
-        try:
-            p2 = self.character2Box.currentText() if hasattr(self, "character2Box") and self.character2Box.currentIndex() > 0 else ''
-        except Exception:
-            p2 = ''
-        try:
-            p3 = self.character3Box.currentText() if hasattr(self, "character3Box") and self.character3Box.currentIndex() > 0 else ''
-        except Exception:
-            p3 = ''
-        try:
-            p4 = self.character4Box.currentText() if hasattr(self, "character4Box") and self.character4Box.currentIndex() > 0 else ''
-        except Exception:
-            p4 = ''
-        for _val in (p1, p2, p3, p4):
-            text = replace_once(text, _val)
-
-        # Apply cached manual entries (left-to-right)
+        # Character 1-4 take the first "" slots, the fill panel the rest; named slots by name
         try:
             pid = self._get_prompt_pid(obj, base_text)
-            cached_vals = getattr(self, '_manual_placeholder_cache', {}).get(pid, [])
         except Exception:
-            cached_vals = []
-        for v in cached_vals:
-            if v:
-                text = re.sub(r'""', f'"{v}"', text, count=1)
-
-        # Push to preview
+            pid = None
         try:
-            self.previewEdit.setPlainText(text or '')
+            self._sync_fill_panel(pid, base_text)
+            self._set_preview(base_text)
         except Exception:
-            pass
+            try:
+                self.previewEdit.setPlainText(base_text)
+            except Exception:
+                pass
+
+    def _sync_fill_panel(self, pid, text):
+        # One field per bare slot and per distinct named slot; rebuilt only when the prompt or its text changes
+        st = self._fill
+        if st is not None and st["pid"] == pid and st["text"] == text:
+            return
+        form = self.placeholderForm
+        while form.rowCount():
+            form.removeRow(0)
+        slots = compile_placeholders(text)[1]
+        values, named = self.placeholders.get(pid) if pid else ([], {})
+        st = self._fill = {"pid": pid, "text": text, "fields": [], "fills": [], "spans": None}
+        by_name = {}; pos = 0
+        for i, name in enumerate(slots):
+            if name:
+                key = placeholder_key(name)
+                if key in by_name:
+                    st["fields"][by_name[key]][1].append(i)
+                    continue
+                by_name[key] = len(st["fields"])
+                label, value = f"{{{name}}}", named.get(key, "")
+            else:
+                label, value = f"#{pos + 1}", values[pos] if pos < len(values) else ""
+            edit = QLineEdit(value)
+            comp = QCompleter(self.placeholders.recent(name), edit)
+            comp.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+            edit.setCompleter(comp)
+            k = len(st["fields"])
+            edit.textChanged.connect(lambda v, k=k: self._on_fill_edited(k, v))
+            edit.editingFinished.connect(lambda k=k: self._remember_fill(k))
+            edit.returnPressed.connect(self.copy_selected_prompt)
+            form.addRow(label, edit)
+            st["fields"].append((edit, [i], name, None if name else pos))
+            if not name:
+                pos += 1
+        self.placeholderScroll.setVisible(bool(st["fields"]))
+
+    def _set_preview(self, text):
+        # Full render; remembers where each slot landed so typing only re-renders that slot
+        st = self._fill
+        chars = self._selected_character_names(keep_only=False)
+        lits, slots = compile_placeholders(text)
+        values, named = self.placeholders.get(st["pid"]) if st["pid"] else ([], {})
+        fills = fill_placeholders(text, chars, named, values)
+        taken = sum(1 for c in chars if c)
+        for edit, idxs, name, pos in st["fields"]:
+            own = bool(name) or pos >= taken
+            edit.setEnabled(own)
+            edit.setPlaceholderText("" if own else fills[idxs[0]] or "")
+        parts = [lits[0]]; spans = []; at = _utf16_len(lits[0])
+        for name, v, lit in zip(slots, fills, lits[1:]):
+            r = render_placeholder(name, v)
+            spans.append((at, at + _utf16_len(r)))
+            at += _utf16_len(r) + _utf16_len(lit)
+            parts.append(r); parts.append(lit)
+        self.previewEdit.setPlainText("".join(parts))
+        # QTextDocument may normalise line breaks; then spans are unusable and edits re-render fully
+        st["spans"] = spans if self.previewEdit.document().characterCount() - 1 == at else None
+        st["fills"] = fills
+
+    def _on_fill_edited(self, k, value):
+        st = self._fill
+        if st is None or k >= len(st["fields"]):
+            return
+        edit, idxs, name, pos = st["fields"][k]
+        value = value.strip()
+        if st["pid"]:
+            self.placeholders.put_slot(st["pid"], name, pos, value)
+            self._placeholder_save_timer.start()
+        if not edit.isEnabled():
+            return
+        if st["spans"] is None:
+            self._set_preview(st["text"])
+            return
+        slots = compile_placeholders(st["text"])[1]
+        doc = self.previewEdit.document()
+        for i in idxs:
+            v = value or None
+            if st["fills"][i] == v:
+                continue
+            st["fills"][i] = v
+            a, b = st["spans"][i]
+            r = render_placeholder(slots[i], v)
+            cur = QTextCursor(doc)
+            cur.setPosition(a)
+            cur.setPosition(b, QTextCursor.MoveMode.KeepAnchor)
+            cur.insertText(r)
+            d = _utf16_len(r) - (b - a)
+            st["spans"][i] = (a, b + d)
+            if d:
+                st["spans"][i + 1:] = [(x + d, y + d) for x, y in st["spans"][i + 1:]]
+
+    def _remember_fill(self, k):
+        st = self._fill
+        if st is None or k >= len(st["fields"]):
+            return
+        edit, _idxs, name, _pos = st["fields"][k]
+        if edit.isEnabled() and edit.text().strip():
+            self.placeholders.remember(name, edit.text())
+            self._placeholder_save_timer.start()
+            try:
+                edit.completer().model().setStringList(self.placeholders.recent(name))
+            except Exception:
+                pass
     
     def _edit_prompt_on_right_click(self, pos):
         item = self.promptList.itemAt(pos)
@@ -2000,61 +7696,65 @@ class Main(QMainWindow):
             if ok_tags and t_tags is not None:
                 new_tags = [t.strip() for t in t_tags.split(",") if t.strip()]
 
-        # Clear any cached placeholders for this prompt
+        # Remembered "" values follow the slot positions of the old text (named ones survive any edit)
         try:
-            pid_old = self._get_prompt_pid(obj, base_text)
-            if hasattr(self, "_manual_placeholder_cache"):
-                self._manual_placeholder_cache.pop(pid_old, None)
+            old_fills = self.placeholders.get(self._get_prompt_pid(obj, base_text))[0]
         except Exception:
-            pass
-
-        # write-through to backing list (string or dict)
-        updated = False
-        for i, p in enumerate(self.user_prompts):
-            if isinstance(p, dict):
-                match = (old_id and p.get("id") == old_id) or (p.get("text") == base_text)
-                if match:
-                    p["text"] = new_text
-                    p["title"] = new_title
-                    if new_category is not None:
-                        p["category"] = new_category
-                    if new_tags is not None:
-                        p["tags"] = new_tags
-                    updated = True
-                    break
-            else:
-                if p == base_text:
-                    # Keep string-type prompts as strings
-                    self.user_prompts[i] = new_text
-                    updated = True
-                    break
-
-        if not updated:
+            old_fills = []
+
+        # write-through to the repository (O(1) by id)
+        fields = {"text": new_text, "title": new_title}
+        if new_category is not None:
+            fields["category"] = new_category
+        if new_tags is not None:
+            fields["tags"] = new_tags
+        before = dict(self.prompt_repo.get(old_id) or {}) if old_id else {}
+        cur = self.prompt_repo.update(old_id, **fields) if old_id else None
+        if cur is None:
             QMessageBox.information(self, "Edit Prompt", "Could not locate the prompt to update.")
             return
 
-        save_user_prompts(self.user_prompts)
-        self.refresh_prompts_list()
-        self._reselect_prompt(old_id, new_text)
+        if cur != before:
+            self._log_prompt_ops([{"op": "edit", "id": old_id, "before": before, "after": dict(cur)}])
+        if old_fills and placeholder_count(before.get("text")) != placeholder_count(cur.get("text")):
+            # Slots moved: the values stay with the old version (restored on revert)
+            self.placeholders.put(old_id, values=[])
+            self._placeholder_save_timer.start()
+            self._fill = None
+            if getattr(self, "prompt_history", None) is not None:
+                try:
+                    self.prompt_history.set_fills(old_id, before.get("text"), old_fills)
+                except Exception:
+                    pass
+        mode = getattr(self, "prompt_sort_mode", "original")
+        moved = (cur.get("category") != before.get("category")) or (
+            mode in ("name", "category") and cur.get("title") != before.get("title"))
+        if moved:
+            # Category list, filter or sort position changed
+            self.refresh_prompts_list()
+        else:
+            self._update_prompt_item(cur)
+        self._reselect_prompt(old_id)
         try:
             self.update_prompt_preview()
         except Exception:
             pass
         self.statusBar().showMessage("Prompt updated.", 3000)
 
-    def _reselect_prompt(self, pid, text):
-        # Reselect edited prompt in the list
-        for i in range(self.promptList.count()):
-            it = self.promptList.item(i)
-            o = it.data(Qt.ItemDataRole.UserRole)
-            if isinstance(o, dict):
-                if pid and o.get('id') == pid:
-                    self.promptList.setCurrentItem(it)
-                    return
-                if text and o.get('text') == text:
-                    self.promptList.setCurrentItem(it)
-                    return
-                    
+    def _update_prompt_item(self, obj):
+        it = self._prompt_items.get(obj.get("id"))
+        if it is None:
+            return
+        it.setText(self._prompt_display_text(obj))
+        it.setData(Qt.ItemDataRole.UserRole, obj)
+        it.setToolTip(obj.get("text", ""))
+
+    def _reselect_prompt(self, pid, text=None):
+        # Reselect a prompt in the list by id
+        it = self._prompt_items.get(pid)
+        if it is not None:
+            self.promptList.setCurrentItem(it)
+
     def add_prompt_dialog(self):
         text, ok = QInputDialog.getMultiLineText(self, "Add Prompt", "Prompt text:")
         if not ok or not text.strip():
@@ -2071,12 +7771,125 @@ class Main(QMainWindow):
         if not ok: return
         tags = [t.strip() for t in tag_str.split(",") if t.strip()]
 
-        new_obj = {"id": f"u{len(self.user_prompts):04d}", "title": title or default_title, "category": cat or "User", "tags": tags, "text": txt}
-        self.user_prompts.append(new_obj)
-        save_user_prompts(self.user_prompts)
+        new_obj = self.prompt_repo.add({"id": self.prompt_repo.next_id(), "title": title or default_title, "category": cat or "User", "tags": tags, "text": txt})
+        self._log_prompt_ops([{"op": "add", "id": new_obj["id"], "after": dict(new_obj)}])
         self.refresh_prompts_list()
+        self._reselect_prompt(new_obj["id"])
         self.statusBar().showMessage("Prompt added.", 3000)
-        
+
+    def _matrix_pool_names(self, choice, box):
+        # Resolve a pool choice from the matrix dialog into a list of character names
+        if choice == "— None —":
+            return []
+        if choice == "Current Selection":
+            return [box.currentText()] if box.currentIndex() > 0 and box.currentText() else []
+        if choice == "Filtered Characters":
+            return [box.itemText(i) for i in range(1, box.count())]
+        return self.characters.names(None if choice == "All Characters" else choice)
+
+    def generate_prompt_matrix_dialog(self):
+        objs = self.prompt_repo.to_list()
+        if not objs:
+            QMessageBox.information(self, "Generate Matrix", "No prompts loaded.")
+            return
+
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Generate Prompt Matrix")
+        form = QFormLayout(dlg)
+
+        src = QComboBox()
+        src.addItems(["Selected Prompt", "Visible Prompts", "All Prompts"])
+        src.setCurrentIndex(1)
+        form.addRow("Prompts:", src)
+
+        boxes = (self.character1Box, self.character2Box, self.character3Box, self.character4Box)
+        cats = self.characters.categories()
+        pool_boxes = []
+        for i, box in enumerate(boxes, start=1):
+            cb = QComboBox()
+            cb.addItems(["— None —", "Current Selection", "Filtered Characters", "All Characters"] + cats)
+            cb.setCurrentIndex(1)
+            form.addRow(f"Character {i}:", cb)
+            pool_boxes.append(cb)
+
+        mode = QComboBox(); mode.addItems(["All Combinations", "Random Sample"])
+        form.addRow("Mode:", mode)
+        cap = QSpinBox(); cap.setRange(1, 10_000_000); cap.setValue(1000)
+        form.addRow("Max Rows:", cap)
+        distinct = QCheckBox("Skip repeated names within a prompt"); distinct.setChecked(True)
+        form.addRow("", distinct)
+        fmt = QComboBox(); fmt.addItems(["JSONL", "TXT"])
+        form.addRow("Format:", fmt)
+        size_lbl = QLabel("")
+        form.addRow("Space:", size_lbl)
+
+        def _selection():
+            if src.currentText() == "Selected Prompt":
+                it = self.promptList.currentItem()
+                o = it.data(Qt.ItemDataRole.UserRole) if it else None
+                prompts = [o] if isinstance(o, dict) else []
+            elif src.currentText() == "Visible Prompts":
+                prompts = []
+                for i in range(self.promptList.count()):
+                    o = self.promptList.item(i).data(Qt.ItemDataRole.UserRole)
+                    if isinstance(o, dict):
+                        prompts.append(o)
+            else:
+                prompts = objs
+            pools = [self._matrix_pool_names(cb.currentText(), box) for cb, box in zip(pool_boxes, boxes)]
+            return prompts, pools
+
+        def _update_size(*_):
+            prompts, pools = _selection()
+            size_lbl.setText(f"{prompt_matrix_size(prompts, pools):,} combinations")
+
+        for w in [src, mode] + pool_boxes:
+            w.currentIndexChanged.connect(_update_size)
+        _update_size()
+
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        bb.accepted.connect(dlg.accept); bb.rejected.connect(dlg.reject)
+        form.addRow(bb)
+        if dlg.exec() != QDialog.DialogCode.Accepted:
+            return
+
+        prompts, pools = _selection()
+        total = prompt_matrix_size(prompts, pools)
+        if not total:
+            QMessageBox.information(self, "Generate Matrix", "Nothing to generate for this selection.")
+            return
+        ext = fmt.currentText().lower()
+        path, _ = QFileDialog.getSaveFileName(self, "Save Prompt Matrix", f"sora2_prompt_matrix.{ext}",
+                                              "JSON Lines (*.jsonl)" if ext == "jsonl" else "Text Files (*.txt)")
+        if not path:
+            return
+
+        limit = min(int(cap.value()), total)
+        prog = QProgressDialog("Generating prompts…", "Cancel", 0, limit, self)
+        prog.setWindowTitle("Generate Matrix")
+        prog.setWindowModality(Qt.WindowModality.WindowModal)
+        prog.setMinimumDuration(300)
+
+        worker = MatrixExportWorker(path, ext, prompts, pools, limit,
+                                    mode.currentText() == "Random Sample",
+                                    distinct_names=distinct.isChecked(), parent=self)
+        self._matrix_worker = worker
+        worker.progress.connect(prog.setValue)
+        prog.canceled.connect(worker.requestInterruption)
+
+        def _done(n, p):
+            prog.reset()
+            self.statusBar().showMessage(f"Wrote {n:,} prompts to {p}", 5000)
+
+        def _failed(msg):
+            prog.reset()
+            QMessageBox.critical(self, "Generate Matrix", msg)
+
+        worker.done.connect(_done)
+        worker.failed.connect(_failed)
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
     def save_splitter_sizes(self):
         # Prompts splitter
         try:
@@ -2147,6 +7960,7 @@ class Main(QMainWindow):
 
         with open(CONFIG_PATH, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        note_own_write(CONFIG_PATH)  # not an external change for the hot-reload watcher
 
     def export_view_toolbar_dialog(self):
         try:
@@ -2208,146 +8022,568 @@ class Main(QMainWindow):
             # Re-apply hotkeys
             hotkeys = ui_cfg.get("hotkeys") or {}
             if isinstance(hotkeys, dict):
-                try:
-                    self.act_toggle_left_fs.setShortcut(hotkeys.get("fullscreen_left", "F1"))
-                    self.act_toggle_right_fs.setShortcut(hotkeys.get("fullscreen_right", "F2"))
-                    self.act_zoom_left_in.setShortcut(hotkeys.get("zoom_left_in", "F3"))
-                    self.act_zoom_left_out.setShortcut(hotkeys.get("zoom_left_out", "F4"))
-                    self.act_zoom_left_reset.setShortcut(hotkeys.get("zoom_left_reset", "F5"))
-                    self.act_zoom_right_in.setShortcut(hotkeys.get("zoom_right_in", "F6"))
-                    self.act_zoom_right_out.setShortcut(hotkeys.get("zoom_right_out", "F7"))
-                    self.act_zoom_right_reset.setShortcut(hotkeys.get("zoom_right_reset", "F8"))
-                except Exception:
-                    pass
+                self._apply_hotkeys(hotkeys)
 
             self.statusBar().showMessage(f"Imported view toolbar settings from {path}", 4000)
         except Exception as e:
             QMessageBox.critical(self, "Import Error", str(e))
 
+    # Three-way merge of shipped defaults (three_way_merge); snapshot in sora2_defaults_snapshot.json
+    MERGE_LIBS = ("prompts", "sites", "characters")
+
+    def _merge_user_items(self, lib):
+        if lib == "prompts":
+            return self.prompt_repo.to_list()
+        if lib == "sites":
+            return list(self.user_sites)
+        return self.characters.to_list()
+
+    def _merge_store_items(self, lib, items):
+        if lib == "prompts":
+            before = self.prompt_repo.to_list()
+            self.prompt_repo.replace_all(items)
+            self._log_prompt_reset(before)
+            self.refresh_prompts_list()
+        elif lib == "sites":
+            self.user_sites = items
+            for i, s in enumerate(self.user_sites, start=1):
+                s["id"] = i
+            save_user_sites(self.user_sites)
+            self.refresh_sites_list()
+            self._apply_ua_rules()
+        else:
+            save_user_characters(self.characters.replace(items).sort())
+            self._reload_character_boxes()
+
+    def merge_updated_defaults(self, interactive=False):
+        version = str(self.cfg.get("version", ""))
+        snap = load_defaults_snapshot() or {}
+        if not interactive and snap.get("version") == version and all(lib in snap for lib in self.MERGE_LIBS):
+            return  # nothing shipped since the last merge
+        results, totals = {}, [0, 0, 0]
+        for lib in self.MERGE_LIBS:
+            defaults = default_library_items(self.cfg, lib)
+            if not isinstance(snap.get(lib), dict):
+                # First run: the current defaults become the baseline, nothing is merged
+                snap[lib] = merge_hashes(lib, defaults)
+                continue
+            res = three_way_merge(lib, snap[lib], defaults, self._merge_user_items(lib))
+            results[lib] = res
+            if res["added"] or res["updated"] or res["removed"]:
+                self._merge_store_items(lib, res["items"])
+            snap[lib] = res["snapshot"]
+            totals[0] += res["added"]; totals[1] += res["updated"]; totals[2] += res["removed"]
+        snap["version"] = version
+        save_defaults_snapshot(snap)
+        conflicts = [(lib, c) for lib, res in results.items() for c in res["conflicts"]]
+        if any(totals):
+            self.statusBar().showMessage(f"Merged updated defaults: {totals[0]} added, {totals[1]} updated, "
+                                         f"{totals[2]} removed" + (f", {len(conflicts)} conflict(s)" if conflicts else ""), 6000)
+        if conflicts:
+            self._resolve_merge_conflicts_dialog(results, snap, conflicts)
+        elif interactive:
+            QMessageBox.information(self, "Merge Updated Defaults",
+                                    f"{totals[0]} added, {totals[1]} updated, {totals[2]} removed. No conflicts.")
+
+    def _resolve_merge_conflicts_dialog(self, results, snap, conflicts):
+        kinds = {"both-added": "added by you and by the update", "both-changed": "changed by you and by the update",
+                 "deleted-locally": "deleted by you, changed by the update",
+                 "removed-upstream": "changed by you, removed by the update"}
+
+        def label(lib, obj):
+            if obj is None:
+                return "—"
+            if lib == "prompts":
+                return f"{obj.get('title', '')}: {(obj.get('text') or '')[:80]}"
+            if lib == "sites":
+                return f"{obj.get('name', '')} ({obj.get('url', '')})"
+            return str(obj)
+
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Merge Conflicts")
+        dlg.resize(900, 480)
+        v = QVBoxLayout(dlg)
+        v.addWidget(QLabel(f"{len(conflicts)} item(s) were changed both by you and by the updated defaults. "
+                           "Choose which version to keep; skipped items are asked about again next time."))
+        tbl = QTableWidget(len(conflicts), 5)
+        tbl.setHorizontalHeaderLabels(["Library", "Conflict", "Yours", "Default", "Keep"])
+        tbl.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        for c in (2, 3):
+            tbl.horizontalHeader().setSectionResizeMode(c, QHeaderView.ResizeMode.Stretch)
+        boxes = []
+        for r, (lib, c) in enumerate(conflicts):
+            tbl.setItem(r, 0, QTableWidgetItem(lib))
+            tbl.setItem(r, 1, QTableWidgetItem(kinds.get(c["kind"], c["kind"])))
+            for col, obj in ((2, c["ours"]), (3, c["theirs"])):
+                it = QTableWidgetItem(label(lib, obj))
+                it.setToolTip(json.dumps(obj, indent=2, ensure_ascii=False) if obj is not None else "")
+                tbl.setItem(r, col, it)
+            box = QComboBox(); box.addItems(["Decide later", "Mine", "Default"])
+            tbl.setCellWidget(r, 4, box)
+            boxes.append(box)
+        v.addWidget(tbl)
+        row = QHBoxLayout()
+        for text, idx in (("All: Mine", 1), ("All: Default", 2)):
+            b = QPushButton(text)
+            b.clicked.connect(lambda _, i=idx: [x.setCurrentIndex(i) for x in boxes])
+            row.addWidget(b)
+        row.addStretch(1)
+        v.addLayout(row)
+        bb = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        bb.accepted.connect(dlg.accept); bb.rejected.connect(dlg.reject)
+        v.addWidget(bb)
+        if dlg.exec() != QDialog.DialogCode.Accepted:
+            return
+        choices = {lib: {} for lib in results}
+        for (lib, c), box in zip(conflicts, boxes):
+            if box.currentIndex():
+                choices[lib][c["key"]] = "ours" if box.currentIndex() == 1 else "theirs"
+        for lib, picked in choices.items():
+            if not picked:
+                continue
+            res = results[lib]
+            take = any(v == "theirs" for v in picked.values())
+            resolve_merge_conflicts(lib, res, picked)
+            if take:
+                self._merge_store_items(lib, res["items"])
+            snap[lib] = res["snapshot"]
+        save_defaults_snapshot(snap)
+        self.statusBar().showMessage(f"Resolved {sum(len(p) for p in choices.values())} conflict(s).", 4000)
+
     def restore_default_prompts(self):
         if QMessageBox.question(self, "Restore Default Prompts", "Replace your user prompts with the base defaults?") != QMessageBox.StandardButton.Yes:
             return
         defaults = self.cfg.get("prompts", [])
-        self.user_prompts = list(defaults)
-        if save_user_prompts(self.user_prompts):
+        before = self.prompt_repo.to_list()
+        self.prompt_repo.replace_all(list(defaults))
+        if self._log_prompt_reset(before):
             self.refresh_prompts_list()
             self.statusBar().showMessage("Restored default prompts.", 4000)
 
     def clear_user_prompts(self):
         if QMessageBox.question(self, "Clear User Prompts", "Remove ALL user prompts? This does not touch the base defaults. Continue?") != QMessageBox.StandardButton.Yes:
             return
-        self.user_prompts = []
-        if save_user_prompts(self.user_prompts):
+        before = self.prompt_repo.to_list()
+        self.prompt_repo.replace_all([])
+        if self._log_prompt_reset(before):
             self.refresh_prompts_list()
             self.statusBar().showMessage("Cleared user prompts.", 4000)
 
+    # Streaming library import/export (write_records / iter_records) on a LibraryTransferWorker
+    LIBRARY_FILE_FILTERS = ("JSON (*.json *.json.gz)", "JSON Lines (*.jsonl *.jsonl.gz *.ndjson)",
+                            "CSV (*.csv *.csv.gz)", "Text, one per line (*.txt *.txt.gz)")
+
+    def _library_transfer(self, title, label, job, on_done):
+        if getattr(self, "_transfer_worker", None) is not None:
+            QMessageBox.information(self, title, "Another import or export is still running.")
+            return
+        prog = QProgressDialog(label, "Cancel", 0, 1000, self)
+        prog.setWindowTitle(title)
+        prog.setWindowModality(Qt.WindowModality.WindowModal)
+        prog.setMinimumDuration(300)
+        worker = LibraryTransferWorker(job, parent=self)
+        self._transfer_worker = worker
+        worker.progress.connect(prog.setValue)
+        prog.canceled.connect(worker.requestInterruption)
+
+        def _done(result):
+            prog.reset()
+            if result is None:
+                self.statusBar().showMessage(f"{title} cancelled.", 4000)
+            else:
+                on_done(result)
+
+        def _failed(msg):
+            prog.reset()
+            QMessageBox.critical(self, title, msg)
+
+        worker.done.connect(_done)
+        worker.failed.connect(_failed)
+        worker.finished.connect(lambda: setattr(self, "_transfer_worker", None))
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def _library_save_path(self, title, default_name):
+        path, flt = QFileDialog.getSaveFileName(self, title, default_name,
+                                                ";;".join(self.LIBRARY_FILE_FILTERS + ("JSON, gzip (*.json.gz)",)))
+        if path and record_format(path, None) is None:
+            path += "." + ("jsonl" if flt.startswith("JSON Lines") else "csv" if flt.startswith("CSV")
+                           else "txt" if flt.startswith("Text") else "json")
+        return path
+
+    def _library_open_path(self, title):
+        path, _ = QFileDialog.getOpenFileName(self, title, "",
+                                              ";;".join(("Library Files (*.json *.jsonl *.ndjson *.csv *.txt *.gz)",)
+                                                        + self.LIBRARY_FILE_FILTERS + ("All Files (*)",)))
+        if not path:
+            return None, None
+        modes = ["Merge (update same id, add new)", "Append (add new only)", "Replace"]
+        mode, ok = QInputDialog.getItem(self, title, "Import mode (duplicates are skipped):", modes, 0, False)
+        return (path, mode.split()[0].lower()) if ok else (None, None)
+
+    def _export_library(self, what, title, items):
+        path = self._library_save_path(title, f"sora2_user_{what}_export.json")
+        if not path:
+            return
+        total = max(1, len(items))
+
+        def job(progress, should_stop):
+            return write_records(path, what, items, progress=lambda n: progress(n * 1000 // total),
+                                 should_stop=should_stop)
+
+        self._library_transfer(title, f"Exporting {len(items):,} {what}…", job,
+                               lambda n: self.statusBar().showMessage(f"Exported {n:,} {what} to {path}", 4000))
+
     def export_prompts_dialog(self):
-        try:
-            path, _ = QFileDialog.getSaveFileName(self, "Export Prompts", "sora2_user_prompts_export.json", "JSON Files (*.json)")
-            if not path:
-                return
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump({"prompts": self.user_prompts}, f, indent=2)
-            self.statusBar().showMessage(f"Exported prompts to {path}", 4000)
-        except Exception as e:
-            QMessageBox.critical(self, "Export Error", str(e))
+        self._export_library("prompts", "Export Prompts", self.prompt_repo.to_list())
 
     def import_prompts_dialog(self):
-        try:
-            path, _ = QFileDialog.getOpenFileName(self, "Import Prompts", "", "JSON Files (*.json)")
-            if not path:
-                return
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if "prompts" not in data:
-                QMessageBox.warning(self, "Import Prompts", "Invalid format. Expecting an object with a 'prompts' array.")
-                return
-            self.user_prompts = data.get("prompts", [])
-            save_user_prompts(self.user_prompts)
+        path, mode = self._library_open_path("Import Prompts")
+        if not path:
+            return
+        current = self.prompt_repo.to_list()
+
+        def job(progress, should_stop):
+            records = iter_records(path, "prompts", progress=lambda d, t: progress(d * 1000 // max(1, t)))
+            res = import_prompt_records(current, records, mode, should_stop)
+            if res is None:
+                return None
+            repo = PromptRepository(res[0])
+            if not save_user_prompts(repo.to_list()):
+                raise OSError(f"Could not write {USER_PROMPTS_PATH}")
+            return repo, res[1]
+
+        def done(result):
+            before = self.prompt_repo.to_list()
+            self.prompt_repo, st = result
+            self.prompt_journal.load()  # the worker's snapshot write moved the base
+            self._log_prompt_ops([PromptJournal.reset_op(before, self.prompt_repo.to_list())])
+            self.prompt_journal.rebase()
+            if "before" not in self._prompt_undo[-1][0]:
+                self._prompt_undo.clear()
             self.refresh_prompts_list()
-            self.statusBar().showMessage(f"Imported prompts from {path}", 4000)
-        except Exception as e:
-            QMessageBox.critical(self, "Import Error", str(e))
+            self.statusBar().showMessage(f"Imported prompts from {path}: {st['added']:,} added, "
+                                         f"{st['updated']:,} updated, {st['skipped']:,} duplicates skipped", 6000)
+
+        self._library_transfer("Import Prompts", "Importing prompts…", job, done)
 
     def restore_default_characters(self):
         if QMessageBox.question(self, "Restore Default Characters", "Replace your character list with the defaults from base?", QMessageBox.StandardButton.Yes|QMessageBox.StandardButton.No) != QMessageBox.StandardButton.Yes:
             return
-        defaults = self.cfg.get("characters", [])
-        characters = [sanitize_character_name(x) for x in defaults if sanitize_character_name(x)]
-        characters = list(dict.fromkeys(characters))
-        self.user_characters = characters
-        save_user_characters(self.user_characters)
+        self.characters.replace(self.cfg.get("characters", []), sanitize_character_name)
+        save_user_characters(self.characters)
         self._reload_character_boxes()
         self.statusBar().showMessage("Restored default characters.", 4000)
 
     def clear_user_characters(self):
         if QMessageBox.question(self, "Clear User Characters", "Remove ALL user characters? This does not touch the base defaults. Continue?", QMessageBox.StandardButton.Yes|QMessageBox.StandardButton.No) != QMessageBox.StandardButton.Yes:
             return
-        self.user_characters = []
-        if save_user_characters(self.user_characters):
+        self.characters.replace(())
+        if save_user_characters(self.characters):
             self._reload_character_boxes()
             self.statusBar().showMessage("Cleared user characters.", 4000)
 
     def export_characters_dialog(self):
-        try:
-            path, _ = QFileDialog.getSaveFileName(self, "Export Characters", "sora2_user_characters_export.json", "JSON Files (*.json)")
-            if not path:
-                return
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump({"characters": self.user_characters}, f, indent=2, ensure_ascii=False)
-            self.statusBar().showMessage(f"Exported characters to {path}", 4000)
-        except Exception as e:
-            QMessageBox.critical(self, "Export Error", str(e))
+        self._export_library("characters", "Export Characters", self.characters.to_list())
 
     def import_characters_dialog(self):
-        try:
-            path, _ = QFileDialog.getOpenFileName(self, "Import Characters", "", "JSON Files (*.json)")
-            if not path:
-                return
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            characters = data.get("characters", data if isinstance(data, list) else [])
-            if not isinstance(characters, list):
-                QMessageBox.warning(self, "Import Characters", "Invalid format. Expecting an object with a 'characters' array or a flat array.")
-                return
-            characters = [sanitize_character_name(x) for x in characters]
-            characters = [x for x in characters if x]
-            characters = list(dict.fromkeys(characters))
-            self.user_characters = characters
-            save_user_characters(self.user_characters)
+        path, mode = self._library_open_path("Import Characters")
+        if not path:
+            return
+        chars = self.characters.copy()
+
+        def job(progress, should_stop):
+            records = iter_records(path, "characters", progress=lambda d, t: progress(d * 1000 // max(1, t)))
+            res = import_character_records(chars, records, mode, should_stop=should_stop)
+            if res is not None and not save_user_characters(res[0]):
+                raise OSError(f"Could not write {USER_CHARACTERS_PATH}")
+            return res
+
+        def done(result):
+            self.characters, st = result
             self._reload_character_boxes()
-            self.statusBar().showMessage(f"Imported {len(characters)} characters.", 4000)
-        except Exception as e:
-            QMessageBox.critical(self, "Import Error", str(e))
+            self.statusBar().showMessage(f"Imported characters from {path}: {st['added']:,} added, "
+                                         f"{st['updated']:,} updated, {st['skipped']:,} duplicates skipped", 6000)
+
+        self._library_transfer("Import Characters", "Importing characters…", job, done)
+
+    def _character_facet_states(self):
+        # {tag: Checked | PartiallyChecked} for the facets currently in use
+        lst = getattr(self, "characterFacetList", None)
+        out = {}
+        for i in range(lst.count() if lst is not None else 0):
+            it = lst.item(i)
+            if it.checkState() != Qt.CheckState.Unchecked:
+                out[it.data(Qt.ItemDataRole.UserRole)] = it.checkState()
+        return out
+
+    _FACET_LAST = Qt.ItemDataRole.UserRole + 1  # check state the facet item had before the click
+
+    def _on_character_facet_changed(self, it):
+        # Qt's user tristate steps Unchecked -> Partially -> Checked; facets go the other way
+        # round (click once to require, twice to exclude, a third time to clear)
+        prev = it.data(self._FACET_LAST)
+        prev = Qt.CheckState.Unchecked if prev is None else Qt.CheckState(prev)
+        state = it.checkState()
+        if state.value == (prev.value + 1) % 3:
+            state = Qt.CheckState((prev.value + 2) % 3)
+        lst = it.listWidget()
+        lst.blockSignals(True)
+        try:
+            it.setCheckState(state)
+            it.setData(self._FACET_LAST, state.value)
+        finally:
+            lst.blockSignals(False)
+        self._reload_character_boxes()
 
-    def _rebuild_character_objects(self):
-        """Rebuild internal character objects (name + category) from config + user list."""
-        defs = getattr(self, "character_defs", []) or []
-        # Map config names (casefolded) to category
-        lut = {}
-        for o in defs:
-            name = (o.get("name") or "").strip()
-            if not name:
-                continue
-            key = name.casefold()
-            if key not in lut:
-                lut[key] = {"name": name, "category": (o.get("category") or "Base")}
-        objs = []
-        seen = set()
-        for raw in getattr(self, "user_characters", []) or []:
-            name = (" ".join(str(raw).split())).strip()
-            if not name:
-                continue
-            key = name.casefold()
-            if key in seen:
+    def _refresh_character_facets(self, mask):
+        # Tag counts within the current filter; items are reused so check states survive
+        lst = getattr(self, "characterFacetList", None)
+        if lst is None:
+            return
+        counts = self.characters.facet_counts(mask)
+        lst.blockSignals(True)
+        try:
+            have = {lst.item(i).data(Qt.ItemDataRole.UserRole): lst.item(i) for i in range(lst.count())}
+            if list(have) != list(counts):
+                states = {t: it.checkState() for t, it in have.items()}
+                lst.clear(); have = {}
+                for tag in counts:
+                    it = QListWidgetItem()
+                    it.setData(Qt.ItemDataRole.UserRole, tag)
+                    it.setFlags(it.flags() | Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsUserTristate)
+                    it.setCheckState(states.get(tag, Qt.CheckState.Unchecked))
+                    it.setData(self._FACET_LAST, it.checkState().value)
+                    lst.addItem(it); have[tag] = it
+            for tag, n in counts.items():
+                it = have[tag]
+                it.setText(f"{tag} ({n})")
+                active = n > 0 or it.checkState() != Qt.CheckState.Unchecked
+                it.setForeground(lst.palette().text() if active else lst.palette().placeholderText())
+        finally:
+            lst.blockSignals(False)
+
+    def edit_character_tags_dialog(self):
+        # Extra tags for one character (the category is always its first tag)
+        cur = self.character1Box.currentText() if self.character1Box.currentIndex() > 0 else ""
+        names = self.characters.names()
+        if not names:
+            return
+        name, ok = QInputDialog.getItem(self, "Edit Character Tags", "Character:", names,
+                                        max(0, names.index(cur)) if cur in names else 0, True)
+        name = self.characters.canonical(name) if ok else None
+        if not name:
+            return
+        tags = self.characters.tags_of(name)[1:]
+        text, ok = QInputDialog.getText(self, "Edit Character Tags",
+                                        f"Tags for {name} (comma-separated; category: {self.characters.category_of(name)}):",
+                                        text=", ".join(tags))
+        if not ok:
+            return
+        self.characters.set_tags(name, [t for t in text.split(",") if t.strip()])
+        save_user_characters(self.characters)
+        self._reload_character_boxes()
+        self.statusBar().showMessage(f"Tags for {name}: {', '.join(self.characters.tags_of(name))}", 4000)
+
+    # Hot reload of the watched files (see __init__)
+    def _check_watched_files(self):
+        # Debounced: queue the files whose signature moved; the app's own writes only update it
+        watching = set(self._file_watcher.files())
+        for path in self._watched:
+            if path not in watching and os.path.exists(path):
+                self._file_watcher.addPath(path)
+            sig = file_signature(path)
+            if sig == self._watch_sigs.get(path):
                 continue
-            seen.add(key)
-            base = lut.get(key)
-            if base:
-                objs.append({"name": base["name"], "category": base.get("category") or "Base"})
-            else:
-                objs.append({"name": name, "category": "Base"})
-        self._character_objs = objs
+            self._watch_sigs[path] = sig
+            if sig is not None and not is_own_write(path):
+                self._reload_pending.add(path)
+        self._start_file_reload()
+
+    def _start_file_reload(self):
+        # One parse at a time; the next queued file starts when it finishes
+        w = self._reload_worker
+        if not self._reload_pending or (w is not None and w.isRunning()):
+            return
+        path = self._reload_pending.pop()
+        kind = self._watched[path]
+        w = self._reload_worker = LibraryTransferWorker(self._reload_job(kind, path), self)
+        w.done.connect(lambda res, k=kind, p=path: self._apply_file_reload(k, p, res))
+        w.failed.connect(lambda msg, p=path: self.statusBar().showMessage(
+            f"{os.path.basename(p)} changed but could not be read ({msg}); keeping the loaded copy.", 5000))
+        w.finished.connect(lambda w=w: self._reload_worker is w and setattr(self, "_reload_worker", None))
+        w.finished.connect(w.deleteLater)
+        w.finished.connect(self._start_file_reload)
+        w.start()
+
+    def _reload_job(self, kind, path):
+        # Runs in the worker: parse, and for prompts also diff against a copy taken now
+        if kind == "prompts":
+            current = [dict(o) for o in self.prompt_repo]  # the repository edits its dicts in place
+            pending = self.prompt_journal.pending()
+            seq = self.prompt_journal.seq
+
+            def job(progress, should_stop):
+                # Ops not yet in the snapshot are replayed on the new file, so local edits survive
+                repo = PromptRepository(read_user_list(path, "prompts"))
+                migrated = repo.migrated
+                for r in pending:
+                    apply_prompt_op(repo, r)
+                target = repo.to_list()
+                ops = prompt_diff_ops(current, target)
+                return {"seq": seq, "rewrite": bool(pending) or migrated, "ops": ops,
+                        "items": target if len(ops) > PromptJournal.RESET_MAX_ITEMS else None}
+        elif kind == "characters":
+            defs = self.cfg.get("characters", [])
+
+            def job(progress, should_stop):
+                return CharacterRepository(defs, read_user_list(path, "characters")).sort()
+        elif kind == "config":
+            def job(progress, should_stop):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                return data if isinstance(data, dict) else {}
+        else:
+            def job(progress, should_stop):
+                return read_user_list(path, kind)
+        return job
+
+    def _apply_file_reload(self, kind, path, res):
+        try:
+            n = getattr(self, f"_reload_{kind}")(res)
+        except Exception as e:
+            self.statusBar().showMessage(f"Reloading {os.path.basename(path)} failed: {e}", 5000)
+            return
+        if n:
+            self.statusBar().showMessage(f"{os.path.basename(path)} changed on disk: {n} change(s) applied.", 4000)
+
+    def _reload_prompts(self, res):
+        if self.prompt_journal.seq != res["seq"]:
+            self._reload_pending.add(USER_PROMPTS_PATH)  # edited meanwhile: diff again
+            return 0
+        ops = res["ops"]
+        if res.get("items") is not None:
+            # Bulk change (e.g. a replaced library): one reset op and a snapshot, like an import
+            cur = self.promptList.currentItem()
+            pid = (cur.data(Qt.ItemDataRole.UserRole) or {}).get("id") if cur is not None else None
+            before = self.prompt_repo.to_list()
+            self.prompt_repo.replace_all(res["items"])
+            self._log_prompt_reset(before)
+            self.refresh_prompts_list()
+            if pid:
+                self._reselect_prompt(pid)
+            return len(ops)
+        if ops:
+            for op in ops:
+                apply_prompt_op(self.prompt_repo, op)
+            self._log_prompt_ops(ops)  # one undo step, versions recorded
+            self._patch_prompts_list({op["id"] for op in ops if op["op"] == "edit"})
+            self.update_prompt_preview()
+        if res["rewrite"]:
+            self._save_prompts()  # local ops (or fresh ids) on top of the new file
+        elif ops:
+            self.prompt_journal.rebase()  # the file already holds these ops
+        return len(ops)
+
+    def _reload_sites(self, items):
+        items = [s for s in items if isinstance(s, dict)]
+        if items == self.user_sites:
+            return 0
+        old = {self._site_key(s): s for s in self.user_sites}
+        new = {self._site_key(s): s for s in items}
+        n = len(old.keys() ^ new.keys()) + sum(1 for k in old.keys() & new.keys() if old[k] != new[k])
+        self.user_sites = items
+        self._patch_sites_list()
+        self._apply_ua_rules()
+        return n or 1
+
+    def _reload_mail_sites(self, urls):
+        urls = [str(u) for u in urls if u]
+        if urls == self.user_mail_sites:
+            return 0
+        n = len(set(urls) ^ set(self.user_mail_sites))
+        self.user_mail_sites = urls
+        self._build_mail_sites_menu(self.m_mail_sites)
+        return n or 1
+
+    def _reload_characters(self, repo):
+        if repo.to_list() == self.characters.to_list():
+            return 0
+        n = len(set(repo.names()) ^ set(self.characters.names())) or 1
+        self.characters = repo
+        self._reload_character_boxes()
+        return n
+
+    def _reload_config(self, cfg):
+        # Library defaults and other top-level keys are taken as they are; of "window"/"ui"
+        # (which this window keeps changing) only the hotkeys are picked up
+        changed = [k for k, v in cfg.items() if k not in ("window", "ui") and self.cfg.get(k) != v]
+        for k in changed:
+            self.cfg[k] = cfg[k]
+        hotkeys = (cfg.get("ui") or {}).get("hotkeys") if isinstance(cfg.get("ui"), dict) else None
+        ui = self.cfg.setdefault("ui", {})
+        if isinstance(hotkeys, dict) and hotkeys != ui.get("hotkeys"):
+            ui["hotkeys"] = hotkeys
+            self._apply_hotkeys(hotkeys)
+            changed.append("ui.hotkeys")
+        if "characters" in changed:
+            self.characters = CharacterRepository(self.cfg.get("characters", []), self.characters.to_list()).sort()
+            self._reload_character_boxes()
+        return len(changed)
+
+    def _patch_prompts_list(self, changed=()):
+        entries = [(o.get("id"), o) for o in self._visible_prompt_objs()]
+        self._sync_list_items(self.promptList, self._prompt_items, entries,
+                              self._new_prompt_item, lambda it, o: self._update_prompt_item(o), changed)
+
+    def _patch_sites_list(self):
+        entries = [(self._site_key(s), s) for s in self._sorted_sites()]
+        if len({k for k, _ in entries}) != len(entries):
+            self.refresh_sites_list()  # duplicate bases: only the full rebuild shows them all
+            return
+
+        def update(it, site):
+            it.setData(Qt.ItemDataRole.UserRole, site)
+            self._update_site_item(it)
+        self._sync_list_items(self.listw, self._site_items, entries, self._new_site_item, update)
+
+    def _sync_list_items(self, listw, items, entries, make_item, update_item, changed=()):
+        # Make listw show entries ((key, obj) in order) reusing its items (key -> item, kept in
+        # step) and updating them in place (objects that differ, or keys in changed). Rows are
+        # removed/inserted one by one when the kept rows stay in order, else all rows are taken
+        # out and put back; both are O(n). The current item and the scroll position survive.
+        cur = listw.currentItem()
+        bar = listw.verticalScrollBar()
+        pos = bar.value()
+        want = dict(entries)
+        key_of = {id(it): k for k, it in items.items()}
+        order = [key_of.get(id(listw.item(r))) for r in range(listw.count())]
+        in_order = [k for k in order if k in want] == [k for k, _ in entries if k in items]
+        for key in [k for k in items if k not in want]:
+            del items[key]
+        listw.blockSignals(True)
+        listw.setUpdatesEnabled(False)
+        try:
+            for r in range(len(order) - 1, -1, -1):
+                if not in_order or order[r] not in want:
+                    listw.takeItem(r)
+            for i, (key, obj) in enumerate(entries):
+                it = items.get(key)
+                if it is None:
+                    it = items[key] = make_item(obj)
+                elif key in changed or it.data(Qt.ItemDataRole.UserRole) != obj:
+                    update_item(it, obj)
+                    if in_order:
+                        continue
+                elif in_order:
+                    continue
+                listw.insertItem(i, it)
+            if cur is not None and listw.row(cur) >= 0:
+                listw.setCurrentItem(cur)
+        finally:
+            listw.setUpdatesEnabled(True)
+            listw.blockSignals(False)
+        bar.setValue(pos)
 
     def _reload_character_boxes(self):
         p1 = self.character1Box.currentText() if self.character1Box.currentIndex() > 0 else None
@@ -2355,19 +8591,13 @@ class Main(QMainWindow):
         p3 = self.character3Box.currentText() if self.character3Box.currentIndex() > 0 else None
         p4 = self.character4Box.currentText() if self.character4Box.currentIndex() > 0 else None
 
-        # Ensure character objects are up to date
-        try:
-            self._rebuild_character_objects()
-        except Exception:
-            self._character_objs = []
-
-        objs = getattr(self, "_character_objs", []) or []
+        chars = self.characters
 
         # Update character category combo
         selected_cat = "Show All"
         if hasattr(self, "characterCategoryBox"):
             cur = self.characterCategoryBox.currentText() if self.characterCategoryBox.currentIndex() >= 0 else "Show All"
-            cats = _extract_categories(objs)
+            cats = chars.categories()
             self.characterCategoryBox.blockSignals(True)
             self.characterCategoryBox.clear()
             self.characterCategoryBox.addItem("Show All")
@@ -2378,12 +8608,37 @@ class Main(QMainWindow):
             self.characterCategoryBox.blockSignals(False)
             selected_cat = self.characterCategoryBox.currentText() or "Show All"
 
-        # Build visible names based on selected category
+        # Visible names: category AND tag query AND facets, as one bitset
+        mask = None
         if selected_cat != "Show All":
-            names = [o.get("name", "") for o in objs if (o.get("category") or "Base") == selected_cat]
-        else:
-            names = [o.get("name", "") for o in objs]
-        names = [n for n in names if n]
+            mask = chars.tag_mask(selected_cat)
+        edit = getattr(self, "characterQueryEdit", None)
+        query = edit.text().strip() if edit is not None else ""
+        if query:
+            try:
+                qm = chars.query(query)
+                mask = qm if mask is None else mask & qm
+                edit.setStyleSheet(""); edit.setToolTip("")
+            except ValueError as e:
+                edit.setStyleSheet("color: #c0392b;"); edit.setToolTip(f"Ignored: {e}")
+        for tag, state in self._character_facet_states().items():
+            if state == Qt.CheckState.Checked:
+                mask = chars.tag_mask(tag) if mask is None else mask & chars.tag_mask(tag)
+            elif state == Qt.CheckState.PartiallyChecked:
+                mask = (chars.all_mask() if mask is None else mask) & ~chars.tag_mask(tag)
+        names = chars.names() if mask is None else chars.names_for(mask)
+        self._refresh_character_facets(chars.all_mask() if mask is None else mask)
+
+        try:
+            groups = chars.groups()
+            if mask is None or (not query and selected_cat != "Show All" and not self._character_facet_states()):
+                self._character_group = None if selected_cat == "Show All" else selected_cat
+            else:
+                self._character_group = ("filter",)
+                groups[self._character_group] = names
+            self._character_picker.set_groups(groups)
+        except Exception:
+            pass
 
         # Repopulate combo boxes
         for box in (self.character1Box, self.character2Box, self.character3Box, self.character4Box):
@@ -2417,9 +8672,60 @@ class Main(QMainWindow):
             self.cfg["window"]["width"] = self.width()
             self.cfg["window"]["height"] = self.height()
             self.cfg["window"]["orientation"] = "vertical" if self.contentSplit.orientation()==Qt.Orientation.Vertical else "horizontal"
-            label = next((k for k,v in PRESET_UAS.items() if v==self.current_ua), "Custom")
+            label = self.ua_library.label_for(self.current_ua, "Custom")
             self.cfg["window"]["user_agent"] = label if label!="Custom" else self.current_ua
+            for i in range(self.leftTabs.count()):
+                w = self.leftTabs.widget(i)
+                if isinstance(w, QWebEngineView):
+                    self._remember_scroll(w)
+            self._cfg_save_timer.stop()
             save_config(self.cfg)
+            if self.prompt_journal.pending():
+                self._save_prompts()  # compact: fold the journaled ops into the snapshot
+            if self.prompt_history is not None:
+                self.prompt_history.close()
+            uw = getattr(self, "_update_worker", None)
+            if uw is not None and uw.isRunning():
+                uw.requestInterruption()  # partial download is kept and resumed next time
+                uw.wait(3000)
+            tw = getattr(self, "_transfer_worker", None)
+            if tw is not None:
+                tw.requestInterruption()  # writes go through .part files, nothing is half-written
+                tw.wait(5000)
+            rw = getattr(self, "_reload_worker", None)
+            if rw is not None:
+                self._file_watcher.removePaths(self._file_watcher.files() + self._file_watcher.directories())
+                rw.wait(3000)  # parse only; its result is dropped
+            try:
+                if self.placeholders.dirty:
+                    self.placeholders.save()
+            except Exception:
+                pass
+            try:
+                if self.analytics is not None:
+                    self.analytics.close()
+            except Exception:
+                pass
+            try:
+                if self.api_server is not None:
+                    self.api_server.stop()
+            except Exception:
+                pass
+            try:
+                self.save_session_now()
+            except Exception:
+                pass
+            try:
+                if self.perf_stats.dirty:
+                    self.perf_stats.save()
+            except Exception:
+                pass
+            try:
+                self.asset_handler.shutdown()
+                if self.asset_cache.dirty:
+                    self.asset_cache.save()
+            except Exception:
+                pass
             try:
                 self.save_splitter_sizes()
             except Exception:
@@ -2434,142 +8740,48 @@ class Main(QMainWindow):
             QMessageBox.information(self, "Remove Prompt", "Select a prompt first.")
             return
         obj = item.data(Qt.ItemDataRole.UserRole)
-        def _same(p):
-            if isinstance(p, dict) and isinstance(obj, dict):
-                return p.get('id') == obj.get('id') or p.get('text') == obj.get('text')
-            elif isinstance(p, str) and isinstance(obj, dict):
-                return p == obj.get('text')
-            elif isinstance(p, dict) and isinstance(obj, str):
-                return p.get('text') == obj
-            else:
-                return p == obj
-        self.user_prompts = [p for p in self.user_prompts if not _same(p)]
-        save_user_prompts(self.user_prompts)
-        self.refresh_prompts_list()
+        pid = obj.get("id") if isinstance(obj, dict) else None
+        pos = self.prompt_repo.index_of(pid) if pid else None
+        gone = self.prompt_repo.remove(pid) if pid else None
+        if gone is None:
+            QMessageBox.information(self, "Remove Prompt", "Could not locate the prompt to remove.")
+            return
+        self._log_prompt_ops([{"op": "remove", "id": pid, "pos": pos, "before": dict(gone)}])
+        self._prompt_items.pop(pid, None)
+        self.promptList.takeItem(self.promptList.row(item))
+        self._prompt_picker.discard(pid)
         self.statusBar().showMessage("Prompt removed.", 3000)
 
     def _apply_pending_tmp_updates(self):
-        # At startup, apply updates only if BOTH .tmp files exist; otherwise discard and warn.
-
+        # At startup, swap in a staged update (see apply_pending_update); an incomplete or
+        # unverifiable set is discarded with a warning.
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        py_name  = "sora2-browser-tool.py"
-        py_dst   = os.path.join(base_dir, py_name)
-        json_dst = os.path.join(base_dir, "sora2_config.json")
-        py_tmp   = os.path.join(base_dir, py_name + '.tmp')
-        json_tmp = os.path.join(base_dir, "sora2_config.json.tmp")
-
-        has_py_tmp   = os.path.exists(py_tmp)
-        has_json_tmp = os.path.exists(json_tmp)
-
-        # Nothing to do
-        if not has_py_tmp and not has_json_tmp:
-            return
-
-        # Incomplete update -> discard and warn
-        if not (has_py_tmp and has_json_tmp):
-            try:
-                if has_py_tmp: os.remove(py_tmp)
-            except Exception:
-                pass
-            try:
-                if has_json_tmp: os.remove(json_tmp)
-            except Exception:
-                pass
+        res = apply_pending_update(base_dir)
+        if res == "discarded":
             try:
                 QMessageBox.warning(self, "Update Error",
                                     "An incomplete update was detected and has been discarded.\nPlease run 'Check For Updates' again.")
             except Exception:
                 pass
-            return
-
-        # Both .tmp exist -> attempt atomic replace now
-        def try_swap():
-            ok = True
-            try:
-                os.replace(json_tmp, json_dst)  # JSON first
-            except Exception:
-                ok = False
-            try:
-                os.replace(py_tmp, py_dst)      # then PY
-            except Exception:
-                ok = False
-            return ok
-
-        if try_swap():
-            return
-            
-        # Force helper to finish update on exit
-        try:
-            tmp_dir = tempfile.gettempdir()
-            helper_path = os.path.join(tmp_dir, "sora2_apply_update.py")
-            with open(helper_path, "w", encoding="utf-8") as f:
-                f.write(helper_code)
-            try:
-                QProcess.startDetached(sys.executable, [helper_path])
-            except Exception:
-                import subprocess
-                try:
-                    subprocess.Popen([sys.executable, helper_path],
-                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
-                except Exception:
-                    pass
-        except Exception:
-            pass
-            
-        # Exit so helper can apply update
-        try:
-            sys.exit(0)
-        except Exception:
-            pass
-
-
-        # If replacing PY fails, write a helper that will finish after app exits
-        helper_code = (
-            "# -*- coding: utf-8 -*-\n"
-            "import os, sys, time\n"
-            "base_dir = " + repr(base_dir) + "\n"
-            "py_name  = " + repr(py_name) + "\n"
-            "py_dst   = os.path.join(base_dir, py_name)\n"
-            "json_dst = os.path.join(base_dir, 'sora2_config.json')\n"
-            "py_tmp   = os.path.join(base_dir, py_name + '.tmp')\n"
-            "json_tmp = os.path.join(base_dir, 'sora2_config.json.tmp')\n"
-            "for _ in range(600):\n"
-            "    done = True\n"
-            "    try:\n"
-            "        if os.path.exists(json_tmp): os.replace(json_tmp, json_dst)\n"
-            "    except Exception:\n"
-            "        done = False\n"
-            "    try:\n"
-            "        if os.path.exists(py_tmp): os.replace(py_tmp, py_dst)\n"
-            "    except Exception:\n"
-            "        done = False\n"
-            "    if done: break\n"
-            "    time.sleep(0.1)\n"
-        )
-
-        try:
-            tmp_dir = tempfile.gettempdir()
-            helper_path = os.path.join(tmp_dir, "sora2_apply_update.py")
-            with open(helper_path, "w", encoding="utf-8") as f:
-                f.write(helper_code)
-                
-            # Launch helper detached; it will finish the swap when the app is closed
+        elif res == "deferred":
+            # A file is locked: let a detached copy of the CLI finish the swap after we exit
+            script = os.path.abspath(__file__)
+            cmd = [script, "--cli", "update", "--apply", "--wait", "120"]
             try:
-                QProcess.startDetached(sys.executable, [helper_path])
+                if not QProcess.startDetached(sys.executable, cmd):
+                    raise OSError("startDetached failed")
             except Exception:
                 import subprocess
                 try:
-                    subprocess.Popen([sys.executable, helper_path],
-                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+                    subprocess.Popen([sys.executable] + cmd, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
                 except Exception:
-                    pass
+                    return
             try:
-                self.statusBar().showMessage("Update staged. It will finish when you close the app.", 5000)
+                QMessageBox.information(self, "Update", "Finishing the update. Please start the app again in a moment.")
             except Exception:
                 pass
-        except Exception:
-            # Ignore if helper creation fails; user can retry update.
-            return
+            sys.exit(0)
 
     def clear_site_data(self):
         # Clear all site data (cookies, cache, local/session storage, indexedDB) and reload views.
@@ -2669,84 +8881,91 @@ class Main(QMainWindow):
         except Exception:
             pass
                 
+    # Updates (background; see run_update). ui.update_url overrides the GitHub raw base URL.
     def check_for_updates(self):
-        # Check GitHub JSON for a newer version; if present, download .tmp files into script dir.
-        REMOTE_JSON = "https://raw.githubusercontent.com/esc0rtd3w/sora2-browser-tool/refs/heads/main/sora2_config.json"
-        REMOTE_PY   = "https://raw.githubusercontent.com/esc0rtd3w/sora2-browser-tool/refs/heads/main/sora2-browser-tool.py"
-
-        def _ver_tuple(v):
-            # extract all ints; fallback [0] if nothing
-            return tuple(int(x) for x in re.findall(r"\d+", str(v)) or [0])
-
-        try:
-            # Fetch remote config + version
-            with urllib.request.urlopen(REMOTE_JSON, timeout=15) as r:
-                remote_cfg = json.loads(r.read().decode("utf-8", "ignore"))
-            remote_ver = remote_cfg.get("version", "0.0.0")
-            local_ver  = (self.cfg or {}).get("version", "0.0.0")
-
-            # Already up to date
-            if _ver_tuple(remote_ver) <= _ver_tuple(local_ver):
-                QMessageBox.information(
-                    self,
-                    "Check For Updates",
-                    f"You're up to date.\n\nLocal: {local_ver}\nRemote: {remote_ver}",
-                )
-                return
+        w = getattr(self, "_update_worker", None)
+        if w is not None and w.isRunning():
+            self.statusBar().showMessage("Update check already running…", 3000)
+            return
+        self._start_update_worker(check_only=True)
+
+    def _start_update_worker(self, check_only):
+        ui_cfg = self.cfg.get("ui") if isinstance(self.cfg.get("ui"), dict) else {}
+        url = ui_cfg.get("update_url") or UPDATE_BASE_URL
+        w = self._update_worker = UpdateWorker(url, (self.cfg or {}).get("version", "0.0.0"), check_only, parent=self)
+        w.progress.connect(self._update_progress)
+        w.done.connect(self._update_done)
+        w.failed.connect(self._update_failed)
+        w.finished.connect(self._update_bar_hide)
+        self.statusBar().showMessage("Checking for updates…" if check_only else "Downloading update…")
+        w.start()
+
+    def _update_progress(self, name, done, total):
+        bar = getattr(self, "updateProgress", None)
+        if bar is None:
+            bar = self.updateProgress = QProgressBar()
+            bar.setMaximumWidth(160)
+            bar.setTextVisible(True)
+            self.statusBar().addPermanentWidget(bar)
+        bar.setRange(0, 100 if total else 0)
+        if total:
+            bar.setValue(min(100, done * 100 // total))
+        bar.setFormat(f"{name} %p%")
+        bar.show()
+        self.statusBar().showMessage(f"Downloading {name}: {done // 1024} KB" + (f" of {total // 1024} KB" if total else ""))
+
+    def _update_bar_hide(self):
+        bar = getattr(self, "updateProgress", None)
+        if bar is not None:
+            bar.hide()
+
+    def _update_failed(self, msg):
+        self.statusBar().clearMessage()
+        if msg == "cancelled":
+            return
+        QMessageBox.critical(self, "Update Error", f"Failed to update:\n{msg}")
 
-            # Ask to download
+    def _update_done(self, res):
+        self.statusBar().clearMessage()
+        if res.get("status") == "uptodate":
+            QMessageBox.information(
+                self,
+                "Check For Updates",
+                f"You're up to date.\n\nLocal: {res['local']}\nRemote: {res['version']}",
+            )
+        elif res.get("status") == "available":
+            size = f" ({res['bytes'] // 1024} KB)" if res.get("bytes") else ""
             resp = QMessageBox.question(
                 self,
                 "Update Available",
                 (
                     f"A new version is available.\n\n"
-                    f"Current: {local_ver}\n"
-                    f"Available: {remote_ver}\n\n"
+                    f"Current: {res['local']}\n"
+                    f"Available: {res['version']}\n"
+                    f"Files: {', '.join(res['files'])}{size}\n\n"
                     f"Download now?"
                 ),
                 QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                 QMessageBox.StandardButton.Yes,
             )
-            if resp != QMessageBox.StandardButton.Yes:
-                return
-
-            # Ask whether to auto-close after download
+            if resp == QMessageBox.StandardButton.Yes:
+                self._start_update_worker(check_only=False)
+        elif res.get("status") == "staged":
             auto_close = QMessageBox.question(
                 self,
-                "Close After Download?",
-                "Automatically close the app after the update files finish downloading? (Recommended)",
+                "Update Downloaded",
+                f"Version {res['version']} is downloaded and verified.\n\n"
+                "Close the app now? The update applies on the next launch. (Recommended)",
                 QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                 QMessageBox.StandardButton.Yes,
             ) == QMessageBox.StandardButton.Yes
-
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            py_tmp   = os.path.join(base_dir, "sora2-browser-tool.py.tmp")
-            json_tmp = os.path.join(base_dir, "sora2_config.json.tmp")
-
-            # Download new files as .tmp
-            urllib.request.urlretrieve(REMOTE_PY, py_tmp)
-            with open(json_tmp, "w", encoding="utf-8") as f:
-                json.dump(remote_cfg, f, indent=2, ensure_ascii=False)
-
             if auto_close:
-                QMessageBox.information(
-                    self,
-                    "Update Downloaded",
-                    "Update files downloaded.\n\n"
-                    "The app will close now. Relaunch to finish applying the update.",
-                )
                 QApplication.instance().quit()
             else:
-                QMessageBox.information(
-                    self,
-                    "Update Downloaded",
-                    "Update files downloaded.\n\n"
-                    "On next launch, the update will apply automatically.",
-                )
-        except Exception as e:
-            QMessageBox.critical(self, "Update Error", f"Failed to update:\n{e}")
+                self.statusBar().showMessage("Update staged; it applies on the next launch.", 5000)
 
 def main():
+    _register_asset_scheme()
     app = QApplication(sys.argv)
     w = Main(); w.show()
     sys.exit(app.exec())